@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import os
+import csv
+import time
+import datetime
+import logging
+
+import sqlalchemy
+
+from pysilhouette.db.model import JOBGROUP_STATUS, JOB_OUTPUT_COLUMNS
+from pysilhouette.util import is_empty
+from pysilhouette.spool import read_output, remove_output
+
+#: archive.mode
+#:  - archive : Move the rows into the jobgroup_archive and job_archive tables.
+#:  - export : Write the rows to CSV files in archive.export.path, one per table
+#:              and batch, and delete them.
+ARCHIVE_MODES = ('off', 'archive', 'export')
+
+#: Jobgroup status which do not change any more.
+FINISHED_STATUS = (JOBGROUP_STATUS['OK'],
+                   JOBGROUP_STATUS['NG'],
+                   JOBGROUP_STATUS['APPERR'],
+                   )
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+def export_rows(export_dir, table, rows, batch):
+    """Write the rows to <export_dir>/<table>.<batch>.csv, the column names
+    first. The file is written under a temporary name and renamed, so a
+    batch exported again (its commit failed) replaces it.
+    @param batch: Jobgroup ids of the batch. ("<first>-<last>")
+    @type batch: str
+    """
+    path = os.path.join(export_dir, '%s.%s.csv' % (table.name, batch))
+    names = [c.name for c in table.columns]
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    fp = open(tmp, 'wb')
+    try:
+        writer = csv.writer(fp)
+        writer.writerow(names)
+        for row in rows:
+            writer.writerow([_csv_value(row[name]) for name in names])
+        fp.flush()
+        os.fsync(fp.fileno())
+    finally:
+        fp.close()
+    os.rename(tmp, path)
+    return path
+
+def _inline_spool(row, spools):
+    """Job row with the spooled output read back into the output columns.
+    The spool paths are appended to "spools" and cleared in the row.
+    """
+    value = dict(row.items())
+    for name in JOB_OUTPUT_COLUMNS:
+        path = value['%s_spool' % name]
+        if is_empty(path) is False:
+            if os.path.isfile(path):
+                value[name] = read_output(path)
+            value['%s_spool' % name] = None
+            spools.append(path)
+    return value
+
+def archive_batch(metadata, before, limit, mode, export_dir=None):
+    """Move up to "limit" finished jobgroups modified before "before", with
+    their jobs, out of the jobgroup/job tables in one transaction.
+    (A batch which failed to commit is moved again by the next run.)
+    The archived jobs keep their spool files, psil-cleandb removes them with
+    the archive tables. An export writes the spooled output into the CSV
+    file, the spool files are removed after the commit.
+    @param metadata: MetaData after reload_mappers.
+    @type metadata: sqlalchemy.schema.MetaData
+    @type before: datetime.datetime
+    @return: Number of the jobgroups moved.
+    @rtype: int
+    """
+    logger = logging.getLogger('pysilhouette.archive')
+    t_jobgroup = metadata.tables['jobgroup']
+    t_job = metadata.tables['job']
+    t_job_output = metadata.tables['job_output']
+    now = datetime.datetime.now()
+
+    spools = []
+    conn = metadata.bind.connect()
+    try:
+        trans = conn.begin()
+        try:
+            jg_rows = conn.execute(t_jobgroup.select(sqlalchemy.and_(
+                t_jobgroup.c.status.in_(FINISHED_STATUS),
+                t_jobgroup.c.modified < before)).order_by(
+                t_jobgroup.c.id.asc()).limit(limit)).fetchall()
+            if not jg_rows:
+                trans.rollback()
+                return 0
+
+            jg_ids = [row['id'] for row in jg_rows]
+            job_rows = conn.execute(t_job.select(
+                t_job.c.jobgroup_id.in_(jg_ids))).fetchall()
+
+            if mode == 'archive':
+                t_jobgroup_archive = metadata.tables['jobgroup_archive']
+                t_job_archive = metadata.tables['job_archive']
+                values = []
+                for row in jg_rows:
+                    value = dict(row.items())
+                    value['archived'] = now
+                    values.append(value)
+                conn.execute(t_jobgroup_archive.insert(), values)
+                if job_rows:
+                    values = []
+                    for row in job_rows:
+                        value = dict(row.items())
+                        value['archived'] = now
+                        values.append(value)
+                    conn.execute(t_job_archive.insert(), values)
+
+            elif mode == 'export':
+                values = []
+                for row in job_rows:
+                    values.append(_inline_spool(row, spools))
+                batch = '%d-%d' % (jg_ids[0], jg_ids[-1])
+                export_rows(export_dir, t_jobgroup, jg_rows, batch)
+                export_rows(export_dir, t_job, values, batch)
+
+            else:
+                raise ValueError('Unknown archive mode. - mode=%s' % mode)
+
+            jobs = sqlalchemy.select([t_job.c.id], t_job.c.jobgroup_id.in_(jg_ids))
+            conn.execute(t_job_output.delete(t_job_output.c.job_id.in_(jobs)))
+            conn.execute(t_job.delete(t_job.c.jobgroup_id.in_(jg_ids)))
+            conn.execute(t_jobgroup.delete(t_jobgroup.c.id.in_(jg_ids)))
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+    finally:
+        conn.close()
+
+    for path in spools:
+        remove_output(path)
+
+    logger.info('Archived the jobgroups. - mode=%s, jobgroup_id=%d..%d, jobgroup_num=%d, job_num=%d'
+                % (mode, jg_ids[0], jg_ids[-1], len(jg_ids), len(job_rows)))
+    return len(jg_ids)
+
+def archive(metadata, mode, age, limit, export_dir=None, wait=0):
+    """Move the jobgroups finished more than "age" days ago, batch by batch.
+    @param limit: Jobgroups in one transaction.
+    @type limit: int
+    @param wait: Seconds to sleep between the transactions, lets the
+                 performers at the database.
+    @type wait: float
+    @return: Number of the jobgroups moved.
+    @rtype: int
+    """
+    before = datetime.datetime.now() - datetime.timedelta(days=age)
+    ret = 0
+    while True:
+        num = archive_batch(metadata, before, limit, mode, export_dir)
+        ret += num
+        if num < limit:
+            break
+        if 0 < wait:
+            time.sleep(wait)
+    return ret
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import os
+import sys
+import time
+import signal
+import traceback
+import logging
+
+from pysilhouette import PROCERROR, PROCSUCCESS
+from pysilhouette.er import ER
+from pysilhouette.db import create_database
+from pysilhouette.log import reload_conf
+from pysilhouette.prep import readconf, getopts, chkopts, parse_conf
+from pysilhouette.archive import archive
+
+stop = False #: Set by SIGTERM
+
+class Archiver(ER):
+    """Archiver Class
+    Moves the finished jobgroups out of the jobgroup/job tables every
+    archive.interval seconds. (See pysilhouette.archive)
+    """
+    def __init__(self, opts, cf):
+        ER.__init__(self, opts, cf)
+        self._setdaemon()
+        self.db = create_database(cf)
+
+    def process(self):
+        self.logger.info('archiver : [started]')
+        if self.cf['archive.mode'] == 'off':
+            self.logger.warning('archive.mode is off, nothing to do.')
+            return PROCSUCCESS
+
+        while stop is False:
+            try:
+                num = archive(self.db.get_metadata(),
+                              self.cf['archive.mode'],
+                              self.cf['archive.age'],
+                              self.cf['archive.batch.size'],
+                              self.cf['archive.export.path'],
+                              self.cf['archive.batch.wait'])
+                self.logger.info('Activity Information. - [mode=%s, jobgroup_num=%d]'
+                                 % (self.cf['archive.mode'], num))
+            except Exception, e:
+                self.logger.error('Failed to archive the job groups. - %s' % str(e.args))
+                t_logger = logging.getLogger('pysilhouette_traceback')
+                t_logger.error(traceback.format_exc())
+
+            if stop is False:
+                self.logger.debug('interval start, interval=%s' % (self.cf['archive.interval']))
+                time.sleep(self.cf['archive.interval'])
+
+        return PROCSUCCESS # When ending with the signal
+
+def sigterm_handler(signum, frame):
+    global stop
+    stop = True
+    logger = logging.getLogger('pysilhouette.archiver.signal')
+    logger.warning('Stop the archiverd with signal- pid=%s, signal=%s' % (os.getpid(), signum))
+
+def main():
+    (opts, args) = getopts()
+    if chkopts(opts) is True:
+        return PROCERROR
+
+    cf = readconf(opts.config)
+    if cf is None:
+        print >>sys.stderr, 'Failed to load the config file "%s". (%s)' % (opts.config, sys.argv[0])
+        return PROCERROR
+
+    # conf parse
+    if parse_conf(cf) is False:
+        return PROCERROR
+
+    if reload_conf(cf["env.sys.log.conf.path"]):
+        logger = logging.getLogger('pysilhouette.archiver')
+    else:
+        print >>sys.stderr, 'Failed to load the log file. (%s)' % sys.argv[0]
+        return PROCERROR
+
+    try:
+        try:
+            signal.signal(signal.SIGTERM, sigterm_handler)
+            archiver = Archiver(opts, cf)
+            ret = archiver.process() # start!!
+            return ret
+        except KeyboardInterrupt, k:
+            logger.critical('Keyboard interrupt occurred. - %s' % str(k.args))
+            print >>sys.stderr, 'Keyboard interrupt occurred. - %s' % str(k.args)
+        except Exception, e:
+            logger.critical('A system error has occurred. - %s' % str(e.args))
+            print >>sys.stderr, 'A system error has occurred. - %s' % str(e.args)
+            print >>sys.stderr, traceback.format_exc()
+            t_logger = logging.getLogger('pysilhouette_traceback')
+            t_logger.critical(traceback.format_exc())
+
+    finally:
+        if opts.daemon is True and os.path.isfile(opts.pidfile):
+            os.unlink(opts.pidfile)
+            logger.warning('Process file has been deleted.. - pidfile=%s' % opts.pidfile)
+
+    return PROCERROR
+
+if __name__ == '__main__':
+    sys.exit(main())
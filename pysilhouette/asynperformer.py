@@ -32,16 +32,21 @@ import os
 import logging
 import traceback
 import signal
-import Queue
+import datetime
 
 from pysilhouette import PROCERROR, PROCSUCCESS
 from pysilhouette.log import reload_conf
 from pysilhouette.prep import readconf, getopts, chkopts, parse_conf
 from pysilhouette.db.model import JOBGROUP_STATUS, JOBGROUP_TYPE
-from pysilhouette.db.access import jobgroup_findbytype_limit_status, jobgroup_update
+from pysilhouette.db.access import jobgroup_findbytype_limit_status, jobgroup_update, jobgroup_age, jobgroup_next_run_after, \
+     jobgroup_findbytype_key_limit_status, jobgroup_countbytype_status
 from pysilhouette.er import ER
-from pysilhouette.worker import ThreadQueue, ThreadWorker, dummy_set_job
+from pysilhouette.worker import WorkerPool, ProcessPool, dummy_set_job
 from pysilhouette.db import create_database, Database
+from pysilhouette.wakeup import WakeupChannel, notify
+from pysilhouette.reactor import ReactorPool
+from pysilhouette.lease import Reaper
+from pysilhouette.fairshare import FairShare
 
 # var
 asynpool = []
@@ -54,62 +59,160 @@ class AsynPerformer(ER):
         self._fifo('asynperformer')
         self._setdaemon()
         self.db = create_database(cf)
+        self.channel = WakeupChannel(self.cf, 'asynperformer')
+        self.reaper = Reaper(self.cf, self.db, JOBGROUP_TYPE['PARALLEL'])
+        self.fair = FairShare(self.cf, 'asynperformer')
+        self.uniq_key = unicode(self.cf['env.uniqkey'], 'utf-8')
 
     def process(self):
         self.logger.info('asynperformer : [started]')
 
-        # thread pool
-        request_queue = Queue.Queue()
-        #response_queue = Queue.Queue()
-        response_list = []
-        tq = ThreadQueue(request_queue, response_list)
+        # worker pool
+        if self.cf['asynperformer.executor'] == 'process':
+            global asynpool
+            pool = ProcessPool(self.cf, self.db, self.cf['asynperformer.thread.pool.size'],
+                               self._done)
+            asynpool = pool.processes # sigterm_handler
+        elif self.cf['asynperformer.executor'] == 'reactor':
+            pool = ReactorPool(self.cf, self.db, self.cf['asynperformer.thread.pool.size'],
+                               self._done)
+        else:
+            pool = WorkerPool(self.cf, self.db, self.cf['asynperformer.thread.pool.size'],
+                              self._done)
+        self.logger.info('Worker pool. - executor=%s, size=%d' \
+                         % (self.cf['asynperformer.executor'], pool.size))
 
-        while True:
-            fp = open(self.cf["asynperformer.mkfifo.path"], 'r')
+        try:
+            while True:
+                code = self.channel.next_code()
+
+                #self.logger.info('Received code from the FIFO file. - code=%s' % code)
+                if code == self.cf["asynperformer.mkfifo.stop.code"]:
+                    self.logger.warning('Received stop code from the FIFO file. - code=%s' % code)
+                    pool.stop()
+                    break
+                elif code != self.cf["asynperformer.mkfifo.start.code"]:
+                    self.logger.warning('Received illegal code from the FIFO file. - code=%s' % code)
+                    continue
+
+                self._reap()
+                self._age()
+                self._schedule()
+
+                # Pending JobGroup search
+                if pool.free() <= 0:
+                    self.channel.scanned(pool.busy()) # busy
+                    continue
+
+                free = pool.free()
+                session = self.db.get_session()
+                try:
+                    if self.fair.is_on() is True:
+                        m_jgs = self._fair_scan(session, pool)
+                    else:
+                        # The jobgroups still queued in the pool are PEND too, so they are skipped by put().
+                        m_jgs = jobgroup_findbytype_limit_status(session,
+                                                                 JOBGROUP_TYPE['PARALLEL'],
+                                                                 pool.free() + pool.busy(),
+                                                                 uniq_key=self.uniq_key)
+                finally:
+                    session.close()
+                #self.logger.info('Queued the Job Group from the database. - Number of JobGroup=%d' % len(m_jgs))
+                self.logger.info('Activity Information. - [fifo_code=%s, type=parallel, jobgroup_num=%d]' % (code, len(m_jgs)))
+                num = 0
+                for m_jg in m_jgs:
+                    try:
+                        if pool.put(m_jg.id) is True:
+                            num += 1
+                    except Exception, e:
+                        self.logger.debug('Failed to perform the job group. Exceptions are not expected. - jobgroup_id=%d : %s'
+                                     % (m_jg.id, str(e.args)))
+                        print >>sys.stderr, traceback.format_exc()
+                        t_logger = logging.getLogger('pysilhouette_traceback')
+                        t_logger.error(traceback.format_exc())
+                if num == 0:
+                    self.logger.debug('No Job Group.')
+                # The pool was filled up, more may be waiting: scan again at once.
+                self.channel.scanned(num + pool.busy(), num == free)
+        finally:
+            self.channel.close() # also on SIGTERM (SystemExit)
+
+    def _fair_scan(self, session, pool):
+        """The pending job groups to put into the pool, shared out among the
+        values of asynperformer.fair.key. (FairShare)
+        """
+        key = self.fair.key
+        pend = jobgroup_countbytype_status(session, JOBGROUP_TYPE['PARALLEL'], key,
+                                           JOBGROUP_STATUS['PEND'], self.uniq_key)
+        # RUN of all the performers sharing the database, for the caps.
+        running = jobgroup_countbytype_status(session, JOBGROUP_TYPE['PARALLEL'], key,
+                                              JOBGROUP_STATUS['RUN'], self.uniq_key)
+        candidates = {}
+        for value in pend.keys():
+            m_jgs = jobgroup_findbytype_key_limit_status(session,
+                                                         JOBGROUP_TYPE['PARALLEL'],
+                                                         key, value,
+                                                         pool.free() + pool.busy(),
+                                                         uniq_key=self.uniq_key)
+            candidates[value] = filter(lambda m_jg: pool.has(m_jg.id) is False, m_jgs)
+        return self.fair.select(candidates, pool.free(), running)
+
+    def _age(self):
+        """Raise the priority of the job groups that have been waiting for
+        asynperformer.priority.aging seconds, so that they are not starved.
+        Up to asynperformer.priority.aging.max.
+        """
+        if self.cf['asynperformer.priority.aging'] <= 0:
+            return
+        before = datetime.datetime.now() - datetime.timedelta(seconds=self.cf['asynperformer.priority.aging'])
+        try:
+            session = self.db.get_session()
             try:
-                code = fp.read()
+                num = jobgroup_age(session, JOBGROUP_TYPE['PARALLEL'], before, self.uniq_key,
+                                   self.cf['asynperformer.priority.aging.max'])
+                if 0 < num:
+                    self.logger.debug('Raised the priority of the waiting job groups. - jobgroup_num=%d' % num)
             finally:
-                fp.close()
-                
-            #self.logger.info('Received code from the FIFO file. - code=%s' % code)
+                session.close()
+        except Exception, e:
+            self.logger.error('Failed to raise the priority of the waiting job groups. - %s' % str(e.args))
+            t_logger = logging.getLogger('pysilhouette_traceback')
+            t_logger.error(traceback.format_exc())
+
+    def _schedule(self):
+        """Wake up when the next delayed job group is due. (run_after)"""
+        try:
             session = self.db.get_session()
+            try:
+                run_after = jobgroup_next_run_after(session, JOBGROUP_TYPE['PARALLEL'], self.uniq_key)
+            finally:
+                session.close()
+            if not run_after is None:
+                self.channel.wake_at(run_after)
+        except Exception, e:
+            self.logger.error('Failed to look for the delayed job groups. - %s' % str(e.args))
+            t_logger = logging.getLogger('pysilhouette_traceback')
+            t_logger.error(traceback.format_exc())
 
-            # Pending JobGroup search
-            if self.cf['asynperformer.thread.pool.size'] <= tq.now_alive():
-                continue
-                
-            m_jgs = jobgroup_findbytype_limit_status(session,
-                                                     JOBGROUP_TYPE['PARALLEL'],
-                                                     self.cf['asynperformer.thread.pool.size'] - tq.now_alive())
-
-            session.close()
-            #self.logger.info('Queued the Job Group from the database. - Number of JobGroup=%d' % len(m_jgs))
-            #self.logger.debug('filo code=%s, cf asynperformer.mkfifo.start.code=%s' % (code, self.cf["asynperformer.mkfifo.start.code"]))
-            self.logger.info('Activity Information. - [fifo_code=%s, type=serial, jobgroup_num=%d]' % (code, len(m_jgs)))
-            if code == self.cf["asynperformer.mkfifo.start.code"]:
-                if 0 < len(m_jgs):
-                    for m_jg in m_jgs:
-                        try:
-                            tq.put(ThreadWorker(self.cf, self.db, m_jg.id)) # thread worker!! start
-                        except Exception, e:
-                            self.logger.debug('Failed to perform the job group. Exceptions are not expected. - jobgroup_id=%d : %s'
-                                         % (m_jg.id, str(e.args)))
-                            print >>sys.stderr, traceback.format_exc()
-                            t_logger = logging.getLogger('pysilhouette_traceback')
-                            t_logger.error(traceback.format_exc())
-                else:
-                    self.logger.debug('No Job Group.')
-            elif code == self.cf["asynperformer.mkfifo.stop.code"]:
-                self.logger.warning('Received stop code from the FIFO file. - code=%s' % code)
-                break
-            else:
-                self.logger.warning('Received illegal code from the FIFO file. - code=%s' % code)
+    def _reap(self):
+        """Take back the job groups of killed performers. (lease.expired)"""
+        try:
+            self.reaper.reap()
+        except Exception, e:
+            self.logger.error('Failed to take back the expired job groups. - %s' % str(e.args))
+            t_logger = logging.getLogger('pysilhouette_traceback')
+            t_logger.error(traceback.format_exc())
+
+    def _done(self, jobgroup_id):
+        """Pool callback: a worker is free, claim the next jobgroup."""
+        notify(self.cf, JOBGROUP_TYPE['PARALLEL'])
 
 def sigterm_handler(signum, frame):
     logger = logging.getLogger('pysilhouette.asynperformer')
     logger.info('Stop the AsynPerformerd with signal - pid=%s, signal=%s' % (os.getpid(), signum))
     for x in asynpool :
-        os.kill(x.pid, signum)
+        if not x is None:
+            os.kill(x.pid, signum)
     sys.exit(os.getpid())
 
 def main():
@@ -36,7 +36,7 @@ import traceback
 import pysilhouette.prep
 import pysilhouette.log
 from pysilhouette.util import is_empty
-from pysilhouette.db import Database
+from pysilhouette.db import Database, sqlite_listeners
 from pysilhouette.db.model import reload_mappers
 from pysilhouette.db.access import \
      get_progress as dba_get_progress, \
@@ -103,6 +103,7 @@ class Command:
                           #assert_unicode='warn', # DEBUG
                           echo = False,
                           echo_pool = False,
+                          listeners=sqlite_listeners(self.cf),
                           )
 
             reload_mappers(self.db.get_metadata())
@@ -102,6 +102,19 @@ def observer(opts, cf):
                                 env=this_env,
                                 shell=False)
 
+    def archiver():
+        cmd = [cf['observer.target.python'], cf['observer.target.archiver']]
+        if cmd_args:
+            cmd.extend(cmd_args)
+        if opts.daemon is True:
+            cmd.extend(['-p', os.path.abspath(os.path.dirname(opts.pidfile)) + '/archiverd.pid'])
+
+        logger.debug('archiver:popen - cmd=%s' % cmd)
+        return subprocess.Popen(args=cmd,
+                                close_fds=True,
+                                env=this_env,
+                                shell=False)
+
     def status(count, status, default, force=False):
         try:
             if (force is True) or (status != count):
@@ -137,22 +150,30 @@ def observer(opts, cf):
     status_count = default_count # status
     count = default_count # now
 
-    sd = pf = None
+    sd = pf = ar = None
+    asynsd = asynpf = None
 
     pf = performer() # start!!
     logger.info('performer : [start] - pid=%s, count=%s/%s'
                  % (pf.pid, count, cf['observer.restart.count']))
-    sd = scheduler() # start!!
-    logger.info('scheduler : [start] - pid=%s, count=%s/%s'
-                 % (sd.pid, count, cf['observer.restart.count']))
+    if cf['performer.timer.interval'] <= 0: # Otherwise the performer has its own timer.
+        sd = scheduler() # start!!
+        logger.info('scheduler : [start] - pid=%s, count=%s/%s'
+                     % (sd.pid, count, cf['observer.restart.count']))
 
     asynpf = asynperformer() # start!!
     logger.info('asynperformer : [start] - pid=%s, count=%s/%s'
                  % (pf.pid, count, cf['observer.restart.count']))
 
-    asynsd = asynscheduler() # start!!
-    logger.info('asynscheduler : [start] - pid=%s, count=%s/%s'
-                 % (sd.pid, count, cf['observer.restart.count']))
+    if cf['asynperformer.timer.interval'] <= 0:
+        asynsd = asynscheduler() # start!!
+        logger.info('asynscheduler : [start] - pid=%s, count=%s/%s'
+                     % (asynsd.pid, count, cf['observer.restart.count']))
+
+    if cf['archive.mode'] != 'off':
+        ar = archiver() # start!!
+        logger.info('archiver : [start] - pid=%s, count=%s/%s'
+                     % (ar.pid, count, cf['observer.restart.count']))
 
     status(count, status_count, default_count, True)
 
@@ -174,18 +195,19 @@ def observer(opts, cf):
                              % (pf.pid, count, cf['observer.restart.count']))
 
             # Scheduler
-            if not sd.poll() is None:
-                logger.debug('return code=%d' % sd.returncode)
-                logger.info('scheduler : [stop] - pid=%s, count=%s/%s'
-                             % (sd.pid, count, cf['observer.restart.count']))
-                sd = scheduler() # restart
-                count -= 1
-                logger.info('scheduler : [start] - pid=%s, count=%s/%s'
-                                  % (sd.pid, count, cf['observer.restart.count']))
-            else:
-                simple_log.append('scheduler (running) - count=%s/%s' % (count, cf['observer.restart.count']))
-                logger.debug('scheduler [running] - pid=%s, count=%s/%s'
-                             % (sd.pid, count, cf['observer.restart.count']))
+            if not sd is None:
+                if not sd.poll() is None:
+                    logger.debug('return code=%d' % sd.returncode)
+                    logger.info('scheduler : [stop] - pid=%s, count=%s/%s'
+                                 % (sd.pid, count, cf['observer.restart.count']))
+                    sd = scheduler() # restart
+                    count -= 1
+                    logger.info('scheduler : [start] - pid=%s, count=%s/%s'
+                                      % (sd.pid, count, cf['observer.restart.count']))
+                else:
+                    simple_log.append('scheduler (running) - count=%s/%s' % (count, cf['observer.restart.count']))
+                    logger.debug('scheduler [running] - pid=%s, count=%s/%s'
+                                 % (sd.pid, count, cf['observer.restart.count']))
 
             # AsynPerformer
             if not asynpf.poll() is None:
@@ -202,18 +224,34 @@ def observer(opts, cf):
                              % (asynpf.pid, count, cf['observer.restart.count']))
 
             # AsynScheduler
-            if not asynsd.poll() is None:
-                logger.debug('return code=%d' % asynsd.returncode)
-                logger.info('asynscheduler : [stop] - pid=%s, count=%s/%s'
-                             % (asynsd.pid, count, cf['observer.restart.count']))
-                asynsd = asynscheduler() # restart
-                count -= 1
-                logger.info('asynscheduler : [start] - pid=%s, count=%s/%s'
-                                  % (asynsd.pid, count, cf['observer.restart.count']))
-            else:
-                simple_log.append('asynscheduler (running) - count=%s/%s' % ( count, cf['observer.restart.count']))
-                logger.debug('asynscheduler [running] - pid=%s, count=%s/%s'
-                             % (asynsd.pid, count, cf['observer.restart.count']))
+            if not asynsd is None:
+                if not asynsd.poll() is None:
+                    logger.debug('return code=%d' % asynsd.returncode)
+                    logger.info('asynscheduler : [stop] - pid=%s, count=%s/%s'
+                                 % (asynsd.pid, count, cf['observer.restart.count']))
+                    asynsd = asynscheduler() # restart
+                    count -= 1
+                    logger.info('asynscheduler : [start] - pid=%s, count=%s/%s'
+                                      % (asynsd.pid, count, cf['observer.restart.count']))
+                else:
+                    simple_log.append('asynscheduler (running) - count=%s/%s' % ( count, cf['observer.restart.count']))
+                    logger.debug('asynscheduler [running] - pid=%s, count=%s/%s'
+                                 % (asynsd.pid, count, cf['observer.restart.count']))
+
+            # Archiver
+            if not ar is None:
+                if not ar.poll() is None:
+                    logger.debug('return code=%d' % ar.returncode)
+                    logger.info('archiver : [stop] - pid=%s, count=%s/%s'
+                                 % (ar.pid, count, cf['observer.restart.count']))
+                    ar = archiver() # restart
+                    count -= 1
+                    logger.info('archiver : [start] - pid=%s, count=%s/%s'
+                                 % (ar.pid, count, cf['observer.restart.count']))
+                else:
+                    simple_log.append('archiver (running) - count=%s/%s' % (count, cf['observer.restart.count']))
+                    logger.debug('archiver [running] - pid=%s, count=%s/%s'
+                                 % (ar.pid, count, cf['observer.restart.count']))
 
             logger.info(str(simple_log)[1:-1])
             
@@ -270,6 +308,12 @@ def observer(opts, cf):
             else:
                 logger.info('KILL %d: killing asynperformer failed.' % asynpf.pid)
 
+        if not ar is None:
+            if kill_proc(ar) is True:
+                logger.info('KILL %d: killing archiver succeeded.' % ar.pid)
+            else:
+                logger.info('KILL %d: killing archiver failed.' % ar.pid)
+
     return PROCERROR
 
 # -- daemon
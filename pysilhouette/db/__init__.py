@@ -35,6 +35,7 @@ from sqlalchemy.orm import sessionmaker, mapper, \
      clear_mappers, relation, scoped_session
 from sqlalchemy.orm.exc import UnmappedInstanceError
 from sqlalchemy.pool import SingletonThreadPool, QueuePool
+from sqlalchemy.interfaces import PoolListener
 
 from pysilhouette.db.model import reload_mappers
 from pysilhouette import SilhouetteException
@@ -47,12 +48,54 @@ class SilhouetteDBException(SilhouetteException):
     """
     pass
 
+#: PRAGMA set on SQLite connections, by config key. (In this order)
+SQLITE_PRAGMAS = (('database.sqlite.busy.timeout', 'busy_timeout'),
+                  ('database.sqlite.journal.mode', 'journal_mode'),
+                  ('database.sqlite.synchronous', 'synchronous'),
+                  ('database.sqlite.cache.size', 'cache_size'),
+                  )
+
+class SQLitePragmaListener(PoolListener):
+    """Set the PRAGMAs on each new SQLite connection.
+    """
+    def __init__(self, pragmas):
+        self.pragmas = pragmas
+
+    def connect(self, dbapi_con, con_record):
+        cursor = dbapi_con.cursor()
+        try:
+            for (name, value) in self.pragmas:
+                cursor.execute('PRAGMA %s=%s' % (name, value))
+                if name == 'journal_mode':
+                    mode = cursor.fetchone()
+                    if mode and str(mode[0]).upper() != str(value).upper():
+                        logger = logging.getLogger('pysilhouette.db')
+                        logger.warning('SQLite journal mode was not changed. - journal_mode=%s (%s)'
+                                       % (mode[0], value))
+        finally:
+            cursor.close()
+
+def sqlite_listeners(cf):
+    """Pool listeners for the database.sqlite.* keys.
+    Empty when the database is not SQLite or no key is set.
+    """
+    if cf['database.url'][:6].strip() != 'sqlite':
+        return []
+    pragmas = []
+    for (key, name) in SQLITE_PRAGMAS:
+        if cf.has_key(key) is True and 0 < len(str(cf[key])):
+            pragmas.append((name, cf[key]))
+    if not pragmas:
+        return []
+    return [SQLitePragmaListener(pragmas)]
+
 def create_database(cf):
     db = None
     if cf['database.url'][:6].strip() == 'sqlite':
         db = Database(cf['database.url'],
                       encoding="utf-8",
                       convert_unicode=True,
+                      listeners=sqlite_listeners(cf),
                       )
     else:
         if cf['database.pool.status'] == 1:
@@ -81,11 +124,16 @@ class Database:
     
     __engine = None
     __metadata = None
+    __sessionmaker = None
     __Session = None
 
     def __init__(self, *args, **kwargs):
         self.get_engine(*args, **kwargs)
         self.create_metadata(self.__engine)
+        # One session factory per database. The registry keeps a session
+        # per thread, so ThreadWorkers do not share theirs.
+        self.__sessionmaker = sessionmaker(bind=self.__engine, autoflush=True)
+        self.__Session = scoped_session(self.__sessionmaker)
 
     def get_engine(self, *args, **kwargs):
         if not self.__engine:
@@ -101,11 +149,22 @@ class Database:
         return self.__metadata
 
     def get_session(self):
-        #if self.__Session is None:
-        #    self.__Session = sessionmaker(bind=self.__engine)
-        #return self.__Session()
-        return scoped_session(
-            sessionmaker(bind=self.__engine, autoflush=True))
+        """Session of the calling thread.
+        The same session is returned until it is removed. (remove_session)
+        """
+        return self.__Session()
+
+    def remove_session(self):
+        """Close and forget the session of the calling thread.
+        Call it before a thread ends.
+        """
+        self.__Session.remove()
+
+    def new_session(self):
+        """Session that is not bound to the calling thread.
+        The caller closes it, and uses it from one thread at a time.
+        """
+        return self.__sessionmaker()
 
 
 
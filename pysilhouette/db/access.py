@@ -28,10 +28,19 @@
 @author: Kei Funagayama <kei@karesansui-project.info>
 """
 
+import datetime
+
 import sqlalchemy
 import sqlalchemy.orm
 from pysilhouette.db import dbsave, dbupdate, dbdelete
-from  pysilhouette.db.model import JobGroup, Job, JOBGROUP_STATUS
+from  pysilhouette.db.model import JobGroup, Job, JobOutput, JOBGROUP_STATUS, ACTION_STATUS, sql_now
+
+def _text(value):
+    """Command output as stored in the database. (unicode, broken UTF-8 replaced)
+    """
+    if isinstance(value, str):
+        return unicode(value, 'utf-8', 'replace')
+    return value
 
 # JobGroup Table
 def jobgroup_findbyall(session, desc=False):
@@ -50,15 +59,90 @@ def jobgroup_findbystatus(session, status=JOBGROUP_STATUS['PEND']):
     return session.query(JobGroup).filter(
         JobGroup.status == status).order_by(JobGroup.id.asc()).all()
 
-def jobgroup_findbytype_status(session, type, status=JOBGROUP_STATUS['PEND']):
-    return session.query(JobGroup).filter(
+def _filter_type_status(query, type, status, uniq_key, due=True):
+    """Pending jobgroups are only those whose "run_after" has come.
+    @param due: False=Also the pending ones still waiting for "run_after"
+    """
+    query = query.filter(
         JobGroup.type == type).filter(
-        JobGroup.status == status).order_by(JobGroup.id.asc()).all()
+        JobGroup.status == status)
+    if uniq_key:
+        query = query.filter(JobGroup.uniq_key == uniq_key)
+    if status == JOBGROUP_STATUS['PEND'] and due is True:
+        query = query.filter(sqlalchemy.or_(JobGroup.run_after == None,
+                                            JobGroup.run_after <= datetime.datetime.now()))
+    return query
 
-def jobgroup_findbytype_limit_status(session, type, limit, status=JOBGROUP_STATUS['PEND']):
-    return session.query(JobGroup).filter(
+def _query_type_status(session, type, status, uniq_key, due=True):
+    return _filter_type_status(session.query(JobGroup), type, status, uniq_key, due)
+
+def jobgroup_findbytype_status(session, type, status=JOBGROUP_STATUS['PEND'], uniq_key=None, due=True):
+    """Highest priority first, then in order of registration.
+    @param uniq_key: Only the jobgroups of this uniq_key. None=All
+    @param due: False=Also the pending ones still waiting for "run_after" (lanes)
+    """
+    return _query_type_status(session, type, status, uniq_key, due).order_by(
+        JobGroup.priority.desc(), JobGroup.id.asc()).all()
+
+def jobgroup_findbytype_limit_status(session, type, limit, status=JOBGROUP_STATUS['PEND'], uniq_key=None):
+    """Highest priority first, then in order of registration.
+    @param uniq_key: Only the jobgroups of this uniq_key. None=All
+    """
+    return _query_type_status(session, type, status, uniq_key).order_by(
+        JobGroup.priority.desc(), JobGroup.id.asc()).limit(limit).all()
+
+def jobgroup_findbytype_key_limit_status(session, type, key, value, limit,
+                                         status=JOBGROUP_STATUS['PEND'], uniq_key=None):
+    """jobgroup_findbytype_limit_status of the jobgroups whose column "key"
+    is "value".
+    """
+    return _query_type_status(session, type, status, uniq_key).filter(
+        getattr(JobGroup, key) == value).order_by(
+        JobGroup.priority.desc(), JobGroup.id.asc()).limit(limit).all()
+
+def jobgroup_countbytype_status(session, type, key, status=JOBGROUP_STATUS['PEND'], uniq_key=None):
+    """Number of jobgroups for each value of the column "key".
+    @rtype: dict
+    """
+    column = getattr(JobGroup, key)
+    query = _filter_type_status(session.query(column, sqlalchemy.func.count(JobGroup.id)),
+                                type, status, uniq_key)
+    ret = {}
+    for (value, num) in query.group_by(column).all():
+        ret[value] = num
+    return ret
+
+def jobgroup_next_run_after(session, type, uniq_key=None):
+    """The nearest "run_after" still to come of the pending jobgroups of
+    "type", None when there is none.
+    @rtype: datetime
+    """
+    query = session.query(sqlalchemy.func.min(JobGroup.run_after)).filter(
         JobGroup.type == type).filter(
-        JobGroup.status == status).order_by(JobGroup.id.asc()).limit(limit).all()
+        JobGroup.status == JOBGROUP_STATUS['PEND']).filter(
+        JobGroup.run_after > datetime.datetime.now())
+    if uniq_key:
+        query = query.filter(JobGroup.uniq_key == uniq_key)
+    return query.scalar()
+
+def jobgroup_age(session, type, before, uniq_key=None, max_priority=None):
+    """Raise by one the priority of the pending jobgroups of "type" that
+    were registered or last raised before "before". (modified)
+    The priority is not raised beyond "max_priority". (None=No limit)
+    Returns the number of jobgroups.
+    """
+    query = session.query(JobGroup).filter(
+        JobGroup.type == type).filter(
+        JobGroup.status == JOBGROUP_STATUS['PEND']).filter(
+        JobGroup.modified < before)
+    if uniq_key:
+        query = query.filter(JobGroup.uniq_key == uniq_key)
+    if not max_priority is None:
+        query = query.filter(JobGroup.priority < max_priority)
+    num = query.update({'priority' : JobGroup.priority + 1},
+                       synchronize_session=False)
+    session.commit()
+    return num
 
 def jobgroup_findbyuniqkey(session, uniq_key):
     if uniq_key:
@@ -74,6 +158,76 @@ def jobgroup_findbyid(session, jgid, uniq_key):
     except sqlalchemy.orm.exc.NoResultFound, nrf:
         return None
 
+def jobgroup_claim(session, m_jg, owner, status=JOBGROUP_STATUS['PEND'], lease=None):
+    """Take a jobgroup for "owner" before running it.
+    The jobgroup becomes RUN by a conditional UPDATE (only while it is still
+    in "status"), so of the performers that found it, on this host or on
+    others sharing the database, only one gets True.
+    @param lease: Expiry of the lease (datetime), None=No lease
+    """
+    num = session.query(JobGroup).filter(
+        JobGroup.id == m_jg.id).filter(
+        JobGroup.status == status).update({'status' : JOBGROUP_STATUS['RUN'],
+                                           'owner' : owner,
+                                           'claimed' : sql_now(session.bind),
+                                           'lease' : lease,
+                                           },
+                                          synchronize_session=False)
+    session.commit() # m_jg is expired, and reloaded on access
+    return num == 1
+
+def jobgroup_renew(session, owner, lease):
+    """Extend the leases of the running jobgroups of "owner".
+    Returns the number of jobgroups.
+    """
+    num = session.query(JobGroup).filter(
+        JobGroup.owner == owner).filter(
+        JobGroup.status == JOBGROUP_STATUS['RUN']).update({'lease' : lease},
+                                                          synchronize_session=False)
+    session.commit()
+    return num
+
+def jobgroup_findexpired(session, type, now):
+    return session.query(JobGroup).filter(
+        JobGroup.type == type).filter(
+        JobGroup.status == JOBGROUP_STATUS['RUN']).filter(
+        JobGroup.lease < now).order_by(JobGroup.id.asc()).all()
+
+def jobgroup_expire(session, m_jg, now, status):
+    """Take back a running jobgroup whose lease expired before "now".
+    status PEND queues it again (its jobs that did not end normally are
+    PEND again, the owner is cleared), APPERR ends it. Returns False when
+    it was renewed or ended in the meantime.
+    """
+    values = {'status' : status, 'lease' : None}
+    if status == JOBGROUP_STATUS['PEND']:
+        values['owner'] = None
+        values['claimed'] = None
+    num = session.query(JobGroup).filter(
+        JobGroup.id == m_jg.id).filter(
+        JobGroup.status == JOBGROUP_STATUS['RUN']).filter(
+        JobGroup.lease < now).update(values, synchronize_session=False)
+    if num == 1 and status == JOBGROUP_STATUS['PEND']:
+        session.query(Job).filter(
+            Job.jobgroup_id == m_jg.id).filter(
+            Job.status != ACTION_STATUS['OK']).update({'status' : ACTION_STATUS['PEND']},
+                                                      synchronize_session=False)
+    session.commit()
+    return num == 1
+
+def jobgroup_retry(session, m_jg, run_after, autocommit=True):
+    """Queue a jobgroup again, to run from "run_after" on. (Job.max_retries)
+    The owner is cleared. Its jobs that ended normally do not run again.
+    """
+    m_jg.status = JOBGROUP_STATUS['PEND']
+    m_jg.owner = None
+    m_jg.claimed = None
+    m_jg.lease = None
+    m_jg.run_after = run_after
+    ret = update(session, m_jg)
+    if autocommit is True:
+        session.commit()
+    return ret
 
 def jobgroup_update(session, m_jg, status, autocommit=True):
     m_jg.status = status
@@ -97,8 +251,15 @@ def delete(session, model):
 
 
 # Job Table
-def job_findbyjobgroup_id(session, jgid, desc=False):
+def job_findbyjobgroup_id(session, jgid, desc=False, output=False):
+    """
+    @param output: True=Also load the output columns (action_stdout, ...).
+                   They are loaded on access otherwise.
+    @type output: bool
+    """
     _q = session.query(Job).filter(Job.jobgroup_id == jgid)
+    if output is True:
+        _q = _q.options(sqlalchemy.orm.undefer_group('output'))
     if desc:
         _r = _q.order_by(Job.order.desc()).all()
     else:
@@ -117,28 +278,68 @@ def job_update(session, m_job, status=None, autocommit=True):
 
 def job_result_action(session, job, info, autocommit=True):
     job.action_exit_code = info['r_code']
-    job.action_stdout = info['stdout']
-    job.action_stderr = info['stderr']
+    job.action_stdout = _text(info['stdout'])
+    job.action_stderr = _text(info['stderr'])
+    job.action_stdout_spool = info.get('stdout_spool')
+    job.action_stderr_spool = info.get('stderr_spool')
 
-    ret = job_update(session, job)
-        
-    if autocommit is True:
-        session.commit()
+    ret = job_update(session, job, None, autocommit)
 
     return ret
 
 def job_result_rollback(session, job, info, autocommit=True):
     job.rollback_exit_code = info['r_code']
-    job.rollback_stdout = info['stdout']
-    job.rollback_stderr = info['stderr']
+    job.rollback_stdout = _text(info['stdout'])
+    job.rollback_stderr = _text(info['stderr'])
+    job.rollback_stdout_spool = info.get('stdout_spool')
+    job.rollback_stderr_spool = info.get('stderr_spool')
 
-    ret = job_update(session, job)
+    ret = job_update(session, job, None, autocommit)
 
+    return ret
+
+# JobOutput Table
+def job_output_append(session, job_id, stream, offset, data, autocommit=True):
+    ret = save(session, JobOutput(job_id, stream, offset, _text(data)))
     if autocommit is True:
         session.commit()
+    return ret
 
+def job_output_delete(session, job_id, streams, autocommit=True):
+    """Delete the chunks once the whole output is in the job row.
+    """
+    ret = session.query(JobOutput).filter(
+        JobOutput.job_id == job_id).filter(
+        JobOutput.stream.in_(streams)).delete(synchronize_session=False)
+    if autocommit is True:
+        session.commit()
     return ret
 
+def job_output_tail(session, job_id, stream, offset=0):
+    """Output of the job from offset, also while the command is running.
+    @param stream: action_stdout, action_stderr, rollback_stdout or rollback_stderr
+    @type stream: str
+    @param offset: Bytes of the UTF-8 output already read. Pass the returned one to read the rest.
+    @type offset: int
+    @rtype: tuple
+    @return: (output (unicode), next offset)
+    """
+    chunks = session.query(JobOutput).filter(
+        JobOutput.job_id == job_id).filter(
+        JobOutput.stream == stream).filter(
+        JobOutput.offset + JobOutput.size > offset).order_by(
+        JobOutput.offset.asc()).all()
+    if chunks:
+        data = u''.join([_text(c.data) for c in chunks]).encode('utf-8')
+        data = data[max(0, offset - chunks[0].offset):]
+    else:
+        # Finished (or never streamed), the job row has the whole output.
+        job = session.query(Job).options(sqlalchemy.orm.undefer(stream)).filter(
+            Job.id == job_id).one()
+        data = _text(job.get_output(stream) or u'').encode('utf-8')[offset:]
+    # A character cut by offset comes back replaced, the offset stays exact.
+    return (unicode(data, 'utf-8', 'replace'), offset + len(data))
+
 # progress
 def get_progress(session, job_id):
     job = session.query(Job).filter(Job.id == job_id).one()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import logging
+
+import sqlalchemy
+import sqlalchemy.exc
+from sqlalchemy.engine.reflection import Inspector
+
+#: Indexes replaced by others, dropped by upgrade. {table: (index, ...)}
+OBSOLETE_INDEXES = {
+    'jobgroup' : ('ix_jobgroup_type_status_id',
+                  'ix_jobgroup_type_status_priority_id', # priority ascending
+                  ),
+    }
+
+def _default_clause(column):
+    """DEFAULT clause for a column added to a table which has rows.
+    Only a scalar default of the column can be written in the DDL.
+    """
+    if column.default is None or not column.default.is_scalar:
+        return None
+    value = column.default.arg
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, (int, long, float)):
+        return str(value)
+    return "'%s'" % unicode(value).replace("'", "''")
+
+def add_column(engine, table, column):
+    """ALTER TABLE ... ADD COLUMN for a column missing in the database.
+    """
+    preparer = engine.dialect.identifier_preparer
+    ddl = 'ALTER TABLE %s ADD COLUMN %s %s' % (
+        preparer.format_table(table),
+        preparer.format_column(column),
+        column.type.compile(dialect=engine.dialect))
+    default = _default_clause(column)
+    if default is not None:
+        ddl += ' DEFAULT %s' % default
+    if column.nullable is False:
+        if default is None:
+            raise sqlalchemy.exc.ArgumentError(
+                'Can not add the NOT NULL column without a default. - %s.%s'
+                % (table.name, column.name))
+        ddl += ' NOT NULL'
+    engine.execute(ddl)
+    return ddl
+
+def drop_index(bind, table_name, index):
+    """DROP INDEX of an index in the database. (Inspector.get_indexes)
+    """
+    t_index = sqlalchemy.Table(table_name, sqlalchemy.MetaData(),
+                               *[sqlalchemy.Column(name, sqlalchemy.types.NullType())
+                                 for name in index['column_names']])
+    sqlalchemy.Index(index['name'], *list(t_index.columns)).drop(bind=bind)
+    return 'DROP INDEX %s' % index['name']
+
+def autoincrement_missing(engine, table):
+    """Whether a table of sqlite_autoincrement=True was created without
+    AUTOINCREMENT. (SQLite, the ids of deleted rows are used again)
+    """
+    if engine.dialect.name != 'sqlite' or table.kwargs.get('sqlite_autoincrement') is not True:
+        return False
+    sql = engine.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                         table.name).scalar()
+    return not sql is None and not 'AUTOINCREMENT' in sql.upper()
+
+def _set_pragmas(conn, pragmas):
+    """Set the SQLite PRAGMAs of the connection, returns the values they had.
+    One the SQLite does not know is left out.
+    """
+    ret = []
+    for (name, value) in pragmas:
+        row = conn.execute('PRAGMA %s' % name).fetchone()
+        if not row is None:
+            ret.append((name, row[0]))
+        conn.execute('PRAGMA %s=%s' % (name, value))
+    return ret
+
+def rebuild_table(engine, table, columns, indexes):
+    """Recreate a table whose primary key was changed, keeping the rows.
+    The indexes are dropped, the table is renamed, created again and the
+    "columns" it had are copied. A missing column gets its default.
+    On SQLite the foreign keys of the other tables keep the name of the
+    table, they do not follow it to the renamed one.
+    @param columns: Column names of the table in the database.
+    @param indexes: Indexes of the table. (Inspector.get_indexes)
+    """
+    preparer = engine.dialect.identifier_preparer
+    old = '%s_upgrade' % table.name
+    names = []
+    values = []
+    for column in table.columns:
+        if column.name in columns:
+            names.append(preparer.format_column(column))
+            values.append(preparer.format_column(column))
+            continue
+        default = _default_clause(column)
+        if default is not None:
+            names.append(preparer.format_column(column))
+            values.append(default)
+        elif column.nullable is False and column.primary_key is False:
+            raise sqlalchemy.exc.ArgumentError(
+                'Can not add the NOT NULL column without a default. - %s.%s'
+                % (table.name, column.name))
+    conn = engine.connect()
+    pragmas = []
+    try:
+        if engine.dialect.name == 'sqlite':
+            pragmas = _set_pragmas(conn, (('foreign_keys', 0), ('legacy_alter_table', 1)))
+        trans = conn.begin()
+        try:
+            for index in indexes:
+                drop_index(conn, table.name, index)
+            conn.execute('ALTER TABLE %s RENAME TO %s'
+                         % (preparer.format_table(table), preparer.quote_identifier(old)))
+            table.create(bind=conn)
+            conn.execute('INSERT INTO %s (%s) SELECT %s FROM %s'
+                         % (preparer.format_table(table), ', '.join(names),
+                            ', '.join(values), preparer.quote_identifier(old)))
+            conn.execute('DROP TABLE %s' % preparer.quote_identifier(old))
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+    finally:
+        try:
+            _set_pragmas(conn, pragmas)
+        finally:
+            conn.close()
+    return 'REBUILD TABLE %s' % table.name
+
+def outdated(metadata):
+    """Tables and columns of the mappers missing in the database, and the
+    tables whose primary key was changed or which lack AUTOINCREMENT.
+    psil-upgradedb brings them up.
+    @param metadata: MetaData after reload_mappers.
+    @type metadata: sqlalchemy.schema.MetaData
+    @return: "table" or "table.column" names. Empty when up to date.
+    @rtype: list
+    """
+    inspector = Inspector.from_engine(metadata.bind)
+    exists = inspector.get_table_names()
+    ret = []
+    for table in metadata.sorted_tables:
+        if not table.name in exists:
+            ret.append(table.name)
+            continue
+        primary_keys = [c.name for c in table.primary_key.columns]
+        if inspector.get_primary_keys(table.name) != primary_keys \
+               or autoincrement_missing(metadata.bind, table) is True:
+            ret.append(table.name)
+            continue
+        columns = [c['name'] for c in inspector.get_columns(table.name)]
+        for column in table.columns:
+            if not column.name in columns:
+                ret.append('%s.%s' % (table.name, column.name))
+    return ret
+
+def upgrade(metadata):
+    """Bring the tables of an existing database up to the schema of the
+    mappers. Missing tables, columns and indexes are created, a table whose
+    primary key was changed (the archive tables) or which lacks
+    AUTOINCREMENT (jobgroup and job on SQLite) is rebuilt. Only the
+    OBSOLETE_INDEXES are dropped.
+    @param metadata: MetaData after reload_mappers.
+    @type metadata: sqlalchemy.schema.MetaData
+    @return: Description of the changes applied.
+    @rtype: list
+    """
+    logger = logging.getLogger('pysilhouette.db.migrate')
+    engine = metadata.bind
+    ret = []
+
+    inspector = Inspector.from_engine(engine)
+    exists = inspector.get_table_names()
+    for table in metadata.sorted_tables:
+        if not table.name in exists:
+            table.create(bind=engine)
+            ret.append('CREATE TABLE %s' % table.name)
+            logger.info('Created the table. - %s' % table.name)
+            continue
+
+        columns = [c['name'] for c in inspector.get_columns(table.name)]
+        indexes = inspector.get_indexes(table.name)
+        primary_keys = [c.name for c in table.primary_key.columns]
+        if inspector.get_primary_keys(table.name) != primary_keys \
+               or autoincrement_missing(engine, table) is True:
+            ret.append(rebuild_table(engine, table, columns, indexes))
+            logger.info('Rebuilt the table. - %s' % table.name)
+            continue
+
+        for column in table.columns:
+            if not column.name in columns:
+                ret.append(add_column(engine, table, column))
+                logger.info('Added the column. - %s.%s' % (table.name, column.name))
+
+        for index in indexes:
+            if index['name'] in OBSOLETE_INDEXES.get(table.name, ()):
+                ret.append(drop_index(engine, table.name, index))
+                logger.info('Dropped the index. - %s' % index['name'])
+
+        indexes = [i['name'] for i in indexes]
+        for index in table.indexes:
+            if not index.name in indexes:
+                index.create(bind=engine)
+                ret.append('CREATE INDEX %s' % index.name)
+                logger.info('Created the index. - %s' % index.name)
+
+    return ret
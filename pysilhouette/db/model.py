@@ -30,9 +30,12 @@
 
 import sqlalchemy
 import sqlalchemy.exc
-from sqlalchemy.orm import mapper, relation, clear_mappers
+from sqlalchemy.orm import mapper, relation, clear_mappers, deferred, validates
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.ext.compiler import compiles
 
 from pysilhouette.util import is_empty
+from pysilhouette.spool import read_output
 
 # Job Constant
 _RES_CREATING = u'100' #: Creating
@@ -77,25 +80,61 @@ JOBGROUP_TYPE = {
     'PARALLEL' : 1, #Parallel
     }
 
+@compiles(CreateIndex)
+def create_index(create, compiler, **kw):
+    """CREATE INDEX with the columns named in Index(..., desc=[...])
+    descending. (Index takes plain columns only)
+    """
+    text = compiler.visit_create_index(create)
+    index = create.element
+    desc = index.kwargs.get('desc')
+    if not desc:
+        return text
+    columns = []
+    for c in index.columns:
+        column = compiler.preparer.quote(c.name, c.quote)
+        if c.name in desc:
+            column += ' DESC'
+        columns.append(column)
+    return '%s(%s)' % (text[:text.rindex('(')], ', '.join(columns))
+
 #: Jobgroup Table instance.
 def get_jobgroup_table(metadata, now):
-    return sqlalchemy.Table('jobgroup', metadata,
+    t_jobgroup = sqlalchemy.Table('jobgroup', metadata,
                             sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True,
                                               autoincrement=True),
                             sqlalchemy.Column('name', sqlalchemy.String(512), nullable=False),
-                            sqlalchemy.Column('uniq_key', sqlalchemy.Unicode(36), nullable=False),
+                            sqlalchemy.Column('uniq_key', sqlalchemy.Unicode(36), nullable=False,
+                                              index=True),
                             sqlalchemy.Column('finish_command', sqlalchemy.String(1024)), 
                             sqlalchemy.Column('type', sqlalchemy.Integer(1), nullable=False,
                                               default=JOBGROUP_TYPE['SERIAL']),
                             sqlalchemy.Column('status', sqlalchemy.Unicode(3), nullable=False,
                                               default=JOBGROUP_STATUS['PEND']),
                             sqlalchemy.Column('register', sqlalchemy.String(32), nullable=True),
+                            sqlalchemy.Column('priority', sqlalchemy.Integer, nullable=False,
+                                              default=0),
+                            sqlalchemy.Column('lane', sqlalchemy.Unicode(64), nullable=True),
+                            sqlalchemy.Column('owner', sqlalchemy.Unicode(255), nullable=True),
+                            sqlalchemy.Column('claimed', sqlalchemy.DateTime, nullable=True),
+                            sqlalchemy.Column('lease', sqlalchemy.DateTime, nullable=True),
+                            sqlalchemy.Column('run_after', sqlalchemy.DateTime, nullable=True),
                             sqlalchemy.Column('created', sqlalchemy.DateTime,
                                               default=now),
                             sqlalchemy.Column('modified', sqlalchemy.DateTime,
                                               default=now,
                                               onupdate=now),
+                            sqlite_autoincrement=True,
                             )
+    # Pending-queue scan of the performers, in the order of the scan.
+    # (See jobgroup_findbytype_status)
+    sqlalchemy.Index('ix_jobgroup_type_status_priority_desc_id',
+                     t_jobgroup.c.type, t_jobgroup.c.status, t_jobgroup.c.priority, t_jobgroup.c.id,
+                     desc=['priority'])
+    # Next delayed jobgroup. (See jobgroup_next_run_after)
+    sqlalchemy.Index('ix_jobgroup_type_status_run_after',
+                     t_jobgroup.c.type, t_jobgroup.c.status, t_jobgroup.c.run_after)
+    return t_jobgroup
 
 #: Job Table instance.
 def get_job_table(metadata, now):
@@ -109,6 +148,14 @@ def get_job_table(metadata, now):
                             sqlalchemy.Column('order', sqlalchemy.Integer, nullable=False),
                             sqlalchemy.Column('action_command', sqlalchemy.String(1024), nullable=False),
                             sqlalchemy.Column('rollback_command', sqlalchemy.String(1024)),
+                            sqlalchemy.Column('depends', sqlalchemy.String(256), nullable=True),
+                            sqlalchemy.Column('max_retries', sqlalchemy.Integer, nullable=False,
+                                              default=0),
+                            sqlalchemy.Column('retry_backoff', sqlalchemy.Integer, nullable=False,
+                                              default=0),
+                            sqlalchemy.Column('retry_codes', sqlalchemy.String(256), nullable=True),
+                            sqlalchemy.Column('retries', sqlalchemy.Integer, nullable=False,
+                                              default=0),
                             sqlalchemy.Column('status', sqlalchemy.Unicode(3), nullable=False,
                                               default=ACTION_STATUS['PEND']),
                             sqlalchemy.Column('action_exit_code', sqlalchemy.Integer),
@@ -117,6 +164,10 @@ def get_job_table(metadata, now):
                             sqlalchemy.Column('rollback_exit_code', sqlalchemy.Integer),
                             sqlalchemy.Column('rollback_stdout', sqlalchemy.TEXT),
                             sqlalchemy.Column('rollback_stderr', sqlalchemy.TEXT),
+                            sqlalchemy.Column('action_stdout_spool', sqlalchemy.String(1024)),
+                            sqlalchemy.Column('action_stderr_spool', sqlalchemy.String(1024)),
+                            sqlalchemy.Column('rollback_stdout_spool', sqlalchemy.String(1024)),
+                            sqlalchemy.Column('rollback_stderr_spool', sqlalchemy.String(1024)),
                             sqlalchemy.Column('progress', sqlalchemy.Integer, nullable=False, 
                                               default=0),
                             sqlalchemy.Column('created', sqlalchemy.DateTime, 
@@ -124,29 +175,83 @@ def get_job_table(metadata, now):
                             sqlalchemy.Column('modified', sqlalchemy.DateTime,
                                               default=now,
                                               onupdate=now),
+                            sqlite_autoincrement=True,
                             )
 
+#: Job columns holding the command output. Mapped as the deferred group
+#: "output", not loaded until used. (See job_findbyjobgroup_id)
+JOB_OUTPUT_COLUMNS = ('action_stdout', 'action_stderr',
+                      'rollback_stdout', 'rollback_stderr',
+                      )
+
+def get_job_properties(t_job):
+    ret = {}
+    for name in JOB_OUTPUT_COLUMNS:
+        ret[name] = deferred(t_job.c[name], group='output')
+    return ret
+
+#: Job Output Table instance.
+def get_job_output_table(metadata, now):
+    return sqlalchemy.Table('job_output', metadata,
+                            sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True,
+                                              autoincrement=True),
+                            sqlalchemy.Column('job_id', sqlalchemy.Integer,
+                                              sqlalchemy.ForeignKey('job.id'),
+                                              index=True, nullable=False),
+                            sqlalchemy.Column('stream', sqlalchemy.String(16), nullable=False),
+                            sqlalchemy.Column('offset', sqlalchemy.Integer, nullable=False),
+                            sqlalchemy.Column('size', sqlalchemy.Integer, nullable=False),
+                            sqlalchemy.Column('data', sqlalchemy.TEXT),
+                            sqlalchemy.Column('created', sqlalchemy.DateTime,
+                                              default=now),
+                            )
+
+#: Archive Table instance. Same columns as the table plus its own key
+#: "archive_id", the original id is kept as an indexed column.
+#: Finished jobgroups are moved here. (See pysilhouette.archive)
+def get_archive_table(metadata, table, now):
+    columns = [sqlalchemy.Column('archive_id', sqlalchemy.Integer, primary_key=True,
+                                 autoincrement=True)]
+    for c in table.columns:
+        default = None
+        if c.default is not None and c.default.is_scalar:
+            default = c.default.arg
+        columns.append(sqlalchemy.Column(c.name, c.type, index=c.primary_key,
+                                         nullable=c.nullable, default=default))
+    columns.append(sqlalchemy.Column('archived', sqlalchemy.DateTime, default=now))
+    return sqlalchemy.Table('%s_archive' % table.name, metadata, *columns)
+
+def sql_now(bind):
+    """SQL expression of the current time on the database of "bind"."""
+    if bind.name == 'sqlite':
+        return sqlalchemy.func.datetime('now', 'localtime')
+    else:
+        return sqlalchemy.func.now()
+
 def reload_mappers(metadata):
     """all model mapper reload.
     @param metadata: reload MetaData
     @type metadata: sqlalchemy.schema.MetaData
     """
-    if metadata.bind.name == 'sqlite':
-        _now = sqlalchemy.func.datetime('now', 'localtime')
-    else:
-        _now = sqlalchemy.func.now()
+    _now = sql_now(metadata.bind)
 
     t_jobgroup = get_jobgroup_table(metadata, _now)
     t_job = get_job_table(metadata, _now)
+    t_job_output = get_job_output_table(metadata, _now)
+    t_jobgroup_archive = get_archive_table(metadata, t_jobgroup, _now)
+    t_job_archive = get_archive_table(metadata, t_job, _now)
+    sqlalchemy.Index('ix_job_archive_jobgroup_id', t_job_archive.c.jobgroup_id)
     try:
         mapper(JobGroup, t_jobgroup, properties={'jobs': relation(Job)})
         #mapper(JobGroup, t_jobgroup, properties={'jobs': relation(Job, backref='job_group')})
-        mapper(Job, t_job)
+        mapper(Job, t_job, properties=get_job_properties(t_job))
+        mapper(JobOutput, t_job_output)
     except sqlalchemy.exc.ArgumentError, ae:
         clear_mappers()
         mapper(JobGroup, t_jobgroup, properties={'jobs': relation(Job)})
         #mapper(JobGroup, t_jobgroup, properties={'jobs': relation(Job, backref='job_group')})
-        mapper(Job, t_job)        
+        mapper(Job, t_job, properties=get_job_properties(t_job))
+        mapper(JobOutput, t_job_output)
     
 class Model(object):
     """Model base class of all.
@@ -165,18 +270,61 @@ class Model(object):
         
 class JobGroup(Model):
     """JobGroup Table class.
+    Serial jobgroups with the same "lane" run one after another, different
+    lanes may run at the same time. (See performer.worker.size)
+    "owner" and "claimed" tell which performer took the jobgroup, and when.
+    (See access.jobgroup_claim) The owner renews "lease" while it runs the
+    jobgroup. (See lease.LeaseKeeper)
+    Pending jobgroups of higher "priority" are run first, and not before
+    "run_after".
     """
 
-    def __init__(self, name, uniq_key, type=JOBGROUP_TYPE['SERIAL']):
+    def __init__(self, name, uniq_key, type=JOBGROUP_TYPE['SERIAL'], priority=0):
         self.name = name
         self.uniq_key = uniq_key
         self.type = type
+        self.priority = priority
 
     def __repr__(self):
         return "JobGroup<'%s','%s'>" % (self.name, self.uniq_key)
         
+def split_numbers(value, name):
+    """Numbers of a comma separated list, e.g. "0,2".
+    Raises ValueError when an item is not a number.
+    @param name: Column name for the message
+    @rtype: list
+    """
+    ret = []
+    for item in value.split(','):
+        if is_empty(item):
+            continue
+        try:
+            ret.append(int(item.strip()))
+        except ValueError:
+            raise ValueError('Must be comma separated numbers. - %s=%s' % (name, value))
+    return ret
+
+def check_depends(value):
+    """Raises ValueError when "value" is not a valid Job.depends."""
+    if not is_empty(value) and value.strip() != '-':
+        split_numbers(value, 'depends')
+
+def check_retry_codes(value):
+    """Raises ValueError when "value" is not a valid Job.retry_codes."""
+    if not is_empty(value):
+        split_numbers(value, 'retry_codes')
+
 class Job(Model):
     """Job Table class.
+    "depends" is the comma separated "order" of the jobs of the same
+    jobgroup that have to end normally before this one starts, e.g. "0,2",
+    or "-" for none. When no job of a jobgroup has it, the jobs run one by
+    one in "order". Otherwise each job waits only for its "depends", and
+    the others run at the same time. (See worker.JobGraph)
+    A failed action whose exit code is in "retry_codes" (comma separated,
+    empty=Any) is retried up to "max_retries" times: the jobgroup is
+    queued again to run after "retry_backoff" seconds, doubled at each
+    retry. "retries" counts them.
     """
     def __init__(self, name, order, action_command):
         self.name = name
@@ -190,6 +338,66 @@ class Job(Model):
     def is_rollback(self):
         return not is_empty(self.rollback_command)
 
+    @validates('depends')
+    def validate_depends(self, key, value):
+        check_depends(value)
+        return value
+
+    @validates('retry_codes')
+    def validate_retry_codes(self, key, value):
+        check_retry_codes(value)
+        return value
+
+    def get_retry_codes(self):
+        """Exit codes that are retried, None for any.
+        @rtype: list
+        """
+        if is_empty(self.retry_codes):
+            return None
+        return split_numbers(self.retry_codes, 'retry_codes')
+
+    def get_depends(self):
+        """"order" of the jobs this one waits for, None when "depends" is not set.
+        @rtype: list
+        """
+        if is_empty(self.depends):
+            return None
+        if self.depends.strip() == '-':
+            return []
+        return split_numbers(self.depends, 'depends')
+
+    def get_output(self, column):
+        """Whole output, also when it was spilled to a spool file.
+        (The column itself has only the beginning of it.)
+        @param column: action_stdout, action_stderr, rollback_stdout or rollback_stderr
+        @type column: str
+        """
+        path = getattr(self, '%s_spool' % column)
+        if is_empty(path) is False:
+            return read_output(path)
+        return getattr(self, column)
+
+class JobOutput(Model):
+    """Job Output Table class.
+    A chunk of the output of a running command.
+    "stream" is the name of the Job column that receives the whole output
+    when the command finishes (e.g. action_stdout).
+    "offset" and "size" count the bytes of the UTF-8 output.
+    """
+    def __init__(self, job_id, stream, offset, data):
+        self.job_id = job_id
+        self.stream = stream
+        self.offset = offset
+        if isinstance(data, unicode):
+            self.size = len(data.encode('utf-8'))
+        else:
+            self.size = len(data)
+        self.data = data
+
+    def __repr__(self):
+        return "JobOutput<'%s','%s','%s'>" % \
+               (self.job_id, self.stream, self.offset)
+
 if __name__ == '__main__':
     """Testing
     """
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import logging
+
+#: <performer>.fair.key - Column of the jobgroup which tells the tenants apart.
+FAIR_KEYS = ('off', 'register', 'lane')
+
+class FairShare:
+    """Deficit round-robin over the tenants of a performer, the values of
+    the jobgroup column <prefix>.fair.key. (A jobgroup without it is the
+    tenant None)
+
+    Every round each tenant with pending jobgroups gets its weight
+    (<prefix>.fair.weight.<value>, default <prefix>.fair.weight) added to
+    its deficit, and takes one jobgroup per unit of it. A tenant which has
+    <prefix>.fair.cap.<value> (default <prefix>.fair.cap, 0=No cap)
+    jobgroups running is passed over. (asynperformer only) A bulk
+    registration of one tenant therefore only delays the others by its
+    weight.
+    """
+    def __init__(self, cf, prefix):
+        self.key = cf['%s.fair.key' % prefix]
+        self.weight = cf['%s.fair.weight' % prefix]
+        self.cap = cf.get('%s.fair.cap' % prefix, 0)
+        self.weights = {}
+        self.caps = {}
+        for (name, value) in cf.items():
+            if name.startswith('%s.fair.weight.' % prefix):
+                self.weights[name[len('%s.fair.weight.' % prefix):]] = value
+            elif name.startswith('%s.fair.cap.' % prefix):
+                self.caps[name[len('%s.fair.cap.' % prefix):]] = value
+        self.logger = logging.getLogger('pysilhouette.fairshare')
+        self.deficits = {}
+        self.order = [] #: Round-robin order of the tenants
+
+    def is_on(self):
+        return self.key != 'off'
+
+    def _conf(self, values, value, default):
+        if value is None:
+            return default
+        return values.get(value.encode('utf-8'), default)
+
+    def weight_of(self, value):
+        return self._conf(self.weights, value, self.weight)
+
+    def cap_of(self, value):
+        return self._conf(self.caps, value, self.cap)
+
+    def tenant_of(self, m_jg):
+        return getattr(m_jg, self.key)
+
+    def group(self, m_jgs):
+        """{tenant: [jobgroup, ...]} keeping the order of m_jgs."""
+        ret = {}
+        for m_jg in m_jgs:
+            ret.setdefault(self.tenant_of(m_jg), []).append(m_jg)
+        return ret
+
+    def select(self, candidates, slots=None, running=None):
+        """Jobgroups to run, in order.
+        @param candidates: {tenant: [jobgroup, ...]} pending, each in queue order
+        @type candidates: dict
+        @param slots: Number of jobgroups to take. None=All
+        @param running: {tenant: number of running jobgroups} for the caps. None=No cap
+        @rtype: list
+        """
+        for value in candidates.keys():
+            if not value in self.order:
+                self.order.append(value)
+        for value in self.order[:]:
+            if not candidates.get(value):
+                # No more pending jobgroups, the deficit is not kept.
+                self.order.remove(value)
+                if self.deficits.has_key(value):
+                    del self.deficits[value]
+
+        queues = {}
+        for (value, m_jgs) in candidates.items():
+            queues[value] = list(m_jgs)
+        if running is None:
+            running = {}
+            caps = False
+        else:
+            running = running.copy()
+            caps = True
+
+        ret = []
+        while slots is None or len(ret) < slots:
+            taken = False
+            for value in self.order:
+                queue = queues[value]
+                cap = self.cap_of(value)
+                if not queue or (caps is True and 0 < cap and cap <= running.get(value, 0)):
+                    continue
+                self.deficits[value] = self.deficits.get(value, 0) + self.weight_of(value)
+                while queue and 1 <= self.deficits[value]:
+                    if not slots is None and slots <= len(ret):
+                        break
+                    if caps is True and 0 < cap and cap <= running.get(value, 0):
+                        break
+                    ret.append(queue.pop(0))
+                    running[value] = running.get(value, 0) + 1
+                    self.deficits[value] -= 1
+                    taken = True
+                if not queue:
+                    self.deficits[value] = 0
+            if taken is False:
+                break
+
+        # The next scan starts with the next tenant.
+        if self.order:
+            self.order.append(self.order.pop(0))
+        return ret
+
+if __name__ == '__main__':
+    pass
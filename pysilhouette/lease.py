@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import os
+import time
+import socket
+import datetime
+import logging
+import traceback
+import threading
+
+from pysilhouette.db.model import JOBGROUP_STATUS
+from pysilhouette.db.access import jobgroup_renew, jobgroup_findexpired, \
+     jobgroup_expire
+from pysilhouette.util import monotonic
+
+#: lease.expired - Status given to a jobgroup whose lease expired.
+LEASE_EXPIRED = {
+    'apperr' : JOBGROUP_STATUS['APPERR'],
+    'pend' : JOBGROUP_STATUS['PEND'],
+    }
+
+def claim_owner(cf):
+    """Owner of the jobgroups claimed by this process. (env.node.name:pid)"""
+    node = cf.get('env.node.name') or socket.gethostname()
+    return unicode('%s:%d' % (node, os.getpid()), 'utf-8')
+
+def lease_time(cf):
+    """lease.time, 0 when the leases are off.
+    (Also for a configuration which was not checked by parse_conf)
+    """
+    return int(cf.get('lease.time', 0))
+
+def lease_expire(cf):
+    """Expiry of a lease taken now, None when the leases are off."""
+    if lease_time(cf) <= 0:
+        return None
+    return datetime.datetime.now() + datetime.timedelta(seconds=lease_time(cf))
+
+class LeaseKeeper(threading.Thread):
+    """Renews the leases of the jobgroups claimed by this process,
+    every third of lease.time. One per process, see start_keeper.
+    """
+    def __init__(self, cf, db):
+        threading.Thread.__init__(self, name='LeaseKeeper')
+        self.setDaemon(1)
+        self._cf = cf
+        self._db = db
+        self.pid = os.getpid()
+        self.interval = max(lease_time(cf) / 3.0, 1)
+        self.logger = logging.getLogger('pysilhouette.lease')
+
+    def run(self):
+        owner = claim_owner(self._cf)
+        while True:
+            time.sleep(self.interval)
+            try:
+                session = self._db.get_session()
+                try:
+                    num = jobgroup_renew(session, owner, lease_expire(self._cf))
+                    self.logger.debug('Renewed the leases. - owner=%s, jobgroup_num=%d' % (owner, num))
+                finally:
+                    self._db.remove_session()
+            except Exception, e:
+                self.logger.error('Failed to renew the leases. - owner=%s : %s' % (owner, str(e.args)))
+                t_logger = logging.getLogger('pysilhouette_traceback')
+                t_logger.error(traceback.format_exc())
+
+_keeper = None
+
+def start_keeper(cf, db):
+    """Start the LeaseKeeper of this process, once.
+    (Again in a forked child, whose jobgroups have another owner)
+    """
+    global _keeper
+    if lease_time(cf) <= 0:
+        return None
+    if _keeper is None or _keeper.pid != os.getpid():
+        _keeper = LeaseKeeper(cf, db)
+        _keeper.start()
+    return _keeper
+
+class Reaper:
+    """Running jobgroups of "type" whose lease expired (their performer
+    was killed) are queued again or set to APPERR. (lease.expired)
+    reap() is called from the performer loop, and looks every third of
+    lease.time at most.
+    """
+    def __init__(self, cf, db, type):
+        self._cf = cf
+        self._db = db
+        self.type = type
+        self.interval = max(lease_time(cf) / 3.0, 1)
+        self.logger = logging.getLogger('pysilhouette.lease')
+        self._next = 0
+
+    def reap(self):
+        if lease_time(self._cf) <= 0 or monotonic() < self._next:
+            return 0
+        self._next = monotonic() + self.interval
+
+        num = 0
+        status = LEASE_EXPIRED[self._cf['lease.expired']]
+        now = datetime.datetime.now()
+        session = self._db.get_session()
+        try:
+            for m_jg in jobgroup_findexpired(session, self.type, now):
+                (jobgroup_id, owner) = (m_jg.id, m_jg.owner)
+                if jobgroup_expire(session, m_jg, now, status) is True:
+                    self.logger.warning('The lease of the JobGroup expired. - jobgroup_id=%d, owner=%s, status=%s' \
+                                        % (jobgroup_id, owner, status))
+                    num += 1
+        finally:
+            session.close()
+        return num
+
+if __name__ == '__main__':
+    pass
@@ -33,6 +33,7 @@ import signal
 import os
 import traceback
 import logging
+import datetime
 
 from pysilhouette import PROCERROR, PROCSUCCESS
 from pysilhouette.er import ER
@@ -40,8 +41,11 @@ from pysilhouette.log import reload_conf
 from pysilhouette.prep import readconf, getopts, chkopts, parse_conf
 from pysilhouette.db import create_database, Database
 from pysilhouette.db.model import JOBGROUP_STATUS, JOBGROUP_TYPE
-from pysilhouette.db.access import jobgroup_findbytype_status, jobgroup_update
-from pysilhouette.worker import SimpleWorker
+from pysilhouette.db.access import jobgroup_findbytype_status, jobgroup_update, jobgroup_age, jobgroup_next_run_after
+from pysilhouette.worker import SimpleWorker, LaneWorker
+from pysilhouette.wakeup import WakeupChannel
+from pysilhouette.lease import Reaper
+from pysilhouette.fairshare import FairShare
 
 class Performer(ER):
     """Performer Class
@@ -51,58 +55,191 @@ class Performer(ER):
         self._fifo('performer')
         self._setdaemon()
         self.db = create_database(self.cf)
+        self.channel = WakeupChannel(self.cf, 'performer')
+        self.lanes = {} #: lane: LaneWorker
+        self.reaper = Reaper(self.cf, self.db, JOBGROUP_TYPE['SERIAL'])
+        self.fair = FairShare(self.cf, 'performer')
+        self.uniq_key = unicode(self.cf['env.uniqkey'], 'utf-8')
 
     def process(self):
         self.logger.info('performer : [started]')
-        while True:
-            fp = open(self.cf["performer.mkfifo.path"], 'r')
-            try:
-                code = fp.read()
-            finally:
-                fp.close()
-                
-            #self.logger.info('Received code from the FIFO file. - code=%s' % code)
-            session = self.db.get_session()
-            m_jgs = jobgroup_findbytype_status(session, JOBGROUP_TYPE['SERIAL'])
-            session.close()
-            #self.logger.info('Queued the Job Group from the database. - Number of JobGroup=%d' % len(m_jgs))
-            self.logger.info('Activity Information. - [fifo_code=%s, type=serial, jobgroup_num=%d]' % (code, len(m_jgs)))
-            if code == self.cf["performer.mkfifo.start.code"]:
-                if 0 < len(m_jgs):
-                    for m_jg in m_jgs:
-                        try:
-                            w = SimpleWorker(self.cf, self.db, m_jg.id)
-                            w.process()
-                        except Exception, e:
-                            self.logger.info('Failed to perform the job group. Exceptions are not expected. - jobgroup_id=%d : %s'
-                                         % (m_jg.id, str(e.args)))
-                            print >>sys.stderr, traceback.format_exc()
-                            t_logger = logging.getLogger('pysilhouette_traceback')
-                            t_logger.error(traceback.format_exc())
+        try:
+            while True:
+                code = self.channel.next_code()
 
+                #self.logger.info('Received code from the FIFO file. - code=%s' % code)
+                self._reap()
+                self._age()
+                self._schedule()
+                session = self.db.get_session()
+                try:
+                    # The lanes also need the delayed ones, to keep their order.
+                    m_jgs = jobgroup_findbytype_status(session, JOBGROUP_TYPE['SERIAL'],
+                                                       uniq_key=self.uniq_key,
+                                                       due=self.cf['performer.worker.size'] <= 1)
+                finally:
+                    session.close()
+                #self.logger.info('Queued the Job Group from the database. - Number of JobGroup=%d' % len(m_jgs))
+                self.logger.info('Activity Information. - [fifo_code=%s, type=serial, jobgroup_num=%d]' % (code, len(m_jgs)))
+                if code == self.cf["performer.mkfifo.start.code"]:
+                    if 1 < self.cf['performer.worker.size']:
+                        num = self._dispatch(m_jgs)
+                        self.channel.scanned(num) # Woken up when a lane is done.
+                    elif 0 < len(m_jgs):
+                        if self.fair.is_on() is True:
+                            m_jgs = self.fair.select(self.fair.group(m_jgs))
+                        for m_jg in m_jgs:
                             try:
-                                session = self.db.get_session()
-                                jobgroup_update(session, m_jg, JOBGROUP_STATUS['APPERR'])
-                                session.close()
-                            except:
-                                logger.error('Failed to change the status of the job group. - jobgroup_id=%d : %s'
+                                w = SimpleWorker(self.cf, self.db, m_jg.id)
+                                w.process()
+                            except Exception, e:
+                                self.logger.info('Failed to perform the job group. Exceptions are not expected. - jobgroup_id=%d : %s'
                                              % (m_jg.id, str(e.args)))
+                                print >>sys.stderr, traceback.format_exc()
                                 t_logger = logging.getLogger('pysilhouette_traceback')
                                 t_logger.error(traceback.format_exc())
 
+                                try:
+                                    session = self.db.get_session()
+                                    jobgroup_update(session, m_jg, JOBGROUP_STATUS['APPERR'])
+                                    session.close()
+                                except:
+                                    logger.error('Failed to change the status of the job group. - jobgroup_id=%d : %s'
+                                                 % (m_jg.id, str(e.args)))
+                                    t_logger = logging.getLogger('pysilhouette_traceback')
+                                    t_logger.error(traceback.format_exc())
+
+                        # More may have been registered while running, scan again at once.
+                        self.channel.scanned(len(m_jgs), True)
+                    else:
+                        #self.logger.info('No Job Group.')
+                        self.channel.scanned(0)
+                elif code == self.cf["performer.mkfifo.stop.code"]:
+                    self.logger.warning('Received stop code from the FIFO file. - code=%s' % code)
+                    for worker in self.lanes.values():
+                        worker.join() # Let the running job groups finish.
+                    return PROCSUCCESS
                 else:
-                    #self.logger.info('No Job Group.')
-                    pass
-            elif code == self.cf["performer.mkfifo.stop.code"]:
-                self.logger.warning('Received stop code from the FIFO file. - code=%s' % code)
-                return PROCSUCCESS
-            else:
-                self.logger.warning('Received illegal code from the FIFO file. - code=%s' % code)
+                    self.logger.warning('Received illegal code from the FIFO file. - code=%s' % code)
+        finally:
+            self.channel.close() # also on SIGTERM (SystemExit)
+
+    def _age(self):
+        """Raise the priority of the job groups that have been waiting for
+        performer.priority.aging seconds, so that they are not starved.
+        Up to performer.priority.aging.max.
+        """
+        if self.cf['performer.priority.aging'] <= 0:
+            return
+        before = datetime.datetime.now() - datetime.timedelta(seconds=self.cf['performer.priority.aging'])
+        try:
+            session = self.db.get_session()
+            try:
+                num = jobgroup_age(session, JOBGROUP_TYPE['SERIAL'], before, self.uniq_key,
+                                   self.cf['performer.priority.aging.max'])
+                if 0 < num:
+                    self.logger.debug('Raised the priority of the waiting job groups. - jobgroup_num=%d' % num)
+            finally:
+                session.close()
+        except Exception, e:
+            self.logger.error('Failed to raise the priority of the waiting job groups. - %s' % str(e.args))
+            t_logger = logging.getLogger('pysilhouette_traceback')
+            t_logger.error(traceback.format_exc())
+
+    def _schedule(self):
+        """Wake up when the next delayed job group is due. (run_after)"""
+        try:
+            session = self.db.get_session()
+            try:
+                run_after = jobgroup_next_run_after(session, JOBGROUP_TYPE['SERIAL'], self.uniq_key)
+            finally:
+                session.close()
+            if not run_after is None:
+                self.channel.wake_at(run_after)
+        except Exception, e:
+            self.logger.error('Failed to look for the delayed job groups. - %s' % str(e.args))
+            t_logger = logging.getLogger('pysilhouette_traceback')
+            t_logger.error(traceback.format_exc())
+
+    def _reap(self):
+        """Take back the job groups of killed performers. (lease.expired)"""
+        try:
+            self.reaper.reap()
+        except Exception, e:
+            self.logger.error('Failed to take back the expired job groups. - %s' % str(e.args))
+            t_logger = logging.getLogger('pysilhouette_traceback')
+            t_logger.error(traceback.format_exc())
+
+    def _dispatch(self, m_jgs):
+        """Start a LaneWorker for each lane of the pending job groups, up to
+        performer.worker.size lanes at the same time. A lane which is still
+        running gets its new job groups after it is done, which keeps them
+        in order. The fair share picks whole lanes, the tenant of a lane is
+        the one of its oldest job group.
+        @param m_jgs: Pending job groups, also the delayed ones. (split_lanes)
+        @return: Number of job groups ready to run.
+        """
+        for (lane, worker) in self.lanes.items():
+            if worker.isAlive() is False:
+                del self.lanes[lane]
+
+        (lanes, jobgroup_ids, oldest) = split_lanes(m_jgs, self.cf['performer.lane.key'],
+                                                    datetime.datetime.now())
+        num = 0
+        for lane in lanes:
+            num += len(jobgroup_ids[lane])
+
+        lanes = [lane for lane in lanes if self.lanes.has_key(lane) is False]
+        if self.fair.is_on() is True:
+            candidates = {}
+            for lane in lanes:
+                candidates.setdefault(self.fair.tenant_of(oldest[lane]), []).append(lane)
+            lanes = self.fair.select(candidates,
+                                     self.cf['performer.worker.size'] - len(self.lanes))
+
+        for lane in lanes:
+            if self.cf['performer.worker.size'] <= len(self.lanes):
+                break
+            worker = LaneWorker(self.cf, self.db, lane, jobgroup_ids[lane])
+            worker.start()
+            self.lanes[lane] = worker
+            self.logger.info('Started the lane. - lane=%s, jobgroup_id=%s' % (lane, jobgroup_ids[lane]))
+        return num
+
+def split_lanes(m_jgs, key, now):
+    """Split the pending job groups into their lanes, in order of the oldest
+    job group. A lane stops at its first job group whose "run_after" has not
+    come (delayed or retried), the ones after it wait for it.
+    @param m_jgs: Pending job groups in the order they run, also the delayed ones.
+    @param key: performer.lane.key
+    @rtype: tuple
+    @return: (lanes, {lane: [jobgroup_id, ...]}, {lane: oldest JobGroup})
+    """
+    lanes = []
+    jobgroup_ids = {}
+    oldest = {}
+    stopped = set()
+    for m_jg in m_jgs:
+        lane = getattr(m_jg, key)
+        if lane is None:
+            lane = u'' # default lane
+        if lane in stopped:
+            continue
+        if not m_jg.run_after is None and now < m_jg.run_after:
+            stopped.add(lane)
+            continue
+        if jobgroup_ids.has_key(lane) is False:
+            lanes.append(lane)
+            jobgroup_ids[lane] = []
+            oldest[lane] = m_jg
+        jobgroup_ids[lane].append(m_jg.id)
+    return (lanes, jobgroup_ids, oldest)
 
 # --
 def sigterm_handler(signum, frame):
     logger = logging.getLogger('pysilhouette.performer.signal')
     logger.info('Stop the performerd with signal - pid=%s, signal=%s' % (os.getpid(), signum))
+    sys.exit(os.getpid()) # The running lanes are still waited for.
 
 def main():
     (opts, args) = getopts()
@@ -76,8 +76,11 @@ def chkopts(opts):
     return False
 
 def parse_conf(cf):
-    from pysilhouette.util import is_int, is_key, set_cf_int
+    from pysilhouette.util import is_int, is_key, set_cf_int, set_cf_default
     from pysilhouette.uniqkey import is_uuid
+    from pysilhouette.archive import ARCHIVE_MODES
+    from pysilhouette.lease import LEASE_EXPIRED
+    from pysilhouette.fairshare import FAIR_KEYS
 
     # env
     err_key = ""
@@ -258,6 +261,268 @@ def parse_conf(cf):
     else:
         set_cf_int(cf, "job.popen.output.limit")
 
+    # job.parallel.size, job.rollback.parallel.size
+    set_cf_default(cf, "job.parallel.size", "4")
+    if is_int(cf["job.parallel.size"]) is False:
+        print >>sys.stderr, 'Must be a number. - job.parallel.size=%s' % (cf["job.parallel.size"])
+        return False
+    else:
+        set_cf_int(cf, "job.parallel.size")
+
+    if cf["job.parallel.size"] <= 0:
+        print >>sys.stderr, 'Please set values that are larger than 0. - job.parallel.size'
+        return False
+
+    set_cf_default(cf, "job.rollback.parallel.size", "1")
+    if is_int(cf["job.rollback.parallel.size"]) is False:
+        print >>sys.stderr, 'Must be a number. - job.rollback.parallel.size=%s' % (cf["job.rollback.parallel.size"])
+        return False
+    else:
+        set_cf_int(cf, "job.rollback.parallel.size")
+
+    if cf["job.rollback.parallel.size"] <= 0:
+        print >>sys.stderr, 'Please set values that are larger than 0. - job.rollback.parallel.size'
+        return False
+
+    # job.retry.backoff.max
+    set_cf_default(cf, "job.retry.backoff.max", "3600")
+    if is_int(cf["job.retry.backoff.max"]) is False:
+        print >>sys.stderr, 'Must be a number. - job.retry.backoff.max=%s' % (cf["job.retry.backoff.max"])
+        return False
+    else:
+        set_cf_int(cf, "job.retry.backoff.max")
+
+    # job.output.flush.*
+    set_cf_default(cf, "job.output.flush.interval", "3")
+    if is_int(cf["job.output.flush.interval"]) is False:
+        print >>sys.stderr, 'Must be a number. - job.output.flush.interval=%s' % (cf["job.output.flush.interval"])
+        return False
+    else:
+        set_cf_int(cf, "job.output.flush.interval")
+
+    set_cf_default(cf, "job.output.flush.size", "65536")
+    if is_int(cf["job.output.flush.size"]) is False:
+        print >>sys.stderr, 'Must be a number. - job.output.flush.size=%s' % (cf["job.output.flush.size"])
+        return False
+    else:
+        set_cf_int(cf, "job.output.flush.size")
+
+    # job.output.spool.*
+    set_cf_default(cf, "job.output.spool.path", "")
+    if 0 < len(cf["job.output.spool.path"]):
+        spool_dir = cf["job.output.spool.path"]
+        if os.path.exists(spool_dir) is False:
+            spool_dir = os.path.dirname(os.path.abspath(spool_dir)) # created by the worker
+        if os.access(spool_dir, os.R_OK | os.W_OK | os.X_OK) is False:
+            print >>sys.stderr, 'Incorrect file permissions. - job.output.spool.path=%s' % (cf["job.output.spool.path"])
+            return False
+
+    set_cf_default(cf, "job.output.spool.threshold", "65536")
+    if is_int(cf["job.output.spool.threshold"]) is False:
+        print >>sys.stderr, 'Must be a number. - job.output.spool.threshold=%s' % (cf["job.output.spool.threshold"])
+        return False
+    else:
+        set_cf_int(cf, "job.output.spool.threshold")
+
+    set_cf_default(cf, "job.output.spool.preview", "1024")
+    if is_int(cf["job.output.spool.preview"]) is False:
+        print >>sys.stderr, 'Must be a number. - job.output.spool.preview=%s' % (cf["job.output.spool.preview"])
+        return False
+    else:
+        set_cf_int(cf, "job.output.spool.preview")
+
+    # <performer>.timer.interval (0=Off, started by the scheduler process)
+    # Default: The scheduler interval, backing off up to 12 times it.
+    set_cf_default(cf, "performer.timer.interval", str(cf["scheduler.interval"]))
+    if is_int(cf["performer.timer.interval"]) is False:
+        print >>sys.stderr, 'Must be a number. - performer.timer.interval=%s' % (cf["performer.timer.interval"])
+        return False
+    else:
+        set_cf_int(cf, "performer.timer.interval")
+
+    set_cf_default(cf, "performer.timer.interval.max", str(cf["performer.timer.interval"] * 12))
+    if is_int(cf["performer.timer.interval.max"]) is False:
+        print >>sys.stderr, 'Must be a number. - performer.timer.interval.max=%s' % (cf["performer.timer.interval.max"])
+        return False
+    else:
+        set_cf_int(cf, "performer.timer.interval.max")
+
+    set_cf_default(cf, "asynperformer.timer.interval", str(cf["asynscheduler.interval"]))
+    if is_int(cf["asynperformer.timer.interval"]) is False:
+        print >>sys.stderr, 'Must be a number. - asynperformer.timer.interval=%s' % (cf["asynperformer.timer.interval"])
+        return False
+    else:
+        set_cf_int(cf, "asynperformer.timer.interval")
+
+    set_cf_default(cf, "asynperformer.timer.interval.max", str(cf["asynperformer.timer.interval"] * 12))
+    if is_int(cf["asynperformer.timer.interval.max"]) is False:
+        print >>sys.stderr, 'Must be a number. - asynperformer.timer.interval.max=%s' % (cf["asynperformer.timer.interval.max"])
+        return False
+    else:
+        set_cf_int(cf, "asynperformer.timer.interval.max")
+
+    # performer.worker.size, performer.lane.key
+    set_cf_default(cf, "performer.worker.size", "1")
+    if is_int(cf["performer.worker.size"]) is False:
+        print >>sys.stderr, 'Must be a number. - performer.worker.size=%s' % (cf["performer.worker.size"])
+        return False
+    else:
+        set_cf_int(cf, "performer.worker.size")
+
+    if cf["performer.worker.size"] <= 0:
+        print >>sys.stderr, 'Please set values that are larger than 0. - performer.worker.size'
+        return False
+
+    set_cf_default(cf, "performer.lane.key", "lane")
+    if (cf["performer.lane.key"] in ("lane", "register", "uniq_key")) is False:
+        print >>sys.stderr, 'The mistake is found in the set value. Please set lane, register or uniq_key. - performer.lane.key'
+        return False
+
+    # performer.priority.aging, asynperformer.priority.aging
+    set_cf_default(cf, "performer.priority.aging", "0")
+    if is_int(cf["performer.priority.aging"]) is False:
+        print >>sys.stderr, 'Must be a number. - performer.priority.aging=%s' % (cf["performer.priority.aging"])
+        return False
+    else:
+        set_cf_int(cf, "performer.priority.aging")
+
+    set_cf_default(cf, "performer.priority.aging.max", "10")
+    if is_int(cf["performer.priority.aging.max"]) is False:
+        print >>sys.stderr, 'Must be a number. - performer.priority.aging.max=%s' % (cf["performer.priority.aging.max"])
+        return False
+    else:
+        set_cf_int(cf, "performer.priority.aging.max")
+
+    set_cf_default(cf, "asynperformer.priority.aging", "0")
+    if is_int(cf["asynperformer.priority.aging"]) is False:
+        print >>sys.stderr, 'Must be a number. - asynperformer.priority.aging=%s' % (cf["asynperformer.priority.aging"])
+        return False
+    else:
+        set_cf_int(cf, "asynperformer.priority.aging")
+
+    set_cf_default(cf, "asynperformer.priority.aging.max", "10")
+    if is_int(cf["asynperformer.priority.aging.max"]) is False:
+        print >>sys.stderr, 'Must be a number. - asynperformer.priority.aging.max=%s' % (cf["asynperformer.priority.aging.max"])
+        return False
+    else:
+        set_cf_int(cf, "asynperformer.priority.aging.max")
+
+    # asynperformer.executor, asynperformer.reactor.db.threads
+    set_cf_default(cf, "asynperformer.executor", "thread")
+    if (cf["asynperformer.executor"] in ("thread", "process", "reactor")) is False:
+        print >>sys.stderr, 'The mistake is found in the set value. Please set thread, process or reactor. - asynperformer.executor'
+        return False
+
+    set_cf_default(cf, "asynperformer.reactor.db.threads", "1")
+    if is_int(cf["asynperformer.reactor.db.threads"]) is False:
+        print >>sys.stderr, 'Must be a number. - asynperformer.reactor.db.threads=%s' % (cf["asynperformer.reactor.db.threads"])
+        return False
+    else:
+        set_cf_int(cf, "asynperformer.reactor.db.threads")
+
+    if cf["asynperformer.reactor.db.threads"] <= 0:
+        print >>sys.stderr, 'Please set values that are larger than 0. - asynperformer.reactor.db.threads'
+        return False
+
+    # performer.fair.*, asynperformer.fair.*
+    for name in ("performer", "asynperformer"):
+        set_cf_default(cf, "%s.fair.key" % name, "off")
+        if (cf["%s.fair.key" % name] in FAIR_KEYS) is False:
+            print >>sys.stderr, 'The mistake is found in the set value. Please set %s. - %s.fair.key=%s' \
+                  % (", ".join(FAIR_KEYS), name, cf["%s.fair.key" % name])
+            return False
+
+        set_cf_default(cf, "%s.fair.weight" % name, "1")
+        for key in cf.keys():
+            if key == "%s.fair.weight" % name or key.startswith("%s.fair.weight." % name):
+                if is_int(cf[key]) is False:
+                    print >>sys.stderr, 'Must be a number. - %s=%s' % (key, cf[key])
+                    return False
+                else:
+                    set_cf_int(cf, key)
+
+                if cf[key] <= 0:
+                    print >>sys.stderr, 'Please set values that are larger than 0. - %s' % key
+                    return False
+
+    set_cf_default(cf, "asynperformer.fair.cap", "0")
+    for key in cf.keys():
+        if key == "asynperformer.fair.cap" or key.startswith("asynperformer.fair.cap."):
+            if is_int(cf[key]) is False:
+                print >>sys.stderr, 'Must be a number. - %s=%s' % (key, cf[key])
+                return False
+            else:
+                set_cf_int(cf, key)
+
+            if cf[key] < 0:
+                print >>sys.stderr, 'Please set values that are 0 or larger. - %s' % key
+                return False
+
+    # lease.*
+    set_cf_default(cf, "lease.time", "300")
+    if is_int(cf["lease.time"]) is False:
+        print >>sys.stderr, 'Must be a number. - lease.time=%s' % (cf["lease.time"])
+        return False
+    else:
+        set_cf_int(cf, "lease.time")
+
+    set_cf_default(cf, "lease.expired", "apperr")
+    if (cf["lease.expired"] in LEASE_EXPIRED.keys()) is False:
+        print >>sys.stderr, 'The mistake is found in the set value. Please set apperr or pend. - lease.expired=%s' % (cf["lease.expired"])
+        return False
+
+    # archive.*
+    set_cf_default(cf, "archive.mode", "off")
+    if (cf["archive.mode"] in ARCHIVE_MODES) is False:
+        print >>sys.stderr, 'The mistake is found in the set value. Please set %s. - archive.mode=%s' \
+              % (' or '.join(ARCHIVE_MODES), cf["archive.mode"])
+        return False
+
+    set_cf_default(cf, "archive.age", "30")
+    if is_int(cf["archive.age"]) is False:
+        print >>sys.stderr, 'Must be a number. - archive.age=%s' % (cf["archive.age"])
+        return False
+    else:
+        set_cf_int(cf, "archive.age")
+
+    set_cf_default(cf, "archive.interval", "3600")
+    if is_int(cf["archive.interval"]) is False:
+        print >>sys.stderr, 'Must be a number. - archive.interval=%s' % (cf["archive.interval"])
+        return False
+    else:
+        set_cf_int(cf, "archive.interval")
+
+    set_cf_default(cf, "archive.batch.size", "100")
+    if is_int(cf["archive.batch.size"]) is False:
+        print >>sys.stderr, 'Must be a number. - archive.batch.size=%s' % (cf["archive.batch.size"])
+        return False
+    else:
+        set_cf_int(cf, "archive.batch.size")
+
+    set_cf_default(cf, "archive.batch.wait", "1")
+    if is_int(cf["archive.batch.wait"]) is False:
+        print >>sys.stderr, 'Must be a number. - archive.batch.wait=%s' % (cf["archive.batch.wait"])
+        return False
+    else:
+        set_cf_int(cf, "archive.batch.wait")
+
+    if cf["archive.batch.size"] <= 0:
+        print >>sys.stderr, 'Please set values that are larger than 0. - archive.batch.size'
+        return False
+
+    set_cf_default(cf, "archive.export.path", "")
+    if cf["archive.mode"] == "export":
+        if os.access(cf["archive.export.path"], os.R_OK | os.W_OK | os.X_OK) is False:
+            print >>sys.stderr, 'Incorrect file permissions. - archive.export.path=%s' % (cf["archive.export.path"])
+            return False
+
+    set_cf_default(cf, "observer.target.archiver",
+                   os.path.join(os.path.dirname(cf["observer.target.performer"]), 'archiver.py'))
+    if cf["archive.mode"] != "off" \
+           and os.access(cf["observer.target.archiver"], os.R_OK) is False:
+        print >>sys.stderr, 'Incorrect file permissions. - observer.target.archiver=%s' % (cf["observer.target.archiver"])
+        return False
+
     # performer
     p_mkfifo = set([cf["performer.mkfifo.start.code"],
                     cf["performer.mkfifo.ignore.code"],
@@ -324,6 +589,33 @@ def parse_conf(cf):
             print >>sys.stderr, 'File not found. - job.whitelist.path=%s' % (cf["job.whitelist.path"])
             return False
 
+    # database.sqlite.*
+    set_cf_default(cf, "database.sqlite.journal.mode", "WAL")
+    cf["database.sqlite.journal.mode"] = cf["database.sqlite.journal.mode"].upper()
+    if (cf["database.sqlite.journal.mode"] in ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")) is False:
+        print >>sys.stderr, 'The mistake is found in the set value. Please set DELETE, TRUNCATE, PERSIST, MEMORY, WAL or OFF. - database.sqlite.journal.mode'
+        return False
+
+    set_cf_default(cf, "database.sqlite.synchronous", "NORMAL")
+    cf["database.sqlite.synchronous"] = cf["database.sqlite.synchronous"].upper()
+    if (cf["database.sqlite.synchronous"] in ("OFF", "NORMAL", "FULL")) is False:
+        print >>sys.stderr, 'The mistake is found in the set value. Please set OFF, NORMAL or FULL. - database.sqlite.synchronous'
+        return False
+
+    set_cf_default(cf, "database.sqlite.busy.timeout", "5000")
+    if is_int(cf["database.sqlite.busy.timeout"]) is False:
+        print >>sys.stderr, 'Must be a number. - database.sqlite.busy.timeout=%s' % (cf["database.sqlite.busy.timeout"])
+        return False
+    else:
+        set_cf_int(cf, "database.sqlite.busy.timeout")
+
+    set_cf_default(cf, "database.sqlite.cache.size", "-16384")
+    if is_int(cf["database.sqlite.cache.size"]) is False:
+        print >>sys.stderr, 'Must be a number. - database.sqlite.cache.size=%s' % (cf["database.sqlite.cache.size"])
+        return False
+    else:
+        set_cf_int(cf, "database.sqlite.cache.size")
+
     # database.pool.status
     if (cf["database.pool.status"] in ("0","1")) is False:
         print >>sys.stderr, 'The mistake is found in the set value. Please set 0 or 1. - database.pool.status'
@@ -0,0 +1,587 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import os
+import errno
+import select
+import signal
+import logging
+import traceback
+import threading
+import Queue
+
+from pysilhouette.util import spawn, proc_result, kill_proc, monotonic, \
+     OutputBuffer, PIPE_READ_SIZE
+from pysilhouette.db.model import JOBGROUP_STATUS, ACTION_STATUS
+from pysilhouette.db.access import jobgroup_findbyid, jobgroup_update, \
+     jobgroup_claim, job_findbyjobgroup_id
+from pysilhouette.worker import SimpleWorker
+from pysilhouette.lease import claim_owner, lease_expire, start_keeper
+
+#: Seconds a timed out command is given to exit after SIGTERM.
+#: Then it is killed with SIGKILL and its pipes are closed.
+KILL_GRACE = 3
+
+class Command:
+    """A command running under the reactor.
+    Same result as util.popen, but nothing here blocks.
+    """
+    def __init__(self, cmd, timeout=0, lang='C', limit=1048576, job_id=None, sink=None):
+        self.proc = spawn(cmd, lang, job_id)
+        out_fd = self.proc.stdout.fileno()
+        err_fd = self.proc.stderr.fileno()
+        self.outputs = {out_fd: OutputBuffer(int(limit), 'stdout', sink),
+                        err_fd: OutputBuffer(int(limit), 'stderr', sink),
+                        }
+        self.fds = [out_fd, err_fd]
+        self.sink = sink
+        self.deadline = None
+        if 0 < int(timeout):
+            self.deadline = monotonic() + int(timeout)
+        self.flushed = monotonic()
+        self.r_code = None
+        self.killed = None #: Time SIGTERM was sent
+
+    def read(self, fd):
+        data = os.read(fd, PIPE_READ_SIZE)
+        if data:
+            self.outputs[fd].write(data)
+        else:
+            self.fds.remove(fd) # EOF
+
+    def poll(self):
+        """True when the pipes are closed and the child is gone."""
+        if self.fds:
+            return False
+        self.r_code = self.proc.poll()
+        return not self.r_code is None
+
+    def expired(self, now):
+        return not self.deadline is None and self.deadline <= now
+
+    def terminate(self, now):
+        """Timeout. SIGTERM, the pipes are read until the command is gone
+        or KILL_GRACE seconds have passed. (r_code=None)
+        """
+        kill_proc(self.proc)
+        self.killed = now
+        self.deadline = now + KILL_GRACE
+
+    def kill(self):
+        """Still running after the grace period (the child ignores SIGTERM
+        or a grandchild holds the pipes). SIGKILL and stop reading, keeps
+        what is already in the pipes. The child is reaped here, SIGKILL
+        does not let it linger.
+        """
+        if self.proc.poll() is None:
+            try:
+                os.kill(self.proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self.proc.wait()
+        if self.fds:
+            (rlist, wlist, xlist) = select.select(self.fds, [], [], 0)
+            for fd in rlist:
+                self.read(fd)
+        self.fds = []
+
+    def result(self):
+        if not self.killed is None:
+            return proc_result(self.proc, self.outputs, None)
+        return proc_result(self.proc, self.outputs, self.r_code)
+
+class Reactor(threading.Thread):
+    """One thread waiting on the pipes of all the running commands.
+    callback(proc_info) is called on this thread when a command is over,
+    it must not block.
+    """
+    def __init__(self, waittime=1):
+        threading.Thread.__init__(self, name='Reactor')
+        self.setDaemon(1)
+        self.waittime = int(waittime)
+        if self.waittime <= 0:
+            self.waittime = 1
+        self.logger = logging.getLogger('pysilhouette.reactor')
+        self.commands = {} # Command: callback
+        self.lock = threading.Lock()
+        self._new = []
+        (self._wake_r, self._wake_w) = os.pipe()
+        self._running = True
+
+    def add(self, command, callback):
+        self.lock.acquire()
+        try:
+            self._new.append((command, callback))
+        finally:
+            self.lock.release()
+        os.write(self._wake_w, 'x')
+
+    def stop(self):
+        self._running = False
+        os.write(self._wake_w, 'x')
+        self.join()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _timeout(self, now, delay):
+        wait = self.waittime
+        for command in self.commands.keys():
+            if not command.fds:
+                # The pipes were closed, the child is about to be gone.
+                wait = min(wait, delay)
+            if not command.deadline is None:
+                wait = min(wait, max(command.deadline - now, 0))
+        return wait
+
+    def run(self):
+        delay = 0.001
+        while self._running:
+            self.lock.acquire()
+            try:
+                for (command, callback) in self._new:
+                    self.commands[command] = callback
+                self._new = []
+            finally:
+                self.lock.release()
+
+            fds = {}
+            for command in self.commands.keys():
+                for fd in command.fds:
+                    fds[fd] = command
+            try:
+                (rlist, wlist, xlist) = select.select(fds.keys() + [self._wake_r], [], [],
+                                                      self._timeout(monotonic(), delay))
+            except select.error, se:
+                if se.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd in rlist:
+                if fd == self._wake_r:
+                    os.read(self._wake_r, 512)
+                else:
+                    fds[fd].read(fd)
+
+            now = monotonic()
+            exiting = False
+            for command in self.commands.keys():
+                if command.poll() is False:
+                    if command.expired(now) is True and command.killed is None:
+                        self.logger.info('The command timed out. - pid=%d' % command.proc.pid)
+                        command.terminate(now)
+                    if command.expired(now) is False:
+                        if not command.fds:
+                            exiting = True
+                        if not command.sink is None and self.waittime <= now - command.flushed:
+                            command.sink.flush()
+                            command.flushed = now
+                        continue
+                    self.logger.info('The command did not exit after SIGTERM, killed. - pid=%d'
+                                     % command.proc.pid)
+                    command.kill()
+
+                callback = self.commands.pop(command)
+                try:
+                    callback(command.result())
+                except:
+                    t_logger = logging.getLogger('pysilhouette_traceback')
+                    t_logger.error(traceback.format_exc())
+
+            if exiting is True:
+                delay = min(delay * 2, 1)
+            else:
+                delay = 0.001
+
+class DBExecutor:
+    """Threads doing the database work of the reactor jobgroups.
+    The work of one jobgroup always goes to the same thread, in order.
+    """
+    def __init__(self, size):
+        self.logger = logging.getLogger('pysilhouette.reactor.dbexecutor')
+        self.queues = []
+        self.threads = []
+        for i in range(size):
+            queue = Queue.Queue()
+            th = threading.Thread(target=self._run, args=(queue,), name='DBExecutor-%d' % i)
+            th.setDaemon(1)
+            th.start()
+            self.queues.append(queue)
+            self.threads.append(th)
+
+    def post(self, key, func, *args):
+        self.queues[key % len(self.queues)].put((func, args))
+
+    def _run(self, queue):
+        while True:
+            task = queue.get()
+            if task is None: # stop
+                break
+            try:
+                task[0](*task[1])
+            except:
+                t_logger = logging.getLogger('pysilhouette_traceback')
+                t_logger.error(traceback.format_exc())
+
+    def stop(self):
+        for queue in self.queues:
+            queue.put(None)
+        for th in self.threads:
+            th.join()
+
+class SinkProxy:
+    """OutputSink of a reactor command. The writes are done by the DBExecutor."""
+    def __init__(self, executor, key, sink):
+        self.executor = executor
+        self.key = key
+        self.sink = sink
+
+    def write(self, name, data):
+        self.executor.post(self.key, self.sink.write, name, data)
+
+    def flush(self):
+        self.executor.post(self.key, self.sink.flush)
+
+class ReactorWorker(SimpleWorker):
+    """SimpleWorker run by ReactorPool.
+    Nothing waits for the commands: each step runs on the DBExecutor and
+    ends by handing a command to the reactor, whose end starts the next step.
+    The jobgroup keeps its own session from start to end.
+    """
+    def __init__(self, cf, db, jobgroup_id, pool):
+        SimpleWorker.__init__(self, cf, db, jobgroup_id)
+        self.logger = logging.getLogger('pysilhouette.reactor.reactorworker')
+        self.pool = pool
+        self.phase = None # action, rollback, finish
+        self._session = None
+        self._m_jobs = []
+        self._m_job = None
+        self._sink = None
+        self._graph = None
+        self._error = None
+
+    def getName(self):
+        return 'ReactorWorker-%d' % self._jobgroup_id
+
+    def start(self):
+        self.pool.post(self._jobgroup_id, self._step, self._start)
+
+    def _step(self, func, *args):
+        try:
+            func(*args)
+        except Exception, e:
+            self._failed(e)
+
+    def _failed(self, e):
+        t_logger = logging.getLogger('pysilhouette_traceback')
+        t_logger.info(traceback.format_exc())
+        try:
+            if self.phase == 'action':
+                self.logger.info('%s, Failed to perform the job action. Exceptions are not expected. - jobgroup_id=%d : %s, JobGroup status=%s'
+                                 % (self.getName(), self._jobgroup_id, str(e.args), JOBGROUP_STATUS['APPERR']))
+                jobgroup_update(self._session, self._m_jg, JOBGROUP_STATUS['APPERR'])
+                self._finish_start()
+                return
+            elif self.phase == 'rollback':
+                self.logger.info('Failed to perform a rollback. Exceptions are not expected. - jobgroup_id=%d : %s'
+                                 % (self._jobgroup_id, str(e.args)))
+                self._finish_start()
+                return
+            elif self.phase == 'finish':
+                self.logger.info('Failed to perform the finish action. Exceptions are not expected. - jobgroup_id=%d : %s'
+                                 % (self._jobgroup_id, str(e.args)))
+            else:
+                self.logger.error('%s - JobGroup execute failed. - jobgroup_id=%d : %s, JobGroup status=%s' \
+                                  % (self.getName(), self._jobgroup_id, str(e.args), JOBGROUP_STATUS['APPERR']))
+                session = self._db.new_session()
+                try:
+                    jobgroup_update(session,
+                                    jobgroup_findbyid(session, self._jobgroup_id, self._cf['env.uniqkey']),
+                                    JOBGROUP_STATUS['APPERR'])
+                finally:
+                    session.close()
+        except Exception, e:
+            self.logger.error('JobGroup failed to update. - jobgroup_id=%d : %s' \
+                              % (self._jobgroup_id, str(e.args)))
+            t_logger.error(traceback.format_exc())
+        self._close()
+
+    def _run(self, lcmd, limit, job_id, sink, callback):
+        proxy = None
+        if not sink is None:
+            proxy = SinkProxy(self.pool.executor, self._jobgroup_id, sink)
+        try:
+            command = Command(lcmd,
+                              self._cf['job.popen.timeout'],
+                              self._cf['job.popen.env.lang'],
+                              limit,
+                              job_id,
+                              proxy,
+                              )
+        except OSError, oe:
+            self.logger.info('%s command system failed!! jobgroup_id=%d : cmd=%s'
+                             % (self.phase, self._jobgroup_id, ' '.join(lcmd)))
+            raise oe
+
+        def done(proc_info):
+            if not sink is None:
+                self.pool.post(self._jobgroup_id, sink.close)
+            self.pool.post(self._jobgroup_id, self._step, callback, proc_info)
+        self.pool.reactor.add(command, done)
+
+    def _start(self):
+        self._session = self._db.new_session()
+        self._m_jg = jobgroup_findbyid(self._session,
+                                       self._jobgroup_id,
+                                       self._cf['env.uniqkey'])
+        if self._m_jg is None:
+            self._close()
+            return
+        start_keeper(self._cf, self._db)
+        if jobgroup_claim(self._session, self._m_jg, claim_owner(self._cf),
+                          lease=lease_expire(self._cf)) is False: # JobGroup RUN
+            self.logger.info('The JobGroup was claimed by another performer. - jobgroup_id=%d' % self._jobgroup_id)
+            self._close()
+            return
+        self._m_jobs = job_findbyjobgroup_id(self._session, self._jobgroup_id, False) # order asc
+        self.phase = 'action'
+        self._graph = self._action_graph(self._m_jobs)
+        if self._graph is None:
+            self._next_action(0)
+        else:
+            self._next_graph()
+
+    def _next_action(self, index):
+        while index < len(self._m_jobs) and self._m_jobs[index].status == ACTION_STATUS['OK']:
+            index += 1 # Done before a retry.
+        if len(self._m_jobs) <= index:
+            self._action_end(True)
+            return
+
+        self._m_job = self._m_jobs[index]
+        lcmd = self._action_command(self._session, self._m_job)
+        if lcmd is None:
+            self._action_end(False)
+            return
+
+        self._sink = self._output_sink(self._m_job.id, 'action')
+        self._run(lcmd, self._cf['job.popen.output.limit'], self._m_job.id, self._sink,
+                  lambda proc_info: self._action_done(index, proc_info))
+
+    def _action_done(self, index, proc_info):
+        if self._action_result(self._session, self._m_job, self._sink, proc_info) is False:
+            self._action_end(False)
+        else:
+            self._next_action(index + 1)
+
+    def _next_graph(self):
+        """Start the jobs that self._graph lets start, up to job.parallel.size
+        (action) or job.rollback.parallel.size (rollback) at the same time.
+        When nothing runs any more the phase is over. (SimpleWorker._run_graph)
+        """
+        if self.phase == 'action':
+            size = self._cf['job.parallel.size']
+            command = self._action_command
+        else:
+            size = self._cf['job.rollback.parallel.size']
+            command = self._rollback_command
+
+        while True:
+            ready = self._graph.ready()
+            if not ready or size <= self._graph.running():
+                break
+            m_job = ready[0]
+            self._graph.start(m_job)
+            lcmd = command(self._session, m_job)
+            if lcmd is None:
+                self._graph.end(m_job, False)
+                continue
+
+            sink = self._output_sink(m_job.id, self.phase)
+            job_id = None
+            if self.phase == 'action':
+                job_id = m_job.id
+            try:
+                self._run(lcmd, self._cf['job.popen.output.limit'], job_id, sink,
+                          lambda proc_info, m_job=m_job, sink=sink: self._graph_done(m_job, sink, proc_info))
+            except OSError, oe:
+                # Raised once the running jobs are done.
+                self._error = oe
+                self._graph.end(m_job, False)
+
+        if self._graph.running() <= 0:
+            self._session.commit()
+            if not self._error is None:
+                error = self._error
+                self._error = None
+                raise error
+            if self.phase == 'action':
+                self._action_end(self._graph.is_ok())
+            else:
+                self._finish_start()
+
+    def _graph_done(self, m_job, sink, proc_info):
+        if self.phase == 'action':
+            result = self._action_result
+        else:
+            result = self._rollback_result
+        try:
+            ret = result(self._session, m_job, sink, proc_info)
+            self._session.commit()
+        except Exception, e:
+            self._error = e
+            ret = False
+        self._graph.end(m_job, ret)
+        self._next_graph()
+
+    def _action_end(self, ret):
+        if ret is True:
+            # normal
+            jobgroup_update(self._session, self._m_jg, JOBGROUP_STATUS['OK'])
+            self._finish_start()
+        elif self._is_retry(self._m_jobs) is True:
+            # retry
+            self._retry(self._session)
+            self._close()
+        else:
+            # rollback
+            jobgroup_update(self._session, self._m_jg, JOBGROUP_STATUS['NG']) # JobGroup UPDATE
+            self.phase = 'rollback'
+            self._graph = self._rollback_graph(self._m_jobs)
+            self._next_graph()
+
+    def _finish_start(self):
+        self.phase = 'finish'
+        lcmd = self._finish_command()
+        if lcmd is None:
+            self._close()
+            return
+        self._run(lcmd, 1048576, None, None, self._finish_done)
+
+    def _finish_done(self, proc_info):
+        self._finish_result(proc_info)
+        self._close()
+
+    def _close(self):
+        try:
+            if not self._session is None:
+                self.logger.debug('close database session, session=%s' % self._session)
+                self._session.close()
+        finally:
+            self.pool.finished(self._jobgroup_id)
+
+class ReactorPool:
+    """Parallel jobgroups run without a thread each.
+    (AsynPerformer, asynperformer.executor=reactor)
+
+    Same interface as WorkerPool. One reactor thread waits on the pipes of
+    every running command, and asynperformer.reactor.db.threads threads do
+    the database work between the commands, so hundreds of jobgroups can
+    be in flight. callback is called on a DBExecutor thread after each
+    jobgroup.
+    """
+    def __init__(self, cf, db, size, callback=None):
+        self._cf = cf
+        self._db = db
+        self.size = size
+        self.callback = callback
+        self.logger = logging.getLogger('pysilhouette.reactor.reactorpool')
+        self.cond = threading.Condition()
+        self.inflight = set()
+        self.executor = DBExecutor(cf['asynperformer.reactor.db.threads'])
+        self.reactor = Reactor(cf['job.popen.waittime'])
+        self.reactor.start()
+
+    def busy(self):
+        """Number of jobgroups in flight."""
+        self.cond.acquire()
+        try:
+            return len(self.inflight)
+        finally:
+            self.cond.release()
+
+    def free(self):
+        """Number of jobgroups the pool can take now."""
+        return self.size - self.busy()
+
+    def has(self, jobgroup_id):
+        """Whether the jobgroup is in flight."""
+        self.cond.acquire()
+        try:
+            return jobgroup_id in self.inflight
+        finally:
+            self.cond.release()
+
+    def put(self, jobgroup_id):
+        """Start a jobgroup. Returns False when the pool is full
+        or the jobgroup is already in flight.
+        """
+        self.cond.acquire()
+        try:
+            if jobgroup_id in self.inflight or self.size <= len(self.inflight):
+                return False
+            self.inflight.add(jobgroup_id)
+        finally:
+            self.cond.release()
+        ReactorWorker(self._cf, self._db, jobgroup_id, self).start()
+        self.logger.debug('Started the JobGroup. - jobgroup_id=%d' % jobgroup_id)
+        return True
+
+    def post(self, jobgroup_id, func, *args):
+        self.executor.post(jobgroup_id, func, *args)
+
+    def finished(self, jobgroup_id):
+        self.cond.acquire()
+        try:
+            self.inflight.discard(jobgroup_id)
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+        if not self.callback is None:
+            try:
+                self.callback(jobgroup_id)
+            except:
+                t_logger = logging.getLogger('pysilhouette_traceback')
+                t_logger.error(traceback.format_exc())
+
+    def stop(self, wait=True):
+        """Let the jobgroups in flight finish, then stop the threads."""
+        if wait is True:
+            self.cond.acquire()
+            try:
+                while self.inflight:
+                    self.cond.wait(1)
+            finally:
+                self.cond.release()
+        self.reactor.stop()
+        self.executor.stop()
+
+if __name__ == '__main__':
+    pass
@@ -45,6 +45,8 @@ from pysilhouette import PROCERROR, PROCSUCCESS
 from pysilhouette.prep import readconf, getopts, chkopts, parse_conf
 from pysilhouette.daemon import daemonize, observer
 from pysilhouette.log import reload_conf
+from pysilhouette.db import create_database
+from pysilhouette.db.migrate import outdated
 
 opt = None #: command options
 
@@ -89,6 +91,21 @@ def main():
         print >>sys.stdout, cf["env.uniqkey"]
         return PROCSUCCESS
 
+    # The daemons would fail on every job group with an older database.
+    missing = []
+    try:
+        db = create_database(cf)
+        try:
+            missing = outdated(db.get_metadata())
+        finally:
+            db.get_engine().dispose()
+    except Exception, e:
+        logger.warning('Failed to check the database. - %s' % str(e.args))
+    if missing:
+        logger.error('The database is not up to date. Please run psil-upgradedb. - %s' % ', '.join(missing))
+        print >>sys.stderr, 'The database is not up to date. Please run psil-upgradedb. - %s' % ', '.join(missing)
+        return PROCERROR
+
     if opts.daemon is True:
         logger.debug('Daemon stdin=%s' % cf['daemon.stdin'])
         logger.debug('Daemon stdout=%s' % cf['daemon.stdout'])
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import os
+import gzip
+import logging
+
+#: Output files per sub directory.
+SPOOL_FILES_PER_DIR = 1000
+
+def output_path(spool_dir, job_id, stream):
+    """Spool file of one output of the job.
+    <spool_dir>/<job_id / 1000>/<job_id>.<stream>.gz
+    @param stream: action_stdout, action_stderr, rollback_stdout or rollback_stderr
+    @type stream: str
+    """
+    return os.path.join(spool_dir,
+                        str(int(job_id) / SPOOL_FILES_PER_DIR),
+                        '%d.%s.gz' % (int(job_id), stream))
+
+def write_output(spool_dir, job_id, stream, data):
+    """Write the output compressed into the spool directory.
+    @return: spool file path
+    @rtype: str
+    """
+    path = output_path(spool_dir, job_id, stream)
+    dname = os.path.dirname(path)
+    if os.path.isdir(dname) is False:
+        try:
+            os.makedirs(dname)
+        except OSError:
+            if os.path.isdir(dname) is False: # Not created by another worker
+                raise
+
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    fp = gzip.GzipFile(tmp, 'wb')
+    try:
+        fp.write(data)
+    finally:
+        fp.close()
+    os.rename(tmp, path)
+    return path
+
+def read_output(path):
+    """Read the output from the spool file.
+    @rtype: unicode
+    """
+    fp = gzip.GzipFile(path, 'rb')
+    try:
+        return unicode(fp.read(), 'utf-8', 'replace')
+    finally:
+        fp.close()
+
+def remove_spool(spool_dir):
+    """Remove all the spool files and their sub directories. (psil-cleandb)
+    Other files in "spool_dir" are left alone.
+    @return: Number of the files removed.
+    @rtype: int
+    """
+    ret = 0
+    if os.path.isdir(spool_dir) is False:
+        return ret
+    for sub in os.listdir(spool_dir):
+        dname = os.path.join(spool_dir, sub)
+        if sub.isdigit() is False or os.path.isdir(dname) is False:
+            continue
+        for name in os.listdir(dname):
+            if name.endswith('.gz') or name.endswith('.tmp'):
+                if remove_output(os.path.join(dname, name)) is True:
+                    ret += 1
+        if not os.listdir(dname):
+            os.rmdir(dname)
+    return ret
+
+def remove_output(path):
+    try:
+        os.unlink(path)
+        return True
+    except OSError, oe:
+        logger = logging.getLogger('pysilhouette.spool')
+        logger.warning('Failed to remove the spool file. - file=%s : %s' % (path, str(oe.args)))
+        return False
+
+if __name__ == '__main__':
+    pass
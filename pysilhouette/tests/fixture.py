@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import os
+import tempfile
+
+from pysilhouette.db import create_database
+from pysilhouette.db.model import JobGroup, Job, JOBGROUP_TYPE
+
+UNIQ_KEY = '2f21b1be-a132-415b-aab6-03cccecb6d7c'
+
+def make_cf(path, conf=None):
+    """Configuration of the tests, as after parse_conf.
+    @param conf: Values that differ from the defaults of the tests
+    @type conf: dict
+    """
+    cf = {'database.url': 'sqlite:///%s' % path,
+          'database.pool.status': 0,
+          'env.uniqkey': UNIQ_KEY,
+          'job.popen.timeout': 60,
+          'job.popen.waittime': 1,
+          'job.popen.env.lang': 'C',
+          'job.popen.output.limit': 1048576,
+          'job.whitelist.flag': '0',
+          'job.whitelist.path': '',
+          'job.parallel.size': 4,
+          'job.rollback.parallel.size': 1,
+          'job.retry.backoff.max': 3600,
+          'job.output.flush.interval': 0,
+          'job.output.flush.size': 65536,
+          'job.output.spool.path': '',
+          'job.output.spool.threshold': 65536,
+          'job.output.spool.preview': 1024,
+          'asynperformer.reactor.db.threads': 1,
+          'lease.time': 0,
+          'lease.expired': 'pend',
+          }
+    if not conf is None:
+        cf.update(conf)
+    return cf
+
+class DBFixture:
+    """A new SQLite database file with the tables, for one test.
+    Close it in tearDown.
+    """
+    def __init__(self, conf=None):
+        (fd, self.path) = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.cf = make_cf(self.path, conf)
+        self.db = create_database(self.cf)
+        self.db.get_metadata().drop_all()
+        self.db.get_metadata().create_all()
+
+    def execute(self, sql, *args):
+        return self.db.get_engine().execute(sql, *args)
+
+    def add(self, jobs, type=JOBGROUP_TYPE['SERIAL'], **kwargs):
+        """Register a jobgroup, returns its id.
+        @param jobs: Action commands, or dicts of the Job columns.
+        """
+        session = self.db.get_session()
+        try:
+            m_jg = JobGroup(u'test', unicode(UNIQ_KEY), type)
+            for (name, value) in kwargs.items():
+                setattr(m_jg, name, value)
+            for i in range(len(jobs)):
+                values = jobs[i]
+                if isinstance(values, basestring):
+                    values = {'action_command': values}
+                m_job = Job(u'job%d' % i, i, unicode(values['action_command']))
+                for (name, value) in values.items():
+                    if isinstance(value, str):
+                        value = unicode(value)
+                    setattr(m_job, name, value)
+                m_jg.jobs.append(m_job)
+            session.add(m_jg)
+            session.commit()
+            return m_jg.id
+        finally:
+            self.db.remove_session()
+
+    def close(self):
+        self.db.remove_session()
+        self.db.get_engine().dispose()
+        os.unlink(self.path)
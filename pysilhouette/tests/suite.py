@@ -32,8 +32,30 @@ import unittest
 
 from pysilhouette.tests.testprep import all_suite_prep
 from pysilhouette.tests.testworker import all_suite_worker
+from pysilhouette.tests.testaccess import all_suite_access
+from pysilhouette.tests.testretry import all_suite_retry
+from pysilhouette.tests.testgraph import all_suite_graph
+from pysilhouette.tests.testfairshare import all_suite_fairshare
+from pysilhouette.tests.testlease import all_suite_lease
+from pysilhouette.tests.testexecutor import all_suite_executor
+from pysilhouette.tests.testwakeup import all_suite_wakeup
+from pysilhouette.tests.testarchive import all_suite_archive
+from pysilhouette.tests.testmigrate import all_suite_migrate
+from pysilhouette.tests.testspool import all_suite_spool
+from pysilhouette.tests.testdb import all_suite_db
 
 ts = unittest.TestSuite()
 ts.addTest(all_suite_prep())
 ts.addTest(all_suite_worker())
+ts.addTest(all_suite_access())
+ts.addTest(all_suite_retry())
+ts.addTest(all_suite_graph())
+ts.addTest(all_suite_fairshare())
+ts.addTest(all_suite_lease())
+ts.addTest(all_suite_executor())
+ts.addTest(all_suite_wakeup())
+ts.addTest(all_suite_archive())
+ts.addTest(all_suite_migrate())
+ts.addTest(all_suite_spool())
+ts.addTest(all_suite_db())
 unittest.TextTestRunner(verbosity=2).run(ts)
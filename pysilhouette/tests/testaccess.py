@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+import pysilhouette.db.access as target
+from pysilhouette.db.model import JobGroup, JOBGROUP_TYPE, JOBGROUP_STATUS
+from pysilhouette.worker import SimpleWorker, OutputSink
+from pysilhouette.tests.fixture import DBFixture, UNIQ_KEY
+
+# u'\u3042\u3044\n' and u'\u3046\u3048\n', 3 bytes a character in UTF-8
+FIRST = '\xe3\x81\x82\xe3\x81\x84\n'
+SECOND = '\xe3\x81\x86\xe3\x81\x88\n'
+
+class TestAccess(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fixture = DBFixture({'job.output.flush.interval': 1,
+                                  'job.output.spool.path': self.tmp_dir,
+                                  'job.output.spool.threshold': 8,
+                                  'job.output.spool.preview': 4,
+                                  })
+        self.session = self.fixture.db.get_session()
+
+    def tearDown(self):
+        self.fixture.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def tail(self, offset):
+        session = self.fixture.db.new_session()
+        try:
+            return target.job_output_tail(session, 1, 'action_stdout', offset)
+        finally:
+            session.close()
+
+    def plan(self, query):
+        """EXPLAIN QUERY PLAN of a Query, one line."""
+        statement = query.statement.compile(dialect=self.session.bind.dialect)
+        params = [statement.params[name] for name in statement.positiontup]
+        rows = self.fixture.execute('EXPLAIN QUERY PLAN %s' % statement, *params).fetchall()
+        return ' / '.join([row[len(row) - 1] for row in rows])
+
+    def test_scan_0(self):
+        # The index gives the order of the scan, no sort.
+        for uniq_key in (None, UNIQ_KEY):
+            query = target._query_type_status(self.session, JOBGROUP_TYPE['SERIAL'],
+                                              JOBGROUP_STATUS['PEND'], uniq_key).order_by(
+                JobGroup.priority.desc(), JobGroup.id.asc()).limit(10)
+            plan = self.plan(query)
+            self.assertTrue('ix_jobgroup_type_status_priority_desc_id' in plan, plan)
+            self.assertFalse('TEMP B-TREE' in plan, plan)
+
+    def test_scan_1(self):
+        for priority in (0, 2, 1, 2):
+            self.fixture.add(['/bin/true'], priority=priority)
+        self.fixture.add(['/bin/true'], JOBGROUP_TYPE['PARALLEL'], priority=5)
+        self.fixture.add(['/bin/true'], priority=9, status=JOBGROUP_STATUS['OK'])
+        m_jgs = target.jobgroup_findbytype_limit_status(self.session, JOBGROUP_TYPE['SERIAL'], 3)
+        self.assertEquals([(2, 2), (2, 4), (1, 3)], [(m_jg.priority, m_jg.id) for m_jg in m_jgs])
+
+    def test_output_tail_0(self):
+        # A character cut between two reads of the pipe.
+        self.fixture.add(['/bin/true'])
+        sink = OutputSink(self.fixture.db, 1, 'action', 60, 65536)
+        try:
+            for data in (FIRST[:4], FIRST[4:] + SECOND):
+                sink.write('stdout', data)
+                sink.flush(True)
+        finally:
+            sink.session.close()
+        self.assertEquals((FIRST.decode('utf-8') + SECOND.decode('utf-8'), 14), self.tail(0))
+        self.assertEquals((SECOND.decode('utf-8'), 14), self.tail(7))
+        self.assertEquals((u'', 14), self.tail(14))
+
+    def test_output_tail_1(self):
+        # While the command is running, then from the spool file after it.
+        flag = os.path.join(self.tmp_dir, 'flag')
+        script = os.path.join(self.tmp_dir, 'output.sh')
+        fp = open(script, 'w')
+        try:
+            fp.write("printf '%s'\nwhile [ ! -f %s ]; do sleep 0.1; done\nprintf '%s'\n"
+                     % (FIRST, flag, SECOND))
+        finally:
+            fp.close()
+        self.fixture.add([u'/bin/sh %s' % script])
+        worker = threading.Thread(target=SimpleWorker(self.fixture.cf, self.fixture.db, 1).process)
+        worker.start()
+        try:
+            for i in range(100):
+                (data, offset) = self.tail(0)
+                if data:
+                    break
+                time.sleep(0.1)
+            self.assertEquals((FIRST.decode('utf-8'), 7), (data, offset))
+        finally:
+            open(flag, 'w').close()
+            worker.join()
+        self.assertEquals((SECOND.decode('utf-8'), 14), self.tail(offset))
+        self.assertEquals((u'\ufffd\u3044\n' + SECOND.decode('utf-8'), 14), self.tail(2))
+        self.assertEquals((u'', 14), self.tail(14))
+
+class SuiteAccess(unittest.TestSuite):
+    def __init__(self):
+        tests = ['test_scan_0',
+                 'test_scan_1',
+                 'test_output_tail_0',
+                 'test_output_tail_1',
+                 ]
+        unittest.TestSuite.__init__(self,map(TestAccess, tests))
+
+def all_suite_access():
+    return unittest.TestSuite([SuiteAccess(),
+                               ])
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(all_suite_access())
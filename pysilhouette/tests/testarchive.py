@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import os
+import csv
+import shutil
+import datetime
+import tempfile
+import unittest
+
+import sqlalchemy.exc
+
+import pysilhouette.archive as target
+from pysilhouette.db.model import JOBGROUP_STATUS
+from pysilhouette.spool import write_output
+from pysilhouette.tests.fixture import DBFixture
+
+def later():
+    return datetime.datetime.now() + datetime.timedelta(minutes=1)
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.fixture = DBFixture()
+        self.metadata = self.fixture.db.get_metadata()
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.fixture.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def read_csv(self, name):
+        fp = open(os.path.join(self.tmp_dir, name), 'rb')
+        try:
+            return list(csv.reader(fp))
+        finally:
+            fp.close()
+
+    def count(self, table):
+        return self.fixture.execute('SELECT COUNT(*) FROM %s' % table).scalar()
+
+    def test_archive_batch_0(self):
+        ok = self.fixture.add(['/bin/true', '/bin/true'], status=JOBGROUP_STATUS['OK'])
+        ng = self.fixture.add(['/bin/false'], status=JOBGROUP_STATUS['NG'])
+        pend = self.fixture.add(['/bin/true'])
+
+        self.assertEquals(0, target.archive_batch(self.metadata, datetime.datetime(2000, 1, 1), 10, 'archive'))
+        self.assertEquals(1, target.archive_batch(self.metadata, later(), 1, 'archive'))
+        self.assertEquals(1, target.archive_batch(self.metadata, later(), 10, 'archive'))
+        self.assertEquals(0, target.archive_batch(self.metadata, later(), 10, 'archive'))
+
+        self.assertEquals([(pend,)], self.fixture.execute('SELECT id FROM jobgroup').fetchall())
+        self.assertEquals(1, self.count('job'))
+        self.assertEquals([ok, ng], [row[0] for row in self.fixture.execute(
+            'SELECT id FROM jobgroup_archive ORDER BY archive_id').fetchall()])
+        self.assertEquals([ok, ok, ng], [row[0] for row in self.fixture.execute(
+            'SELECT jobgroup_id FROM job_archive ORDER BY archive_id').fetchall()])
+        self.assertEquals(0, self.fixture.execute(
+            'SELECT COUNT(*) FROM job_archive WHERE archived IS NULL').scalar())
+
+    def test_archive_batch_1(self):
+        # An id used again after the archive. (A SQLite table without
+        # AUTOINCREMENT, or the jobgroup table rebuilt)
+        self.fixture.add(['/bin/true'], status=JOBGROUP_STATUS['OK'])
+        self.assertEquals(1, target.archive_batch(self.metadata, later(), 10, 'archive'))
+        self.fixture.execute("DELETE FROM sqlite_sequence")
+        self.fixture.add(['/bin/true'], status=JOBGROUP_STATUS['OK'])
+        self.assertEquals(1, target.archive_batch(self.metadata, later(), 10, 'archive'))
+        self.assertEquals([(1,), (1,)], self.fixture.execute(
+            'SELECT id FROM jobgroup_archive ORDER BY archive_id').fetchall())
+        self.assertEquals(2, self.count('job_archive'))
+
+    def test_archive_batch_2(self):
+        # The spooled output is not read back into the database.
+        path = write_output(self.tmp_dir, 1, 'action_stdout', 'spooled output')
+        self.fixture.add([{'action_command': u'/bin/true',
+                           'action_stdout': u'preview',
+                           'action_stdout_spool': unicode(path)}],
+                         status=JOBGROUP_STATUS['OK'])
+        self.assertEquals(1, target.archive_batch(self.metadata, later(), 10, 'archive'))
+        row = self.fixture.execute('SELECT action_stdout, action_stdout_spool FROM job_archive').fetchone()
+        self.assertEquals((u'preview', path), tuple(row))
+        self.assertTrue(os.path.isfile(path))
+
+    def test_archive_batch_3(self):
+        # export
+        path = write_output(self.tmp_dir, 1, 'action_stderr', 'spooled error')
+        self.fixture.add([{'action_command': u'/bin/true',
+                           'action_stderr_spool': unicode(path)}],
+                         status=JOBGROUP_STATUS['APPERR'])
+        self.assertEquals(1, target.archive_batch(self.metadata, later(), 10, 'export', self.tmp_dir))
+        self.assertEquals(0, self.count('jobgroup'))
+        self.assertEquals(0, self.count('job'))
+        self.assertEquals(0, self.count('jobgroup_archive'))
+        self.assertFalse(os.path.exists(path))
+
+        rows = self.read_csv('job.1-1.csv')
+        self.assertEquals(2, len(rows))
+        self.assertEquals('spooled error', rows[1][rows[0].index('action_stderr')])
+        self.assertEquals('', rows[1][rows[0].index('action_stderr_spool')])
+        self.assertEquals(2, len(self.read_csv('jobgroup.1-1.csv')))
+
+    def test_archive_batch_4(self):
+        # The commit failed, the batch is exported again into the same files.
+        self.fixture.add(['/bin/true'], status=JOBGROUP_STATUS['OK'])
+        self.fixture.add(['/bin/true', '/bin/true'], status=JOBGROUP_STATUS['NG'])
+        self.fixture.execute("CREATE TRIGGER test_abort BEFORE DELETE ON jobgroup "
+                             "BEGIN SELECT RAISE(ABORT, 'test'); END")
+        self.assertRaises(sqlalchemy.exc.SQLAlchemyError, target.archive_batch,
+                          self.metadata, later(), 10, 'export', self.tmp_dir)
+        self.assertEquals(2, self.count('jobgroup'))
+        self.assertEquals(4, len(self.read_csv('job.1-2.csv')))
+
+        self.fixture.execute("DROP TRIGGER test_abort")
+        self.assertEquals(2, target.archive_batch(self.metadata, later(), 10, 'export', self.tmp_dir))
+        self.assertEquals(0, self.count('jobgroup'))
+        self.assertEquals(4, len(self.read_csv('job.1-2.csv')))
+        self.assertEquals(3, len(self.read_csv('jobgroup.1-2.csv')))
+        self.assertEquals(['job.1-2.csv', 'jobgroup.1-2.csv'], sorted(os.listdir(self.tmp_dir)))
+
+    def test_archive_0(self):
+        for i in range(5):
+            self.fixture.add(['/bin/true'], status=JOBGROUP_STATUS['OK'])
+        self.assertEquals(0, target.archive(self.metadata, 'archive', 1, 2))
+        self.assertEquals(5, target.archive(self.metadata, 'archive', -1, 2))
+        self.assertEquals(5, self.count('jobgroup_archive'))
+
+class SuiteArchive(unittest.TestSuite):
+    def __init__(self):
+        tests = ['test_archive_batch_0',
+                 'test_archive_batch_1',
+                 'test_archive_batch_2',
+                 'test_archive_batch_3',
+                 'test_archive_batch_4',
+                 'test_archive_0',
+                 ]
+        unittest.TestSuite.__init__(self,map(TestArchive, tests))
+
+def all_suite_archive():
+    return unittest.TestSuite([SuiteArchive(),
+                               ])
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(all_suite_archive())
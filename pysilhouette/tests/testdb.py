@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import unittest
+
+from pysilhouette.db import sqlite_listeners
+from pysilhouette.tests.fixture import DBFixture, make_cf
+
+class TestDB(unittest.TestCase):
+
+    def setUp(self):
+        self.fixture = DBFixture({'database.sqlite.journal.mode': 'WAL',
+                                  'database.sqlite.synchronous': 'OFF',
+                                  'database.sqlite.busy.timeout': 1234,
+                                  })
+
+    def tearDown(self):
+        self.fixture.close()
+
+    def pragma(self, name):
+        return self.fixture.execute('PRAGMA %s' % name).scalar()
+
+    def test_pragma_0(self):
+        # Set on each connection of create_database.
+        self.fixture.db.get_engine().dispose()
+        self.assertEquals(u'wal', self.pragma('journal_mode'))
+        self.assertEquals(0, self.pragma('synchronous'))
+        self.assertEquals(1234, self.pragma('busy_timeout'))
+
+    def test_pragma_1(self):
+        self.assertEquals([], sqlite_listeners(make_cf('/tmp/none.db'))) # no key set
+        cf = make_cf('/tmp/none.db', {'database.sqlite.busy.timeout': 1234})
+        cf['database.url'] = 'mysql://localhost/pysilhouette'
+        self.assertEquals([], sqlite_listeners(cf))
+
+class SuiteDB(unittest.TestSuite):
+    def __init__(self):
+        tests = ['test_pragma_0',
+                 'test_pragma_1',
+                 ]
+        unittest.TestSuite.__init__(self,map(TestDB, tests))
+
+def all_suite_db():
+    return unittest.TestSuite([SuiteDB(),
+                               ])
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(all_suite_db())
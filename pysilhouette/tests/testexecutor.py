@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import os
+import time
+import signal
+import threading
+import unittest
+
+import pysilhouette.reactor as target
+from pysilhouette.db.model import JobGroup, JOBGROUP_TYPE, JOBGROUP_STATUS, \
+     ACTION_STATUS
+from pysilhouette.worker import ProcessPool
+from pysilhouette.tests.fixture import DBFixture
+
+class Results:
+    """Callback of the reactor, keeps the proc_info of the commands."""
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.values = []
+
+    def __call__(self, proc_info):
+        self.cond.acquire()
+        try:
+            self.values.append(proc_info)
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def wait(self, num, timeout):
+        end = time.time() + timeout
+        self.cond.acquire()
+        try:
+            while len(self.values) < num and time.time() < end:
+                self.cond.wait(end - time.time())
+            return self.values
+        finally:
+            self.cond.release()
+
+class TestReactor(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = target.Reactor(1)
+        self.reactor.start()
+        self.kill_grace = target.KILL_GRACE
+
+    def tearDown(self):
+        self.reactor.stop()
+        target.KILL_GRACE = self.kill_grace
+
+    def test_command_0(self):
+        results = Results()
+        self.reactor.add(target.Command(['/bin/sh', '-c', 'echo out; echo err >&2; exit 3']), results)
+        self.reactor.add(target.Command(['/bin/sh', '-c', 'sleep 0.2; echo late']), results)
+        values = results.wait(2, 5)
+        self.assertEquals(2, len(values))
+        self.assertEquals(('out\n', 'err\n', 3),
+                          (values[0]['stdout'], values[0]['stderr'], values[0]['r_code']))
+        self.assertEquals(('late\n', 0), (values[1]['stdout'], values[1]['r_code']))
+
+    def test_command_1(self):
+        # limit
+        results = Results()
+        self.reactor.add(target.Command(['/bin/sh', '-c', 'echo 0123456789'], limit=4), results)
+        values = results.wait(1, 5)
+        self.assertEquals(('0123', 11), (values[0]['stdout'], values[0]['stdout_size']))
+
+    def test_timeout_0(self):
+        results = Results()
+        start = time.time()
+        self.reactor.add(target.Command(['/bin/sh', '-c', 'echo start; exec sleep 10'], timeout=1), results)
+        values = results.wait(1, 5)
+        self.assertEquals(1, len(values))
+        self.assertTrue(values[0]['r_code'] is None)
+        self.assertEquals('start\n', values[0]['stdout'])
+        self.assertTrue(time.time() - start < 3)
+
+    def test_timeout_1(self):
+        # SIGTERM is ignored, SIGKILL after KILL_GRACE.
+        target.KILL_GRACE = 1
+        results = Results()
+        start = time.time()
+        command = target.Command(['/bin/sh', '-c', "trap '' TERM; echo start; exec sleep 10"], timeout=1)
+        self.reactor.add(command, results)
+        values = results.wait(1, 8)
+        self.assertEquals(1, len(values))
+        self.assertTrue(values[0]['r_code'] is None)
+        self.assertEquals('start\n', values[0]['stdout'])
+        self.assertTrue(1.8 < time.time() - start < 5)
+        self.assertEquals(-signal.SIGKILL, command.proc.returncode) # killed and reaped
+
+class TestPool(unittest.TestCase):
+
+    def setUp(self):
+        self.fixture = DBFixture()
+
+    def tearDown(self):
+        self.fixture.close()
+
+    def add(self, num):
+        ret = []
+        for i in range(num):
+            ret.append(self.fixture.add(["/bin/sh -c 'echo %d'" % i, '/bin/true'],
+                                        JOBGROUP_TYPE['PARALLEL']))
+        return ret
+
+    def results(self, jobgroup_ids):
+        session = self.fixture.db.new_session()
+        try:
+            ret = []
+            for jobgroup_id in jobgroup_ids:
+                m_jg = session.query(JobGroup).get(jobgroup_id)
+                ret.append((m_jg.status,
+                            [m_job.status for m_job in sorted(m_jg.jobs, key=lambda m_job: m_job.order)]))
+            return ret
+        finally:
+            session.close()
+
+    def run_pool(self, pool, jobgroup_ids, timeout):
+        """put() the jobgroups as the pool frees up."""
+        end = time.time() + timeout
+        waiting = list(jobgroup_ids)
+        while waiting and time.time() < end:
+            if pool.put(waiting[0]) is True:
+                self.assertFalse(pool.put(waiting[0])) # already in flight
+                waiting.pop(0)
+            else:
+                time.sleep(0.05)
+        self.assertEquals([], waiting)
+
+    def test_process_pool_0(self):
+        jobgroup_ids = self.add(5)
+        pool = ProcessPool(self.fixture.cf, self.fixture.db, 2)
+        try:
+            self.run_pool(pool, jobgroup_ids, 30)
+        finally:
+            pool.stop()
+        self.assertEquals([(JOBGROUP_STATUS['OK'], [ACTION_STATUS['OK']] * 2)] * 5,
+                          self.results(jobgroup_ids))
+
+    def test_process_pool_1(self):
+        # The process died after the last _collect(), put() gets EPIPE.
+        jobgroup_ids = self.add(1)
+        pool = ProcessPool(self.fixture.cf, self.fixture.db, 1)
+        try:
+            pid = pool.processes[0].pid
+            os.kill(pid, signal.SIGKILL)
+            time.sleep(0.5)
+            pool._collect = lambda: None
+            self.assertTrue(pool.put(jobgroup_ids[0]))
+            self.assertNotEquals(pid, pool.processes[0].pid)
+            self.assertEquals(jobgroup_ids[0], pool.processes[0].jobgroup_id)
+            del pool._collect
+            end = time.time() + 30
+            while 0 < pool.busy() and time.time() < end:
+                time.sleep(0.05)
+        finally:
+            pool.stop()
+        self.assertEquals([(JOBGROUP_STATUS['OK'], [ACTION_STATUS['OK']] * 2)],
+                          self.results(jobgroup_ids))
+
+    def test_reactor_pool_0(self):
+        jobgroup_ids = self.add(5)
+        jobgroup_ids.append(self.fixture.add(['/bin/false', '/bin/true'], JOBGROUP_TYPE['PARALLEL']))
+        done = []
+        pool = target.ReactorPool(self.fixture.cf, self.fixture.db, 3, done.append)
+        try:
+            self.run_pool(pool, jobgroup_ids, 30)
+        finally:
+            pool.stop()
+        self.assertEquals(0, pool.busy())
+        self.assertEquals(sorted(jobgroup_ids), sorted(done))
+        self.assertEquals([(JOBGROUP_STATUS['OK'], [ACTION_STATUS['OK']] * 2)] * 5
+                          + [(JOBGROUP_STATUS['NG'], [ACTION_STATUS['NG'], ACTION_STATUS['PEND']])],
+                          self.results(jobgroup_ids))
+
+class SuiteReactor(unittest.TestSuite):
+    def __init__(self):
+        tests = ['test_command_0',
+                 'test_command_1',
+                 'test_timeout_0',
+                 'test_timeout_1',
+                 ]
+        unittest.TestSuite.__init__(self,map(TestReactor, tests))
+
+class SuitePool(unittest.TestSuite):
+    def __init__(self):
+        tests = ['test_process_pool_0',
+                 'test_process_pool_1',
+                 'test_reactor_pool_0',
+                 ]
+        unittest.TestSuite.__init__(self,map(TestPool, tests))
+
+def all_suite_executor():
+    return unittest.TestSuite([SuiteReactor(),
+                               SuitePool(),
+                               ])
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(all_suite_executor())
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import unittest
+
+from pysilhouette.fairshare import FairShare
+
+class JobGroup:
+    def __init__(self, name, register):
+        self.name = name
+        self.register = register
+
+def fair(conf=None):
+    cf = {'performer.fair.key': 'register',
+          'performer.fair.weight': 1,
+          }
+    if not conf is None:
+        cf.update(conf)
+    ret = FairShare(cf, 'performer')
+    ret.order = [u'a', u'b'] # Known order of the first round
+    return ret
+
+class TestFairShare(unittest.TestCase):
+
+    def test_select_0(self):
+        ret = fair().select({u'a': ['a1', 'a2', 'a3'], u'b': ['b1']})
+        self.assertEquals(['a1', 'b1', 'a2', 'a3'], ret)
+
+    def test_select_1(self):
+        # weight
+        ret = fair({'performer.fair.weight.a': 2}).select({u'a': ['a1', 'a2', 'a3'],
+                                                         u'b': ['b1', 'b2']})
+        self.assertEquals(['a1', 'a2', 'b1', 'a3', 'b2'], ret)
+
+    def test_select_2(self):
+        # slots, and the next scan starts with the next tenant.
+        target = fair()
+        self.assertEquals(['a1', 'b1'], target.select({u'a': ['a1', 'a2'], u'b': ['b1', 'b2']}, 2))
+        self.assertEquals(['b2', 'a2'], target.select({u'a': ['a2'], u'b': ['b2']}, 2))
+
+    def test_select_3(self):
+        # cap
+        target = fair({'performer.fair.cap.a': 1})
+        self.assertEquals(['b1', 'b2'], target.select({u'a': ['a1'], u'b': ['b1', 'b2']},
+                                                      None, {u'a': 1}))
+        target = fair({'performer.fair.cap.a': 1})
+        self.assertEquals(['a1', 'b1', 'b2'], target.select({u'a': ['a1', 'a2'], u'b': ['b1', 'b2']},
+                                                            None, {}))
+        # No running numbers, no cap.
+        target = fair({'performer.fair.cap': 1})
+        self.assertEquals(['a1', 'a2'], target.select({u'a': ['a1', 'a2']}))
+
+    def test_select_4(self):
+        # A tenant without pending jobgroups loses its deficit.
+        target = fair({'performer.fair.weight.a': 0.5})
+        self.assertEquals(['b1'], target.select({u'a': ['a1'], u'b': ['b1']}, 1))
+        self.assertEquals(0.5, target.deficits[u'a'])
+        target.select({u'b': ['b2']})
+        self.assertFalse(target.deficits.has_key(u'a'))
+        self.assertEquals([u'b'], target.order)
+
+    def test_group_0(self):
+        m_jgs = [JobGroup('a1', u'a'), JobGroup('n1', None), JobGroup('a2', u'a')]
+        ret = fair().group(m_jgs)
+        self.assertEquals(['a1', 'a2'], [m_jg.name for m_jg in ret[u'a']])
+        self.assertEquals(['n1'], [m_jg.name for m_jg in ret[None]])
+        self.assertEquals(1, fair().weight_of(None))
+
+class SuiteFairShare(unittest.TestSuite):
+    def __init__(self):
+        tests = ['test_select_0',
+                 'test_select_1',
+                 'test_select_2',
+                 'test_select_3',
+                 'test_select_4',
+                 'test_group_0',
+                 ]
+        unittest.TestSuite.__init__(self,map(TestFairShare, tests))
+
+def all_suite_fairshare():
+    return unittest.TestSuite([SuiteFairShare(),
+                               ])
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(all_suite_fairshare())
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import unittest
+
+from pysilhouette.db import create_database
+from pysilhouette.db.model import Job
+from pysilhouette.tests.fixture import make_cf
+from pysilhouette.worker import job_graph, SilhouetteWorkerException
+
+def jobs(*depends):
+    """Jobs of the orders 0, 1, ... with the given "depends".
+    The job id is the order + 100. A tuple is (depends, rollback_command).
+    """
+    ret = []
+    for i in range(len(depends)):
+        value = depends[i]
+        rollback = u'/bin/true'
+        if isinstance(value, tuple):
+            (value, rollback) = value
+        m_job = Job(u'job%d' % i, i, u'/bin/true')
+        m_job.id = i + 100
+        m_job.depends = value
+        m_job.rollback_command = rollback
+        ret.append(m_job)
+    return ret
+
+def orders(m_jobs):
+    return [m_job.order for m_job in m_jobs]
+
+def run(graph, m_job, ret=True):
+    graph.start(m_job)
+    graph.end(m_job, ret)
+
+class TestGraph(unittest.TestCase):
+
+    def setUp(self):
+        # The mappers, for the validators of Job.
+        create_database(make_cf(':memory:'))
+
+    def test_job_graph_0(self):
+        m_jobs = jobs(None, None, None)
+        self.assertTrue(job_graph(m_jobs) is None)
+
+        # serial: each job waits for the one before it.
+        graph = job_graph(m_jobs, True)
+        self.assertEquals([0], orders(graph.ready()))
+        run(graph, m_jobs[0])
+        self.assertEquals([1], orders(graph.ready()))
+        run(graph, m_jobs[1])
+        run(graph, m_jobs[2])
+        self.assertEquals([], graph.ready())
+        self.assertTrue(graph.is_ok())
+
+    def test_job_graph_1(self):
+        # 0 -> (1, 2) -> 3
+        m_jobs = jobs(u'-', u'0', u'0', u'1,2')
+        graph = job_graph(m_jobs)
+        self.assertEquals([0], orders(graph.ready()))
+        graph.start(m_jobs[0])
+        self.assertEquals([], graph.ready())
+        self.assertEquals(1, graph.running())
+        graph.end(m_jobs[0], True)
+        self.assertEquals([1, 2], orders(graph.ready()))
+        graph.start(m_jobs[1])
+        graph.start(m_jobs[2])
+        self.assertEquals(2, graph.running())
+        graph.end(m_jobs[2], True)
+        self.assertEquals([], graph.ready()) # 3 waits for 1 too
+        graph.end(m_jobs[1], True)
+        self.assertEquals([3], orders(graph.ready()))
+        run(graph, m_jobs[3])
+        self.assertTrue(graph.is_ok())
+
+    def test_job_graph_2(self):
+        # failfast: nothing starts after a failure.
+        m_jobs = jobs(u'-', u'-', u'0')
+        graph = job_graph(m_jobs)
+        self.assertEquals([0, 1], orders(graph.ready()))
+        graph.start(m_jobs[0])
+        graph.start(m_jobs[1])
+        graph.end(m_jobs[1], False)
+        self.assertEquals([], graph.ready())
+        self.assertEquals(1, graph.running()) # still waited for
+        graph.end(m_jobs[0], True)
+        self.assertEquals(0, graph.running())
+        self.assertFalse(graph.is_ok())
+
+    def test_job_graph_3(self):
+        # "depends" is given in any order, the graph sorts it.
+        m_jobs = jobs(u'2', u'-', u'1')
+        graph = job_graph(m_jobs)
+        self.assertEquals([1, 2, 0], orders(graph.sorted))
+
+    def test_job_graph_4(self):
+        self.assertRaises(SilhouetteWorkerException, job_graph, jobs(u'1', u'0')) # circular
+        self.assertRaises(SilhouetteWorkerException, job_graph, jobs(u'-', u'5')) # no such job
+        self.assertRaises(SilhouetteWorkerException, job_graph, jobs(u'-', u'1')) # itself
+
+        m_jobs = jobs(u'-', u'-')
+        m_jobs[1].order = 0
+        self.assertRaises(SilhouetteWorkerException, job_graph, m_jobs) # same order
+
+    def test_job_depends_0(self):
+        m_job = jobs(None)[0]
+        self.assertTrue(m_job.get_depends() is None)
+        m_job.depends = u'-'
+        self.assertEquals([], m_job.get_depends())
+        m_job.depends = u' 0, 2,'
+        self.assertEquals([0, 2], m_job.get_depends())
+        try:
+            m_job.depends = u'0,a'
+            self.fail()
+        except ValueError:
+            pass
+        try:
+            m_job.retry_codes = u'1;2'
+            self.fail()
+        except ValueError:
+            pass
+        m_job.retry_codes = u'1,2'
+        self.assertEquals([1, 2], m_job.get_retry_codes())
+
+    def test_rollback_graph_0(self):
+        # 0 -> 1 -> 2, rolled back from the last job.
+        m_jobs = jobs(u'-', u'0', u'1')
+        graph = job_graph(m_jobs).rollback_graph(m_jobs)
+        self.assertEquals([2], orders(graph.ready()))
+        run(graph, m_jobs[2])
+        self.assertEquals([1], orders(graph.ready()))
+        run(graph, m_jobs[1])
+        self.assertEquals([0], orders(graph.ready()))
+        run(graph, m_jobs[0])
+        self.assertTrue(graph.is_ok())
+
+    def test_rollback_graph_1(self):
+        # Independent jobs are rolled back at the same time, the last first.
+        m_jobs = jobs(u'-', u'-', u'0')
+        graph = job_graph(m_jobs).rollback_graph(m_jobs)
+        self.assertEquals([2, 1], orders(graph.ready()))
+        run(graph, m_jobs[2])
+        self.assertEquals([1, 0], orders(graph.ready()))
+
+    def test_rollback_graph_2(self):
+        # 0 -> 1 -> 2, 1 has no rollback: 0 still waits for 2.
+        m_jobs = jobs(u'-', (u'0', None), u'1')
+        targets = [m_jobs[0], m_jobs[2]]
+        graph = job_graph(m_jobs).rollback_graph(targets)
+        self.assertEquals([2], orders(graph.ready()))
+        # A failed rollback does not stop the others.
+        run(graph, m_jobs[2], False)
+        self.assertEquals([0], orders(graph.ready()))
+        run(graph, m_jobs[0])
+        self.assertFalse(graph.is_ok())
+
+    def test_rollback_graph_3(self):
+        # Serial jobs are rolled back in reverse order.
+        m_jobs = jobs(None, None, None)
+        graph = job_graph(m_jobs, True).rollback_graph(m_jobs)
+        self.assertEquals([2], orders(graph.ready()))
+
+class SuiteJobGraph(unittest.TestSuite):
+    def __init__(self):
+        tests = ['test_job_graph_0',
+                 'test_job_graph_1',
+                 'test_job_graph_2',
+                 'test_job_graph_3',
+                 'test_job_graph_4',
+                 'test_job_depends_0',
+                 ]
+        unittest.TestSuite.__init__(self,map(TestGraph, tests))
+
+class SuiteRollbackGraph(unittest.TestSuite):
+    def __init__(self):
+        tests = ['test_rollback_graph_0',
+                 'test_rollback_graph_1',
+                 'test_rollback_graph_2',
+                 'test_rollback_graph_3',
+                 ]
+        unittest.TestSuite.__init__(self,map(TestGraph, tests))
+
+def all_suite_graph():
+    return unittest.TestSuite([SuiteJobGraph(),
+                               SuiteRollbackGraph(),
+                               ])
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(all_suite_graph())
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import datetime
+import unittest
+
+import pysilhouette.lease as target
+from pysilhouette.db.model import JobGroup, JOBGROUP_TYPE, \
+     JOBGROUP_STATUS, ACTION_STATUS
+from pysilhouette.db.access import jobgroup_claim, jobgroup_renew, \
+     jobgroup_findexpired, jobgroup_expire
+from pysilhouette.tests.fixture import DBFixture
+
+def ago(seconds):
+    return datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+
+class TestLease(unittest.TestCase):
+
+    def setUp(self):
+        self.fixture = DBFixture({'lease.time': 30})
+        self.db = self.fixture.db
+
+    def tearDown(self):
+        self.fixture.close()
+
+    def running(self, owner, lease):
+        """A running jobgroup whose first job ended normally."""
+        return self.fixture.add([{'action_command': u'/bin/true', 'status': ACTION_STATUS['OK']},
+                                 {'action_command': u'/bin/true', 'status': ACTION_STATUS['RUN']},
+                                 ],
+                                status=JOBGROUP_STATUS['RUN'], owner=owner, lease=lease)
+
+    def status(self, jobgroup_id):
+        session = self.db.new_session()
+        try:
+            m_jg = session.query(JobGroup).get(jobgroup_id)
+            return (m_jg.status, m_jg.owner,
+                    [m_job.status for m_job in sorted(m_jg.jobs, key=lambda m_job: m_job.order)])
+        finally:
+            session.close()
+
+    def test_claim_0(self):
+        # Two performers found the same jobgroup, only one gets it.
+        jobgroup_id = self.fixture.add(['/bin/true'])
+        sessions = [self.db.new_session(), self.db.new_session()]
+        try:
+            m_jgs = [session.query(JobGroup).get(jobgroup_id) for session in sessions]
+            lease = target.lease_expire(self.fixture.cf)
+            self.assertTrue(jobgroup_claim(sessions[0], m_jgs[0], u'a:1', lease=lease))
+            self.assertFalse(jobgroup_claim(sessions[1], m_jgs[1], u'b:2', lease=lease))
+            self.assertEquals(u'a:1', m_jgs[1].owner) # reloaded
+            self.assertEquals(JOBGROUP_STATUS['RUN'], m_jgs[1].status)
+            self.assertEquals(lease, m_jgs[1].lease)
+        finally:
+            for session in sessions:
+                session.close()
+
+    def test_renew_0(self):
+        self.running(u'a:1', ago(10))
+        other = self.running(u'b:2', ago(10))
+        self.fixture.add(['/bin/true'], status=JOBGROUP_STATUS['OK'], owner=u'a:1', lease=ago(10))
+
+        lease = datetime.datetime.now() + datetime.timedelta(seconds=30)
+        session = self.db.new_session()
+        try:
+            self.assertEquals(1, jobgroup_renew(session, u'a:1', lease))
+            expired = [m_jg.id for m_jg in jobgroup_findexpired(
+                session, JOBGROUP_TYPE['SERIAL'], datetime.datetime.now())]
+            self.assertEquals([other], expired)
+            self.assertEquals([], jobgroup_findexpired(session, JOBGROUP_TYPE['PARALLEL'],
+                                                       datetime.datetime.now()))
+        finally:
+            session.close()
+
+    def test_expire_0(self):
+        # PEND again, the job which ended normally does not run again.
+        jobgroup_id = self.running(u'a:1', ago(10))
+        session = self.db.new_session()
+        try:
+            m_jg = session.query(JobGroup).get(jobgroup_id)
+            self.assertTrue(jobgroup_expire(session, m_jg, datetime.datetime.now(), JOBGROUP_STATUS['PEND']))
+        finally:
+            session.close()
+        self.assertEquals((JOBGROUP_STATUS['PEND'], None, [ACTION_STATUS['OK'], ACTION_STATUS['PEND']]),
+                          self.status(jobgroup_id))
+
+    def test_expire_1(self):
+        # Renewed in the meantime
+        jobgroup_id = self.running(u'a:1', ago(10))
+        session = self.db.new_session()
+        try:
+            m_jg = session.query(JobGroup).get(jobgroup_id)
+            other = self.db.new_session()
+            try:
+                jobgroup_renew(other, u'a:1', datetime.datetime.now() + datetime.timedelta(seconds=30))
+            finally:
+                other.close()
+            self.assertFalse(jobgroup_expire(session, m_jg, datetime.datetime.now(), JOBGROUP_STATUS['PEND']))
+        finally:
+            session.close()
+        self.assertEquals((JOBGROUP_STATUS['RUN'], u'a:1', [ACTION_STATUS['OK'], ACTION_STATUS['RUN']]),
+                          self.status(jobgroup_id))
+
+    def test_reaper_0(self):
+        expired = self.running(u'a:1', ago(10))
+        alive = self.running(u'b:2', datetime.datetime.now() + datetime.timedelta(seconds=30))
+        reaper = target.Reaper(self.fixture.cf, self.db, JOBGROUP_TYPE['SERIAL'])
+        self.assertEquals(1, reaper.reap())
+        self.assertEquals(JOBGROUP_STATUS['PEND'], self.status(expired)[0])
+        self.assertEquals(JOBGROUP_STATUS['RUN'], self.status(alive)[0])
+        self.assertEquals(0, reaper.reap()) # Not before the interval
+
+    def test_reaper_1(self):
+        self.fixture.cf['lease.expired'] = 'apperr'
+        expired = self.running(u'a:1', ago(10))
+        reaper = target.Reaper(self.fixture.cf, self.db, JOBGROUP_TYPE['SERIAL'])
+        self.assertEquals(1, reaper.reap())
+        self.assertEquals((JOBGROUP_STATUS['APPERR'], u'a:1', [ACTION_STATUS['OK'], ACTION_STATUS['RUN']]),
+                          self.status(expired))
+
+        # The leases are off.
+        self.fixture.cf['lease.time'] = 0
+        self.running(u'a:1', ago(10))
+        self.assertEquals(0, target.Reaper(self.fixture.cf, self.db, JOBGROUP_TYPE['SERIAL']).reap())
+
+class SuiteLease(unittest.TestSuite):
+    def __init__(self):
+        tests = ['test_claim_0',
+                 'test_renew_0',
+                 'test_expire_0',
+                 'test_expire_1',
+                 'test_reaper_0',
+                 'test_reaper_1',
+                 ]
+        unittest.TestSuite.__init__(self,map(TestLease, tests))
+
+def all_suite_lease():
+    return unittest.TestSuite([SuiteLease(),
+                               ])
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(all_suite_lease())
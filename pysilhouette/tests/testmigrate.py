@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import os
+import tempfile
+import unittest
+
+import sqlalchemy
+import sqlalchemy.exc
+
+import pysilhouette.db.migrate as target
+from pysilhouette.db import create_database
+from pysilhouette.tests.fixture import make_cf
+
+#: Tables of pysilhouette 0.7, with the scan index and the archive table
+#: (keyed by the jobgroup id) of an earlier psil-upgradedb.
+OLD_TABLES = ("""CREATE TABLE jobgroup (
+	id INTEGER NOT NULL, 
+	name VARCHAR(512) NOT NULL, 
+	uniq_key VARCHAR(36) NOT NULL, 
+	finish_command VARCHAR(1024), 
+	type INTEGER NOT NULL, 
+	status VARCHAR(3) NOT NULL, 
+	register VARCHAR(32), 
+	created TIMESTAMP, 
+	modified TIMESTAMP, 
+	PRIMARY KEY (id)
+)""", """CREATE TABLE job (
+	id INTEGER NOT NULL, 
+	jobgroup_id INTEGER NOT NULL, 
+	name VARCHAR(32) NOT NULL, 
+	"order" INTEGER NOT NULL, 
+	action_command VARCHAR(1024) NOT NULL, 
+	rollback_command VARCHAR(1024), 
+	status VARCHAR(3) NOT NULL, 
+	action_exit_code INTEGER, 
+	action_stdout TEXT, 
+	action_stderr TEXT, 
+	rollback_exit_code INTEGER, 
+	rollback_stdout TEXT, 
+	rollback_stderr TEXT, 
+	progress INTEGER NOT NULL, 
+	created TIMESTAMP, 
+	modified TIMESTAMP, 
+	PRIMARY KEY (id), 
+	 FOREIGN KEY(jobgroup_id) REFERENCES jobgroup (id)
+)""", """CREATE INDEX ix_job_jobgroup_id ON job (jobgroup_id)""",
+"""CREATE INDEX ix_jobgroup_type_status_id ON jobgroup (type, status, id)""",
+"""CREATE TABLE jobgroup_archive (
+	id INTEGER NOT NULL, 
+	name VARCHAR(512) NOT NULL, 
+	uniq_key VARCHAR(36) NOT NULL, 
+	finish_command VARCHAR(1024), 
+	type INTEGER NOT NULL, 
+	status VARCHAR(3) NOT NULL, 
+	register VARCHAR(32), 
+	created TIMESTAMP, 
+	modified TIMESTAMP, 
+	archived TIMESTAMP, 
+	PRIMARY KEY (id)
+)""", """CREATE INDEX ix_jobgroup_archive_archived ON jobgroup_archive (archived)""",
+)
+
+class TestMigrate(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        engine = sqlalchemy.create_engine('sqlite:///%s' % self.path)
+        for ddl in OLD_TABLES:
+            engine.execute(ddl)
+        engine.execute("INSERT INTO jobgroup (id, name, uniq_key, type, status) "
+                       "VALUES (1, 'jg', 'key', 0, '0')")
+        engine.execute("INSERT INTO job (id, jobgroup_id, name, \"order\", action_command, status, progress) "
+                       "VALUES (1, 1, 'job', 0, '/bin/true', '0', 0)")
+        engine.execute("INSERT INTO jobgroup_archive (id, name, uniq_key, type, status) "
+                       "VALUES (1, 'old', 'key', 0, '2')")
+        engine.dispose()
+        self.db = create_database(make_cf(self.path))
+        self.metadata = self.db.get_metadata()
+
+    def tearDown(self):
+        self.db.remove_session()
+        self.db.get_engine().dispose()
+        os.unlink(self.path)
+
+    def execute(self, sql):
+        return self.db.get_engine().execute(sql)
+
+    def table_sql(self, name):
+        return self.execute("SELECT sql FROM sqlite_master WHERE type = 'table' "
+                            "AND name = '%s'" % name).scalar()
+
+    def test_upgrade_0(self):
+        before = target.outdated(self.metadata)
+        self.assertTrue('jobgroup' in before) # AUTOINCREMENT
+        self.assertTrue('job' in before) # AUTOINCREMENT
+        self.assertTrue('job_output' in before)
+        self.assertTrue('jobgroup_archive' in before) # primary key
+
+        ret = target.upgrade(self.metadata)
+        self.assertEquals(['CREATE TABLE job_archive', 'CREATE TABLE job_output',
+                           'REBUILD TABLE job', 'REBUILD TABLE jobgroup',
+                           'REBUILD TABLE jobgroup_archive'], sorted(ret))
+        self.assertTrue('AUTOINCREMENT' in self.table_sql('jobgroup'))
+        self.assertTrue('AUTOINCREMENT' in self.table_sql('job'))
+        self.assertTrue('REFERENCES jobgroup (id)' in self.table_sql('job'))
+        self.assertEquals([(u'CREATE INDEX ix_jobgroup_type_status_priority_desc_id ON jobgroup '
+                            u'(type, status, priority DESC, id)',)],
+                          self.execute("SELECT sql FROM sqlite_master WHERE type = 'index' "
+                                       "AND name LIKE 'ix_jobgroup_type_status_%id'").fetchall())
+        self.assertEquals([], target.outdated(self.metadata))
+        self.assertEquals([], target.upgrade(self.metadata))
+
+        # The rows are kept.
+        self.assertEquals([(1, u'jg')], self.execute('SELECT id, name FROM jobgroup').fetchall())
+        self.assertEquals([(1,)], self.execute('SELECT jobgroup_id FROM job').fetchall())
+        self.assertEquals([(1, u'/bin/true')], self.execute('SELECT id, action_command FROM job').fetchall())
+        self.assertEquals([(1, 1, u'old')], self.execute(
+            'SELECT archive_id, id, name FROM jobgroup_archive').fetchall())
+
+        # The defaults of the new columns are set on the old rows.
+        t_job = self.metadata.tables['job']
+        row = self.execute(sqlalchemy.select([t_job])).fetchone()
+        for column in t_job.columns:
+            if not 'job.%s' % column.name in before:
+                continue
+            if column.default is not None and column.default.is_scalar:
+                self.assertEquals(column.default.arg, row[column.name])
+
+        # From now on the id of a deleted jobgroup is not used again.
+        t_jg = self.metadata.tables['jobgroup']
+        for name in (u'deleted', u'new'):
+            self.execute(t_jg.insert().values(name=name, uniq_key=u'key', type=0, status=u'0'))
+            self.execute("DELETE FROM jobgroup WHERE name = 'deleted'")
+        self.assertEquals([(1,), (3,)], self.execute('SELECT id FROM jobgroup ORDER BY id').fetchall())
+
+    def test_upgrade_1(self):
+        # job_output of an earlier psil-upgradedb refers to the job table
+        # being rebuilt.
+        self.metadata.tables['job_output'].create()
+        ret = target.upgrade(self.metadata)
+        self.assertTrue('REBUILD TABLE job' in ret)
+        self.assertTrue('REFERENCES job (id)' in self.table_sql('job_output'))
+        self.assertEquals([(0,)], self.execute('PRAGMA foreign_keys').fetchall()) # as it was
+
+        # Only the indexes are out of date.
+        self.execute('CREATE INDEX ix_jobgroup_type_status_id ON jobgroup (type, status, id)')
+        self.assertEquals(['DROP INDEX ix_jobgroup_type_status_id'], target.upgrade(self.metadata))
+
+    def test_add_column_0(self):
+        column = sqlalchemy.Column('upgrade_test', sqlalchemy.Integer, nullable=False)
+        table = sqlalchemy.Table('job', sqlalchemy.MetaData(), column)
+        self.assertRaises(sqlalchemy.exc.ArgumentError, target.add_column,
+                          self.db.get_engine(), table, column)
+
+        column = sqlalchemy.Column('upgrade_test', sqlalchemy.Integer, nullable=False, default=3)
+        table = sqlalchemy.Table('job', sqlalchemy.MetaData(), column)
+        self.assertEquals('ALTER TABLE job ADD COLUMN upgrade_test INTEGER DEFAULT 3 NOT NULL',
+                          target.add_column(self.db.get_engine(), table, column))
+        self.assertEquals([(3,)], self.execute('SELECT upgrade_test FROM job').fetchall())
+
+class SuiteMigrate(unittest.TestSuite):
+    def __init__(self):
+        tests = ['test_upgrade_0',
+                 'test_upgrade_1',
+                 'test_add_column_0',
+                 ]
+        unittest.TestSuite.__init__(self,map(TestMigrate, tests))
+
+def all_suite_migrate():
+    return unittest.TestSuite([SuiteMigrate(),
+                               ])
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(all_suite_migrate())
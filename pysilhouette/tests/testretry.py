@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+
+from pysilhouette.db.model import JobGroup, JOBGROUP_TYPE, JOBGROUP_STATUS, ACTION_STATUS
+from pysilhouette.worker import SimpleWorker, LaneWorker
+from pysilhouette.performer import split_lanes
+from pysilhouette.db.access import jobgroup_findbytype_status
+from pysilhouette.tests.fixture import DBFixture
+
+class TestRetry(unittest.TestCase):
+
+    def setUp(self):
+        self.fixture = DBFixture({'job.retry.backoff.max': 60})
+        self.tmp_dir = tempfile.mkdtemp()
+        self.count = os.path.join(self.tmp_dir, 'count')
+        self.flag = os.path.join(self.tmp_dir, 'flag')
+
+    def tearDown(self):
+        self.fixture.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def counted(self):
+        """Action which counts its runs."""
+        return u"/bin/sh -c 'echo x >> %s'" % self.count
+
+    def fail_once(self, code):
+        """Action which exits with "code" the first time only."""
+        return u"/bin/sh -c 'test -f %s && exit 0; touch %s; exit %d'" % (self.flag, self.flag, code)
+
+    def process(self, jobgroup_id):
+        SimpleWorker(self.fixture.cf, self.fixture.db, jobgroup_id).process()
+        self.fixture.db.remove_session()
+        session = self.fixture.db.new_session()
+        try:
+            m_jg = session.query(JobGroup).get(jobgroup_id)
+            return (m_jg.status, m_jg.run_after,
+                    [(m_job.status, m_job.retries) for m_job in sorted(m_jg.jobs, key=lambda m_job: m_job.order)])
+        finally:
+            session.close()
+
+    def test_retry_0(self):
+        jobgroup_id = self.fixture.add([self.counted(),
+                                        {'action_command': self.fail_once(3),
+                                         'max_retries': 2,
+                                         'retry_backoff': 10,
+                                         'retry_codes': u'3,4',
+                                         },
+                                        ])
+        start = datetime.datetime.now()
+        (status, run_after, jobs) = self.process(jobgroup_id)
+        self.assertEquals(JOBGROUP_STATUS['PEND'], status)
+        self.assertEquals([(ACTION_STATUS['OK'], 0), (ACTION_STATUS['PEND'], 1)], jobs)
+        self.assertTrue(start + datetime.timedelta(seconds=10) <= run_after)
+        self.assertTrue(run_after <= datetime.datetime.now() + datetime.timedelta(seconds=10))
+
+        # The job which ended normally does not run again.
+        (status, run_after, jobs) = self.process(jobgroup_id)
+        self.assertEquals(JOBGROUP_STATUS['OK'], status)
+        self.assertEquals([(ACTION_STATUS['OK'], 0), (ACTION_STATUS['OK'], 1)], jobs)
+        self.assertEquals(1, len(open(self.count).readlines()))
+
+    def test_retry_1(self):
+        # Not in retry_codes
+        jobgroup_id = self.fixture.add([{'action_command': self.fail_once(3),
+                                         'max_retries': 2,
+                                         'retry_codes': u'4',
+                                         },
+                                        ])
+        (status, run_after, jobs) = self.process(jobgroup_id)
+        self.assertEquals(JOBGROUP_STATUS['NG'], status)
+        self.assertEquals([(ACTION_STATUS['NG'], 0)], jobs)
+
+    def test_retry_2(self):
+        # No retries left
+        jobgroup_id = self.fixture.add([{'action_command': self.fail_once(3),
+                                         'max_retries': 2,
+                                         'retries': 2,
+                                         },
+                                        ])
+        (status, run_after, jobs) = self.process(jobgroup_id)
+        self.assertEquals(JOBGROUP_STATUS['NG'], status)
+
+    def test_backoff_0(self):
+        # retry_backoff * 2 ** retries, up to job.retry.backoff.max
+        jobgroup_id = self.fixture.add([{'action_command': self.fail_once(3),
+                                         'max_retries': 5,
+                                         'retries': 1,
+                                         'retry_backoff': 20,
+                                         },
+                                        ])
+        start = datetime.datetime.now()
+        (status, run_after, jobs) = self.process(jobgroup_id)
+        self.assertEquals(JOBGROUP_STATUS['PEND'], status)
+        self.assertEquals([(ACTION_STATUS['PEND'], 2)], jobs)
+        self.assertTrue(start + datetime.timedelta(seconds=40) <= run_after)
+        self.assertTrue(run_after <= datetime.datetime.now() + datetime.timedelta(seconds=40))
+
+        os.unlink(self.flag)
+        start = datetime.datetime.now()
+        (status, run_after, jobs) = self.process(jobgroup_id)
+        self.assertEquals([(ACTION_STATUS['PEND'], 3)], jobs)
+        self.assertTrue(start + datetime.timedelta(seconds=60) <= run_after)
+        self.assertTrue(run_after <= datetime.datetime.now() + datetime.timedelta(seconds=60))
+
+    def test_lane_0(self):
+        # A delayed job group holds back the rest of its lane.
+        later = datetime.datetime.now() + datetime.timedelta(seconds=60)
+        jobgroup_ids = [self.fixture.add(['/bin/true'], lane=u'a'),
+                        self.fixture.add(['/bin/true'], lane=u'a', run_after=later),
+                        self.fixture.add(['/bin/true'], lane=u'a'),
+                        self.fixture.add(['/bin/true'], lane=u'b', run_after=later),
+                        self.fixture.add(['/bin/true'], lane=u'b'),
+                        self.fixture.add(['/bin/true']),
+                        ]
+        session = self.fixture.db.new_session()
+        try:
+            m_jgs = jobgroup_findbytype_status(session, JOBGROUP_TYPE['SERIAL'], due=False)
+        finally:
+            session.close()
+        (lanes, ids, oldest) = split_lanes(m_jgs, 'lane', datetime.datetime.now())
+        self.assertEquals([u'a', u''], lanes)
+        self.assertEquals({u'a': [jobgroup_ids[0]], u'': [jobgroup_ids[5]]}, ids)
+
+    def test_lane_1(self):
+        # A retried job group stops its lane.
+        jobgroup_ids = [self.fixture.add([{'action_command': self.fail_once(3),
+                                           'max_retries': 2,
+                                           'retry_backoff': 10,
+                                           }], lane=u'a'),
+                        self.fixture.add([self.counted()], lane=u'a'),
+                        ]
+        worker = LaneWorker(self.fixture.cf, self.fixture.db, u'a', jobgroup_ids)
+        worker.start()
+        worker.join()
+        self.assertFalse(os.path.exists(self.count))
+        session = self.fixture.db.new_session()
+        try:
+            self.assertEquals([JOBGROUP_STATUS['PEND']] * 2,
+                              [session.query(JobGroup).get(jobgroup_id).status
+                               for jobgroup_id in jobgroup_ids])
+        finally:
+            session.close()
+
+class SuiteRetry(unittest.TestSuite):
+    def __init__(self):
+        tests = ['test_retry_0',
+                 'test_retry_1',
+                 'test_retry_2',
+                 'test_backoff_0',
+                 'test_lane_0',
+                 'test_lane_1',
+                 ]
+        unittest.TestSuite.__init__(self,map(TestRetry, tests))
+
+def all_suite_retry():
+    return unittest.TestSuite([SuiteRetry(),
+                               ])
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(all_suite_retry())
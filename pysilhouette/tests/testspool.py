@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pysilhouette.spool as target
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_dir)
+
+    def test_output_path_0(self):
+        self.assertEquals(os.path.join(self.spool_dir, '0', '12.action_stdout.gz'),
+                          target.output_path(self.spool_dir, 12, 'action_stdout'))
+        self.assertEquals(os.path.join(self.spool_dir, '2', '2345.rollback_stderr.gz'),
+                          target.output_path(self.spool_dir, '2345', 'rollback_stderr'))
+
+    def test_write_output_0(self):
+        data = u'ジョブ\n' * 1000
+        path = target.write_output(self.spool_dir, 1001, 'action_stdout', data)
+        self.assertEquals(target.output_path(self.spool_dir, 1001, 'action_stdout'), path)
+        self.assertTrue(os.path.isfile(path))
+        self.assertTrue(os.path.getsize(path) < len(data))
+        self.assertEquals(data, target.read_output(path))
+        self.assertEquals(['1001.action_stdout.gz'], os.listdir(os.path.dirname(path))) # No .tmp left
+
+        # Rewritten
+        path = target.write_output(self.spool_dir, 1001, 'action_stdout', 'abc')
+        self.assertEquals(u'abc', target.read_output(path))
+
+    def test_remove_output_0(self):
+        path = target.write_output(self.spool_dir, 1, 'action_stderr', 'abc')
+        self.assertTrue(target.remove_output(path))
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(target.remove_output(path))
+
+    def test_remove_spool_0(self):
+        target.write_output(self.spool_dir, 1, 'action_stdout', 'abc')
+        target.write_output(self.spool_dir, 1, 'action_stderr', 'abc')
+        target.write_output(self.spool_dir, 2000, 'action_stdout', 'abc')
+        open(os.path.join(self.spool_dir, '0', '1.action_stdout.gz.99.tmp'), 'w').close()
+        open(os.path.join(self.spool_dir, 'README'), 'w').close()
+        os.mkdir(os.path.join(self.spool_dir, 'other'))
+
+        self.assertEquals(4, target.remove_spool(self.spool_dir))
+        self.assertEquals(['README', 'other'], sorted(os.listdir(self.spool_dir)))
+        self.assertEquals(0, target.remove_spool(os.path.join(self.spool_dir, 'none')))
+
+class SuiteSpool(unittest.TestSuite):
+    def __init__(self):
+        tests = ['test_output_path_0',
+                 'test_write_output_0',
+                 'test_remove_output_0',
+                 'test_remove_spool_0',
+                 ]
+        unittest.TestSuite.__init__(self,map(TestSpool, tests))
+
+def all_suite_spool():
+    return unittest.TestSuite([SuiteSpool(),
+                               ])
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(all_suite_spool())
@@ -59,6 +59,42 @@ class TestUtil(unittest.TestCase):
         (proc, proc_info) = target.popen(cmd)
         self.assertTrue(proc_info['r_code'] == 1)
 
+    def test_popen_2(self):
+        cmd = target.split_shell_command('sleep 10')
+        (proc, proc_info) = target.popen(cmd, timeout=1)
+        self.assertTrue(proc_info['r_code'] is None)
+
+    def test_popen_3(self):
+        cmd = target.split_shell_command('sh -c "echo out; echo err >&2"')
+        (proc, proc_info) = target.popen(cmd, timeout=3, waittime=1)
+        self.assertTrue(proc_info['r_code'] == 0)
+        self.assertEquals('out\n', proc_info['stdout'])
+        self.assertEquals('err\n', proc_info['stderr'])
+
+    def test_popen_4(self):
+        cmd = target.split_shell_command('head -c 200000 /dev/zero')
+        (proc, proc_info) = target.popen(cmd, timeout=10, limit=100)
+        self.assertTrue(proc_info['r_code'] == 0)
+        self.assertEquals(100, len(proc_info['stdout']))
+        self.assertEquals(200000, proc_info['stdout_size'])
+
+    def test_popen_5(self):
+        class Sink:
+            def __init__(self):
+                self.data = {'stdout': '', 'stderr': ''}
+                self.flushed = 0
+            def write(self, name, data):
+                self.data[name] += data
+            def flush(self):
+                self.flushed += 1
+
+        sink = Sink()
+        cmd = target.split_shell_command('sh -c "echo out; echo err >&2"')
+        (proc, proc_info) = target.popen(cmd, timeout=3, limit=2, sink=sink)
+        self.assertEquals('ou', sink.data['stdout'])
+        self.assertEquals('er', sink.data['stderr'])
+        self.assertTrue(0 < sink.flushed)
+
     def test_split_shell_command_0(self):
         ret = target.split_shell_command('date')
         self.assertTrue(type(ret) is list)
@@ -157,6 +193,10 @@ class SuitePopen(unittest.TestSuite):
     def __init__(self):
         tests = ['test_popen_0',
                  'test_popen_1',
+                 'test_popen_2',
+                 'test_popen_3',
+                 'test_popen_4',
+                 'test_popen_5',
                  ]
         unittest.TestSuite.__init__(self,map(TestUtil, tests))
 
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import os
+import time
+import shutil
+import signal
+import datetime
+import tempfile
+import unittest
+
+import pysilhouette.wakeup as target
+
+class TestWakeup(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fifo = os.path.join(self.tmp_dir, 'performer.fifo')
+        os.mkfifo(self.fifo)
+        self.cf = {'performer.mkfifo.path': self.fifo,
+                   'performer.mkfifo.start.code': '0',
+                   'performer.mkfifo.ignore.code': '1',
+                   'performer.mkfifo.stop.code': '2',
+                   'performer.mkfifo.user.name': 'nobody',
+                   'performer.mkfifo.group.name': 'nobody',
+                   'performer.mkfifo.perms': '0600',
+                   'performer.wakeup.path': '',
+                   'performer.timer.interval': 0,
+                   }
+        self.channel = None
+
+    def tearDown(self):
+        if not self.channel is None:
+            self.channel.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def open(self, conf=None):
+        if not conf is None:
+            self.cf.update(conf)
+        self.channel = target.WakeupChannel(self.cf, 'performer')
+        return self.channel
+
+    def write(self, data):
+        fd = os.open(self.fifo, os.O_WRONLY | os.O_NONBLOCK)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+    def test_wait_0(self):
+        channel = self.open()
+        self.assertEquals([], channel.wait(0))
+        self.write('0')
+        self.write('12')
+        self.assertEquals(['0', '1', '2'], channel.wait(1))
+        self.write('0')
+        self.write('2')
+        self.assertEquals('2', channel.next_code()) # stop first
+
+    def test_wait_1(self):
+        # A signal ends the wait without codes.
+        channel = self.open()
+        handler = signal.signal(signal.SIGALRM, lambda signum, frame: None)
+        try:
+            signal.setitimer(signal.ITIMER_REAL, 0.1)
+            start = time.time()
+            self.assertEquals([], channel.wait(5))
+            self.assertTrue(time.time() - start < 2)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, handler)
+
+    def test_notify_0(self):
+        path = os.path.join(self.tmp_dir, 'performer.sock')
+        self.assertFalse(target.notify(self.cf, 0)) # Off
+        self.cf['performer.wakeup.path'] = path
+        self.assertFalse(target.notify(self.cf, 0)) # No performer
+        channel = self.open()
+        self.assertTrue(target.notify(self.cf, 0))
+        self.assertTrue(target.notify(self.cf, 0))
+        self.assertEquals(['0'], channel.wait(1))
+        self.assertEquals([], channel.wait(0))
+        channel.close()
+        self.channel = None
+        self.assertFalse(os.path.exists(path))
+
+    def test_wake_at_0(self):
+        channel = self.open()
+        now = datetime.datetime.now()
+        later = now + datetime.timedelta(seconds=0.4)
+        sooner = now + datetime.timedelta(seconds=0.2)
+        channel.wake_at(later)
+        channel.wake_at(sooner)
+        channel.wake_at(sooner)
+        self.assertEquals(2, len(channel._due))
+
+        start = time.time()
+        self.assertEquals('0', channel.next_code())
+        self.assertTrue(0.15 < time.time() - start < 0.35)
+        self.assertEquals([later], [due[1] for due in channel._due])
+        self.assertEquals('0', channel.next_code())
+        self.assertTrue(0.35 < time.time() - start < 0.55)
+        self.assertEquals([], channel._due)
+
+        # Already due
+        channel.wake_at(now)
+        start = time.time()
+        self.assertEquals('0', channel.next_code())
+        self.assertTrue(time.time() - start < 0.1)
+
+    def test_timer_0(self):
+        channel = self.open({'performer.timer.interval': 1,
+                             'performer.timer.interval.max': 4,
+                             })
+        start = time.time()
+        self.assertEquals('0', channel.next_code()) # first tick at once
+        self.assertTrue(time.time() - start < 0.1)
+
+        channel.scanned(0)
+        self.assertEquals(2, channel._wait)
+        channel.scanned(0)
+        channel.scanned(0)
+        self.assertEquals(4, channel._wait)
+        channel.scanned(1)
+        self.assertEquals(1, channel._wait)
+
+        # Full scan, again at once.
+        channel.scanned(3, True)
+        start = time.time()
+        self.assertEquals('0', channel.next_code())
+        self.assertTrue(time.time() - start < 0.1)
+
+        # The FIFO is not held up by the timer.
+        self.write('2')
+        self.assertEquals('2', channel.next_code())
+
+class SuiteWakeup(unittest.TestSuite):
+    def __init__(self):
+        tests = ['test_wait_0',
+                 'test_wait_1',
+                 'test_notify_0',
+                 'test_wake_at_0',
+                 'test_timer_0',
+                 ]
+        unittest.TestSuite.__init__(self,map(TestWakeup, tests))
+
+def all_suite_wakeup():
+    return unittest.TestSuite([SuiteWakeup(),
+                               ])
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(all_suite_wakeup())
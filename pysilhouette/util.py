@@ -31,6 +31,8 @@
 import os
 import pwd
 import grp
+import errno
+import select
 import subprocess
 import time
 import logging
@@ -62,6 +64,12 @@ def split_shell_command(cmd):
             ret.append(v)
     return ret
 
+def monotonic():
+    """Seconds from an arbitrary point of time. Not changed by setting the
+    system clock, only for measuring intervals.
+    """
+    return os.times()[4]
+
 def write_pidfile(fname, pid):
     fp = open(fname, 'w')
     try:
@@ -106,22 +114,148 @@ def kill_proc(proc):
             except:
                 return False        
 
-def popen(cmd, timeout, waittime, lang, limit=1048576, job_id=None):
+#: Bytes read from a pipe at once.
+PIPE_READ_SIZE = 65536
+#: Upper bound of the reads done when draining pipes without waiting.
+PIPE_DRAIN_MAX = 256
+
+class OutputBuffer:
+    """Output of a child process, kept up to "limit" bytes.
+    Bytes beyond the limit are counted and thrown away, so the pipe keeps
+    flowing while the memory stays bounded.
+    The kept bytes are also passed to sink.write(name, data) when a sink
+    is given.
+    """
+    def __init__(self, limit, name=None, sink=None):
+        self.limit = limit
+        self.name = name
+        self.sink = sink
+        self.size = 0 #: Total bytes written
+        self._chunks = []
+        self._kept = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self._kept < self.limit:
+            data = data[:self.limit - self._kept]
+            self._chunks.append(data)
+            self._kept += len(data)
+            if not self.sink is None:
+                self.sink.write(self.name, data)
+
+    def getvalue(self):
+        return ''.join(self._chunks)
+
+    def is_truncated(self):
+        return self._kept < self.size
+
+def _read_pipes(fds, outputs, wait):
+    """Read what the child has written to its pipes.
+    Pipes that reached EOF are removed from fds.
+    @param fds: file descriptors still open
+    @type fds: list
+    @param outputs: {fd: OutputBuffer}
+    @type outputs: dict
+    @param wait: seconds to wait for output. None=Until readable, 0=Only what is available now
+    @type wait: int or float
+    """
+    count = 0
+    while fds and count < PIPE_DRAIN_MAX:
+        count += 1
+        try:
+            (rlist, wlist, xlist) = select.select(fds, [], [], wait)
+        except select.error, se:
+            if se.args[0] == errno.EINTR:
+                continue
+            raise
+        if not rlist:
+            break
+        for fd in rlist:
+            data = os.read(fd, PIPE_READ_SIZE)
+            if data:
+                outputs[fd].write(data)
+            else:
+                fds.remove(fd) # EOF
+        if wait != 0:
+            break
+
+def popen(cmd, timeout=0, waittime=1, lang='C', limit=1048576, job_id=None, sink=None):
     """<comment-ja>
+    The child closes its end of the pipes when it exits, so waiting on
+    stdout/stderr with select() wakes up as soon as the command finishes.
+    Both pipes are drained while the child runs, so a command writing more
+    than the pipe buffer does not block. Only the first "limit" bytes of
+    each are kept; the total sizes are returned as stdout_size/stderr_size.
+    The kept output is also handed to "sink" as it arrives, see OutputBuffer.
+    sink.flush() is called after every wait, so it runs at least every
+    "waittime" seconds.
+    @param timeout: Seconds until the child is killed. 0=Infinite
+    @type timeout: int
+    @param waittime: Upper bound (seconds) of one wait. Only matters when
+                     the pipes are kept open after the child has exited
+                     (e.g. inherited by a grandchild). 0=Infinite
+    @type waittime: int
     @param limit: 1048576(1MByte)
     @type limit: int
+    @param sink: Receives the output while the command runs. None=Unused
+    @type sink: object - write(name, data) and flush()
     """
 
-    proc_info = {}
-
     timeout = int(timeout)
     waittime = int(waittime)
+    limit = int(limit)
+    proc = spawn(cmd, lang, job_id)
+
+    # parent process wait.
+    out_fd = proc.stdout.fileno()
+    err_fd = proc.stderr.fileno()
+    outputs = {out_fd: OutputBuffer(limit, 'stdout', sink),
+               err_fd: OutputBuffer(limit, 'stderr', sink),
+               }
+    fds = [out_fd, err_fd]
+    start_time = time.time()
+    delay = 0.001
+    r = None
+    while True:
+        wait = None
+        if 0 < waittime:
+            wait = waittime
+        if 0 < timeout:
+            remain = timeout - (time.time() - start_time)
+            if remain <= 0:
+                kill_proc(proc)
+                _read_pipes(fds, outputs, 0)
+                break
+            if wait is None or remain < wait:
+                wait = remain
+
+        if fds:
+            _read_pipes(fds, outputs, wait)
+        else:
+            # The pipes were closed, the child is about to be gone
+            # (or has closed them by itself). Back off up to 1 second.
+            time.sleep(delay)
+            delay = min(delay * 2, wait or 1, 1)
+
+        if not sink is None:
+            sink.flush()
+
+        r = proc.poll()
+        if not r is None:
+            _read_pipes(fds, outputs, 0)
+            break
+
+    return proc, proc_result(proc, outputs, r)
+
+def spawn(cmd, lang='C', job_id=None):
+    """Start a command with its stdout/stderr on pipes. (popen)
+    """
     env = os.environ.copy()
     env['LANG'] = lang
     if not (job_id is None):
         env['JOB_ID'] = str(job_id)
 
-    proc = subprocess.Popen(cmd,
+    return subprocess.Popen(cmd,
                             stdout=subprocess.PIPE,
                             stderr=subprocess.PIPE,
                             #env=os.environ,
@@ -129,40 +263,24 @@ def popen(cmd, timeout, waittime, lang, limit=1048576, job_id=None):
                             shell=False,
                             )
 
-    # parent process wait.
-    start_time = time.time()
-    while True:
-        r = proc.poll()
-        if r is None:
-            interval = int(time.time() - start_time)
-            if 0 < timeout and timeout < interval:
-                try:
-                    kill_proc(proc)
-                finally:
-                    break
-            time.sleep(waittime)
-        else:
-            break
-
-    stdout = stderr = ''
-    for x in proc.stdout:
-        stdout += x
-    for x in proc.stderr:
-        stderr += x
-
-    if stdout and limit < len(stdout):
-        proc_info['stdout'] = stdout[:limit]
-    else:
-        proc_info['stdout'] = stdout
-    if stderr and limit < len(stderr):
-        proc_info['stderr'] = stderr[:limit]
-    else:
-        proc_info['stderr'] = stderr
-
+def proc_result(proc, outputs, r_code):
+    """Close the pipes of a finished command and return its proc_info.
+    @param outputs: {fd: OutputBuffer} of stdout and stderr
+    @type outputs: dict
+    """
+    out_fd = proc.stdout.fileno()
+    err_fd = proc.stderr.fileno()
+    proc_info = {}
+    proc_info['stdout'] = outputs[out_fd].getvalue()
+    proc_info['stderr'] = outputs[err_fd].getvalue()
+    proc_info['stdout_size'] = outputs[out_fd].size
+    proc_info['stderr_size'] = outputs[err_fd].size
     proc_info['pid'] = proc.pid
-    proc_info['r_code'] = r
+    proc_info['r_code'] = r_code
 
-    return proc, proc_info
+    proc.stdout.close()
+    proc.stderr.close()
+    return proc_info
 
 def debug_popen(proc, proc_info):
     logger = logging.getLogger('pysilhouette.popen')
@@ -203,6 +321,12 @@ def is_key(cf, key):
 def set_cf_int(cf, key):
     cf[key] = int(cf[key])
 
+def set_cf_default(cf, key, value):
+    """Set the value if the key is missing or empty. (Optional keys)
+    """
+    if is_key(cf, key) is False:
+        cf[key] = value
+
 if __name__ == '__main__':
     #print popen(cmd='efdsfdsafdsafdsafdsafdsa', timeout=3, waittime=1, lang='C')
     print popen(cmd='date', timeout=3, waittime=1, lang='C')
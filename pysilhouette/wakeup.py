@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Pysilhouette.
+#
+# Copyright (c) 2009-2010 HDE, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+@author: Kei Funagayama <kei@karesansui-project.info>
+"""
+
+import os
+import pwd
+import grp
+import errno
+import select
+import socket
+import logging
+import heapq
+import datetime
+
+from pysilhouette.util import monotonic
+
+#: Performer which runs the jobgroups of each type.
+PERFORMERS = {
+    0 : 'performer', # JOBGROUP_TYPE['SERIAL']
+    1 : 'asynperformer', # JOBGROUP_TYPE['PARALLEL']
+    }
+
+#: Default of <performer>.wakeup.path
+WAKEUP_PATHS = {
+    'performer' : '/tmp/pysilhouette-performer.sock',
+    'asynperformer' : '/tmp/pysilhouette-asynperformer.sock',
+    }
+
+def wakeup_path(cf, prefix):
+    """Socket of the performer, None when the wake-up is off.
+    (Also for a configuration which was not checked by parse_conf)
+    """
+    key = '%s.wakeup.path' % prefix
+    if cf.has_key(key) is True:
+        path = cf[key].strip()
+    else:
+        path = WAKEUP_PATHS[prefix]
+    if 0 < len(path):
+        return path
+    return None
+
+def notify(cf, type):
+    """Wake up the performer of the jobgroup type.
+    Call it after the jobgroup is committed. Without a running performer
+    nothing happens, the jobgroup is found by the next scheduler interval.
+    @param type: JOBGROUP_TYPE
+    @type type: int
+    @return: True=sent
+    @rtype: bool
+    """
+    path = wakeup_path(cf, PERFORMERS[int(type)])
+    if path is None:
+        return False
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(0)
+        try:
+            sock.sendto('1', path)
+            return True
+        except socket.error, se:
+            # ENOENT, ECONNREFUSED: No performer. EAGAIN: Already woken up.
+            logger = logging.getLogger('pysilhouette.wakeup')
+            logger.debug('Could not wake up the performer. - path=%s : %s' % (path, str(se.args)))
+            return False
+    finally:
+        sock.close()
+
+class WakeupChannel:
+    """What a performer waits for.
+     - The codes written into the FIFO file. (scheduler, init script)
+     - The wake-up datagrams sent to the socket by notify(). They are
+       returned as the start code.
+     - Every <performer>.timer.interval seconds, the start code. This
+       replaces the scheduler process. (0=Off)
+       The interval adapts to the scans reported by scanned(): at once
+       again after a full scan, doubled up to <performer>.timer.interval.max
+       while nothing is found.
+     - The times given to wake_at(), the start code. (run_after of the
+       delayed jobgroups) They are kept in a heap, the nearest first.
+    The FIFO is opened read/write and non-blocking, so it is never at
+    end-of-file and can be watched with select together with the socket.
+    """
+    def __init__(self, cf, prefix):
+        self.logger = logging.getLogger('pysilhouette.wakeup')
+        self.start_code = cf['%s.mkfifo.start.code' % prefix]
+        self.stop_code = cf['%s.mkfifo.stop.code' % prefix]
+        self.codes = [cf['%s.mkfifo.start.code' % prefix],
+                      cf['%s.mkfifo.ignore.code' % prefix],
+                      cf['%s.mkfifo.stop.code' % prefix],
+                      ]
+        # Longest first, for the codes written back to back.
+        self.codes.sort(lambda a, b: cmp(len(b), len(a)))
+
+        self.interval = 0
+        if cf.has_key('%s.timer.interval' % prefix) is True:
+            self.interval = int(cf['%s.timer.interval' % prefix])
+        self.interval_max = self.interval
+        if cf.has_key('%s.timer.interval.max' % prefix) is True:
+            self.interval_max = max(self.interval, int(cf['%s.timer.interval.max' % prefix]))
+        self._wait = self.interval #: Current interval
+        self._deadline = None
+        self._due = [] #: heap of (monotonic deadline, datetime)
+        self._due_times = set()
+
+        self._fifo = os.open(cf['%s.mkfifo.path' % prefix], os.O_RDWR | os.O_NONBLOCK)
+        self._sock = None
+        self.path = wakeup_path(cf, prefix)
+        if not self.path is None:
+            try:
+                self._sock = self._bind(self.path,
+                                        cf['%s.mkfifo.user.name' % prefix],
+                                        cf['%s.mkfifo.group.name' % prefix],
+                                        cf['%s.mkfifo.perms' % prefix])
+                self.logger.info('The wake-up socket was created. - file=%s' % self.path)
+            except (socket.error, OSError, KeyError), e:
+                self.logger.error('Failed to create the wake-up socket. Waiting for the scheduler only. - file=%s : %s'
+                                  % (self.path, str(e.args)))
+                self._sock = None
+
+    def _bind(self, path, user, group, perm):
+        if os.path.exists(path):
+            os.unlink(path) # left by the previous process
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(0)
+            sock.bind(path)
+            perm8 = int(perm, 8)
+            try:
+                os.chown(path, pwd.getpwnam(user)[2], grp.getgrnam(group)[2])
+            except (KeyError, OSError):
+                pass # Same as the FIFO file, the owner is not changed.
+            os.chmod(path, perm8)
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def _split(self, data):
+        ret = []
+        while data:
+            for code in self.codes:
+                if data.startswith(code):
+                    ret.append(code)
+                    data = data[len(code):]
+                    break
+            else:
+                ret.append(data) # illegal
+                break
+        return ret
+
+    def _read_fifo(self):
+        ret = ''
+        while True:
+            try:
+                data = os.read(self._fifo, 4096)
+            except OSError, oe:
+                if oe.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            if not data:
+                break
+            ret += data
+        return ret
+
+    def _read_sock(self):
+        num = 0
+        while True:
+            try:
+                self._sock.recv(64)
+                num += 1
+            except socket.error, se:
+                if se.args[0] in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+        return num
+
+    def wait(self, timeout=None):
+        """Wait for the codes.
+        @param timeout: seconds, None=Infinite
+        @return: Codes received. (Empty on timeout)
+        @rtype: list
+        """
+        fds = [self._fifo]
+        if not self._sock is None:
+            fds.append(self._sock)
+        try:
+            (r, w, e) = select.select(fds, [], [], timeout)
+        except select.error, se:
+            if se.args[0] == errno.EINTR:
+                return [] # A signal, e.g. SIGCHLD of a worker process.
+            raise
+
+        ret = []
+        if self._fifo in r:
+            ret.extend(self._split(self._read_fifo().strip()))
+        if not self._sock is None and self._sock in r:
+            if 0 < self._read_sock():
+                ret.append(self.start_code)
+        return ret
+
+    def _timer(self):
+        """Seconds until the next tick of the timer, None=No timer.
+        """
+        if self.interval <= 0:
+            return None
+        now = monotonic()
+        if self._deadline is None:
+            self._deadline = now # first tick at once
+        return max(0, self._deadline - now)
+
+    def wake_at(self, when):
+        """Return the start code at "when" (datetime), even when no code
+        comes in and the timer is off.
+        """
+        if when in self._due_times:
+            return
+        delta = when - datetime.datetime.now()
+        seconds = delta.days * 86400 + delta.seconds + delta.microseconds / 1000000.0
+        heapq.heappush(self._due, (monotonic() + max(0, seconds), when))
+        self._due_times.add(when)
+
+    def _next_due(self):
+        """Seconds until the nearest wake_at(), None=Nothing."""
+        if not self._due:
+            return None
+        return max(0, self._due[0][0] - monotonic())
+
+    def next_code(self):
+        """Wait for the next code. When several came in at once, the stop
+        code is returned first, then the start code.
+        """
+        codes = []
+        while not codes:
+            due = self._next_due()
+            if due == 0:
+                while self._due and self._due[0][0] <= monotonic():
+                    self._due_times.discard(heapq.heappop(self._due)[1])
+                return self.start_code
+            timeout = self._timer()
+            if timeout == 0:
+                # tick. (Ticks missed while the performer was busy are not made up)
+                self._deadline = monotonic() + self._wait
+                return self.start_code
+            if timeout is None or (not due is None and due < timeout):
+                timeout = due
+            codes = self.wait(timeout)
+        for code in (self.stop_code, self.start_code):
+            if code in codes:
+                return code
+        return codes[0]
+
+    def scanned(self, num, full=False):
+        """Adapt the timer to the last scan of the pending jobgroups.
+        @param num: Jobgroups found (or still running)
+        @type num: int
+        @param full: True=More may be waiting, scan again at once.
+        @type full: bool
+        """
+        if self.interval <= 0:
+            return
+        if 0 < num:
+            self._wait = self.interval
+        else:
+            self._wait = min(self._wait * 2, self.interval_max) # idle, back off
+        if full is True:
+            self._deadline = monotonic()
+        else:
+            self._deadline = monotonic() + self._wait
+
+    def close(self):
+        os.close(self._fifo)
+        if not self._sock is None:
+            self._sock.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+if __name__ == '__main__':
+    pass
@@ -30,27 +30,258 @@
 
 import subprocess
 import os
+import errno
+import codecs
+import datetime
 import sys
+import time
 import traceback
 import logging
+import select
+import signal
 
 import pysilhouette
 from pysilhouette.db import *
 from pysilhouette.db.model import *
-from pysilhouette.db.access import jobgroup_findbyid, \
+from pysilhouette.db.access import jobgroup_findbyid, jobgroup_claim, jobgroup_retry, \
      job_findbyjobgroup_id, jobgroup_update, job_update, \
-     job_result_action, job_result_rollback
+     job_result_action, job_result_rollback, \
+     job_output_append, job_output_delete
 
 from pysilhouette.util import popen, kill_proc, is_empty, split_shell_command
+from pysilhouette.spool import write_output, remove_output
+from pysilhouette.wakeup import notify
+from pysilhouette.lease import claim_owner, lease_expire, start_keeper
 
 class SilhouetteWorkerException(pysilhouette.SilhouetteException):
     """Worker execution error.
     """
     pass
 
+class OutputSink:
+    """Streams the output of a running command into the job_output table.
+    The chunks are written every "job.output.flush.interval" seconds, or as
+    soon as "job.output.flush.size" bytes are waiting, in one commit.
+    They are deleted when the whole output is stored in the job row.
+    The chunks are decoded as UTF-8, a character cut between two reads is
+    kept until the rest of it comes.
+    The sink has a session of its own, opened at the first write to the
+    database. Close it when the command is over.
+    """
+    def __init__(self, db, job_id, prefix, interval, size):
+        self.db = db
+        self.session = None
+        self.job_id = job_id
+        self.prefix = prefix
+        self.interval = interval
+        self.size = size
+        self.logger = logging.getLogger('pysilhouette.worker.outputsink')
+        self._pending = {}
+        self._pending_size = 0
+        self._offsets = {}
+        self._decoders = {}
+        self._last = time.time()
+        self._failed = False
+
+    def streams(self):
+        return ['%s_stdout' % self.prefix, '%s_stderr' % self.prefix]
+
+    def is_written(self):
+        return 0 < len(self._offsets)
+
+    def write(self, name, data):
+        if self._failed is True:
+            return
+        stream = '%s_%s' % (self.prefix, name)
+        self._pending.setdefault(stream, []).append(data)
+        self._pending_size += len(data)
+        if self.size <= self._pending_size:
+            self.flush(True)
+
+    def flush(self, force=False):
+        if self._failed is True or not self._pending:
+            return
+        if force is False and time.time() - self._last < self.interval:
+            return
+
+        try:
+            if self.session is None:
+                self.session = self.db.new_session()
+            for stream, chunks in self._pending.items():
+                if not stream in self._decoders:
+                    self._decoders[stream] = codecs.getincrementaldecoder('utf-8')('replace')
+                data = self._decoders[stream].decode(''.join(chunks))
+                if not data:
+                    continue
+                offset = self._offsets.get(stream, 0)
+                job_output_append(self.session, self.job_id, stream, offset, data, False)
+                self._offsets[stream] = offset + len(data.encode('utf-8'))
+            self.session.commit()
+        except Exception, e:
+            # Streaming is only for watching, the result is still stored at the end.
+            self._failed = True
+            self.logger.warning('Failed to write the output of the running command. Streaming is stopped. - job_id=%d : %s'
+                                % (self.job_id, str(e.args)))
+            if not self.session is None:
+                self.session.rollback()
+
+        self._pending = {}
+        self._pending_size = 0
+        self._last = time.time()
+
+    def close(self):
+        self._pending = {}
+        self._pending_size = 0
+        if not self.session is None:
+            self.session.close()
+            self.session = None
+
+class JobGraph:
+    """Dependencies among the jobs of a jobgroup. (Job.depends)
+    Keeps which jobs were started and how they ended, and tells which ones
+    may start next. With failfast, no job is started once one failed.
+    """
+    def __init__(self, m_jobs, depends, failfast=True):
+        """
+        @param m_jobs: Jobs, ties are started in this order
+        @param depends: {job_id: [job_id, ...]} the jobs each one waits for
+        """
+        self.m_jobs = m_jobs
+        self.depends = depends
+        self.failfast = failfast
+        self.sorted = self._sort()
+        self.started = set()
+        self.ended = {} #: job_id: True=Normal end, False=Failed
+        self.failed = False
+
+    def _sort(self):
+        """Topological order of the jobs."""
+        ret = []
+        done = set()
+        rest = list(self.m_jobs)
+        while rest:
+            for m_job in rest:
+                if self._is_ready(m_job, done) is True:
+                    break
+            else:
+                raise SilhouetteWorkerException('The depends of the jobs are circular. - job_id=%s'
+                                                % [m_job.id for m_job in rest])
+            rest.remove(m_job)
+            done.add(m_job.id)
+            ret.append(m_job)
+        return ret
+
+    def _is_ready(self, m_job, done):
+        for job_id in self.depends[m_job.id]:
+            if (job_id in done) is False:
+                return False
+        return True
+
+    def ready(self):
+        """Jobs that may start now, in topological order."""
+        if self.failfast is True and self.failed is True:
+            return []
+        done = set([job_id for (job_id, ret) in self.ended.items()
+                    if ret is True or self.failfast is False])
+        return [m_job for m_job in self.sorted
+                if (m_job.id in self.started) is False and self._is_ready(m_job, done) is True]
+
+    def running(self):
+        return len(self.started) - len(self.ended)
+
+    def start(self, m_job):
+        self.started.add(m_job.id)
+
+    def end(self, m_job, ret):
+        self.ended[m_job.id] = ret
+        if ret is False:
+            self.failed = True
+
+    def is_ok(self):
+        """All the jobs ended normally."""
+        return self.failed is False and len(self.ended) == len(self.m_jobs)
+
+    def rollback_graph(self, m_jobs):
+        """JobGraph of the rollbacks of m_jobs, some of the jobs of this graph.
+        A job is rolled back after the jobs depending on it, also through
+        jobs that are not rolled back. A failed rollback does not stop the
+        others.
+        """
+        dependents = {}
+        for m_job in self.m_jobs:
+            dependents[m_job.id] = []
+        for (job_id, depends) in self.depends.items():
+            for depend in depends:
+                dependents[depend].append(job_id)
+
+        job_ids = set([m_job.id for m_job in m_jobs])
+        depends = {}
+        for m_job in m_jobs:
+            depends[m_job.id] = []
+            rest = list(dependents[m_job.id])
+            seen = set()
+            while rest:
+                job_id = rest.pop()
+                if job_id in seen:
+                    continue
+                seen.add(job_id)
+                if job_id in job_ids:
+                    depends[m_job.id].append(job_id)
+                else:
+                    rest.extend(dependents[job_id])
+
+        m_jobs = list(m_jobs)
+        m_jobs.reverse() # The last job first.
+        return JobGraph(m_jobs, depends, False)
+
+def job_graph(m_jobs, serial=False):
+    """JobGraph of the jobs.
+    When none of them has "depends" the jobs run in order: the result is
+    None, or with serial=True a JobGraph where each job waits for the one
+    before it.
+    """
+    depends = {} #: job_id: [job_id, ...]
+    is_graph = False
+    for m_job in m_jobs:
+        if not m_job.get_depends() is None:
+            is_graph = True
+            break
+
+    if is_graph is False:
+        if serial is False:
+            return None
+        prev = None
+        for m_job in m_jobs:
+            depends[m_job.id] = []
+            if not prev is None:
+                depends[m_job.id].append(prev.id)
+            prev = m_job
+        return JobGraph(m_jobs, depends)
+
+    orders = {} #: order: job_id
+    for m_job in m_jobs:
+        if orders.has_key(m_job.order) is True:
+            raise SilhouetteWorkerException('The order of the jobs is not unique. - job_id=%d : order=%d'
+                                            % (m_job.id, m_job.order))
+        orders[m_job.order] = m_job.id
+
+    for m_job in m_jobs:
+        depends[m_job.id] = []
+        if m_job.get_depends() is None:
+            continue
+        for order in m_job.get_depends():
+            if orders.has_key(order) is False or order == m_job.order:
+                raise SilhouetteWorkerException('There is no such job in depends. - job_id=%d : depends=%s'
+                                                % (m_job.id, m_job.depends))
+            depends[m_job.id].append(orders[order])
+    return JobGraph(m_jobs, depends)
+
 class Worker:
     """Worker Base class
     """
+    def getName(self):
+        return self.__class__.__name__
+
     def process(self):
         try:
             session = self._db.get_session()
@@ -60,12 +291,17 @@ class Worker:
                                                self._cf['env.uniqkey'])
             
             if self._m_jg is None: return False
-            jobgroup_update(session, self._m_jg, JOBGROUP_STATUS['RUN']) # JobGroup UPDATE
+            start_keeper(self._cf, self._db)
+            if jobgroup_claim(session, self._m_jg, claim_owner(self._cf),
+                              lease=lease_expire(self._cf)) is False: # JobGroup RUN
+                self.logger.info('The JobGroup was claimed by another performer. - jobgroup_id=%d' % self._jobgroup_id)
+                return False
             _m_jobs = job_findbyjobgroup_id(session, self._jobgroup_id, False) # order asc
 
             # action
             ret = False
             err = False
+            retry = False
             try:
                 ret = self._action(session, _m_jobs)
             except Exception, e:
@@ -82,6 +318,10 @@ class Worker:
                     if ret is True:
                         # normal
                         jobgroup_update(session, self._m_jg, JOBGROUP_STATUS['OK'])
+                    elif self._is_retry(_m_jobs) is True:
+                        # retry
+                        self._retry(session)
+                        retry = True
                     else:
                         # rollback
                         jobgroup_update(session, self._m_jg, JOBGROUP_STATUS['NG']) # JobGroup UPDATE
@@ -96,7 +336,8 @@ class Worker:
             finally:
                 # finish
                 try:
-                    self._finish()
+                    if retry is False:
+                        self._finish()
                 except Exception, e:
                     self.logger.info('Failed to perform the finish action. Exceptions are not expected. - jobgroup_id=%d : %s'
                                  % (self._jobgroup_id, str(e.args)))
@@ -106,6 +347,62 @@ class Worker:
             self.logger.debug('close database session, session=%s' % session)
             session.close()
 
+    def _is_retry(self, m_jobs):
+        """Whether all the failed jobs are to be retried. (Job.max_retries)"""
+        if not self._retries:
+            return False
+        for m_job in m_jobs:
+            if m_job.status in (ACTION_STATUS['NG'], ACTION_STATUS['WHITELIST']) \
+                   and (m_job in self._retries) is False:
+                return False
+        return True
+
+    def _retry(self, session):
+        """Queue the jobgroup again instead of rolling it back. It runs again
+        after the longest backoff of the failed jobs, from them on.
+        The slot of the performer is free in the meantime.
+        """
+        delay = 0
+        for m_job in self._retries:
+            delay = max(delay, m_job.retry_backoff * (2 ** m_job.retries))
+            m_job.retries += 1
+            job_update(session, m_job, ACTION_STATUS['PEND'], False) # Job UPDATE
+        delay = min(delay, self._cf['job.retry.backoff.max'])
+        run_after = datetime.datetime.now() + datetime.timedelta(seconds=delay)
+        jobgroup_retry(session, self._m_jg, run_after)
+        self.logger.info('The JobGroup is queued again to retry the failed jobs. - jobgroup_id=%d : job_id=%s, run_after=%s'
+                         % (self._jobgroup_id, [m_job.id for m_job in self._retries], run_after))
+
+    def _output_sink(self, job_id, prefix):
+        if self._cf['job.output.flush.interval'] <= 0:
+            return None # streaming off
+        return OutputSink(self._db, job_id, prefix,
+                          self._cf['job.output.flush.interval'],
+                          self._cf['job.output.flush.size'])
+
+    def _spool_output(self, m_job, prefix, proc_info):
+        """Outputs larger than "job.output.spool.threshold" go to a compressed
+        file in "job.output.spool.path". The job row keeps the first
+        "job.output.spool.preview" bytes and the file path.
+        A spool file of an earlier run (retry) which is not written again is
+        removed.
+        """
+        spool_dir = self._cf['job.output.spool.path']
+        for name in ('stdout', 'stderr'):
+            data = proc_info[name]
+            if is_empty(spool_dir) is False and self._cf['job.output.spool.threshold'] < len(data):
+                try:
+                    proc_info['%s_spool' % name] = write_output(spool_dir, m_job.id,
+                                                                '%s_%s' % (prefix, name), data)
+                    proc_info[name] = data[:self._cf['job.output.spool.preview']]
+                except (IOError, OSError), e:
+                    self.logger.warning('Failed to write the spool file. The output is stored in the database. - job_id=%d : %s'
+                                        % (m_job.id, str(e.args)))
+
+            path = getattr(m_job, '%s_%s_spool' % (prefix, name))
+            if is_empty(path) is False and path != proc_info.get('%s_spool' % name):
+                remove_output(path)
+
     def _action(self, session, m_jobs):
         raise SilhouetteWorkerException('Please override this method.')
     
@@ -113,52 +410,62 @@ class Worker:
         raise SilhouetteWorkerException('Please override this method.')
 
     def _finish(self):
+        lcmd = self._finish_command()
+        if lcmd is None:
+            return False # No finish Command
+
         proc = None
         proc_info = []
+        try:
+            try:
+                (proc, proc_info) = popen(lcmd,
+                                          self._cf['job.popen.timeout'],
+                                          self._cf['job.popen.waittime'],
+                                          self._cf['job.popen.env.lang'],
+                                          )
+            except OSError, oe:
+                self.logger.info('finish command system failed!! jobgroup_id=%d : cmd=%s'
+                                  % (self._m_jg.id, self._m_jg.finish_command))
+                raise oe
+        finally:
+            kill_proc(proc)
+
+        return self._finish_result(proc_info)
+
+    def _finish_command(self):
+        """Returns the split finish command, or None when there is nothing
+        to run (no command, or not in the whitelist).
+        """
         cmd = self._m_jg.finish_command
 
         if is_empty(cmd):
             self.logger.debug('finish command not running!!- jobgroup_id=%d' % (self._m_jg.id))
-            return False # No finish Command
-        else:
-            try:
-                self.logger.info('finish command running!! - jobgroup_id=%d : cmd=%s'
-                                  % (self._m_jg.id, cmd))
+            return None # No finish Command
 
-                lcmd = split_shell_command(cmd)
+        self.logger.info('finish command running!! - jobgroup_id=%d : cmd=%s'
+                          % (self._m_jg.id, cmd))
 
-                if self.chk_whitelist(lcmd[0]):
-                    try:
-                        (proc, proc_info) = popen(lcmd,
-                                                  self._cf['job.popen.timeout'],
-                                                  self._cf['job.popen.waittime'],
-                                                  self._cf['job.popen.env.lang'],
-                                                  )
-                        self.logger.debug('Of commands executed stdout=%s' % proc_info['stdout'])
-                        self.logger.debug('Of commands executed stderr=%s' % proc_info['stderr'])
-                        
-                    except OSError, oe:
-                        self.logger.info('finish command system failed!! jobgroup_id=%d : cmd=%s'
-                                          % (self._m_jg.id, cmd))
-                        raise oe
-
-                    if proc_info['r_code'] == 0:
-                        self.logger.info('finish command successful!! - jobgroup_id=%d : cmd=%s'
-                                          % (self._m_jg.id, cmd))
-                    else:
-                        self.logger.info('finish command failed!! - jobgroup_id=%d : cmd=%s'
-                                      % (self._m_jg.id, cmd))
-                    return True
+        lcmd = split_shell_command(cmd)
+        if self.chk_whitelist(lcmd[0]):
+            return lcmd
 
-                else:
-                    # whitelist
-                    self.logger.info('Tried to run the rollback command that is not registered in the whitelist. - jobgroup_id=%d : cmd=%s'
-                                      % (self._m_jg.id, cmd))
-                    
-            finally:
-                kill_proc(proc)
+        # whitelist
+        self.logger.info('Tried to run the rollback command that is not registered in the whitelist. - jobgroup_id=%d : cmd=%s'
+                          % (self._m_jg.id, cmd))
+        return None
 
+    def _finish_result(self, proc_info):
+        cmd = self._m_jg.finish_command
+        self.logger.debug('Of commands executed stdout=%s' % proc_info['stdout'])
+        self.logger.debug('Of commands executed stderr=%s' % proc_info['stderr'])
 
+        if proc_info['r_code'] == 0:
+            self.logger.info('finish command successful!! - jobgroup_id=%d : cmd=%s'
+                              % (self._m_jg.id, cmd))
+        else:
+            self.logger.info('finish command failed!! - jobgroup_id=%d : cmd=%s'
+                          % (self._m_jg.id, cmd))
+        return True
 
     def chk_whitelist(self, cmd):
         flag = self._cf['job.whitelist.flag'].strip()
@@ -189,131 +496,565 @@ class SimpleWorker(Worker):
         self._cf = cf
         self._db = db
         self._jobgroup_id = jobgroup_id
+        self._retries = [] #: Failed jobs to retry
         self.logger = logging.getLogger('pysilhouette.worker.simpleworker')
 
     def _action(self, session, m_jobs):
+        graph = self._action_graph(m_jobs)
+        if not graph is None:
+            return self._run_graph(session, graph, self._cf['job.parallel.size'], 'action')
+
         ret = True
         for m_job in m_jobs: # job(N) execute
-            job_update(session, m_job, ACTION_STATUS['RUN']) # Job UPDATE
+            if m_job.status == ACTION_STATUS['OK']:
+                continue # Done before a retry.
+
+            lcmd = self._action_command(session, m_job)
+            if lcmd is None:
+                ret = False
+                break
+
             proc = None
             proc_info = []
+            sink = self._output_sink(m_job.id, 'action')
             try:
-                cmd = m_job.action_command
-                self.logger.info('action command running!!- jobgroup_id=%d : cmd=%s'
-                                  % (m_job.id, cmd))
+                try:
+                    (proc, proc_info) = popen(cmd=lcmd,
+                                              timeout=self._cf['job.popen.timeout'],
+                                              waittime=self._cf['job.popen.waittime'],
+                                              lang=self._cf['job.popen.env.lang'],
+                                              limit=self._cf['job.popen.output.limit'],
+                                              job_id=m_job.id,
+                                              sink=sink,
+                                              )
+                except OSError, oe:
+                    self.logger.info('action command system failed!! job_id=%d : cmd=%s'
+                                      % (m_job.id, m_job.action_command))
+                    raise oe
+            finally:
+                kill_proc(proc)
+                if not sink is None:
+                    sink.close()
 
-                lcmd = split_shell_command(cmd)
-                if self.chk_whitelist(lcmd[0]):
-                    try:
-                        (proc, proc_info) = popen(cmd=lcmd,
-                                                  timeout=self._cf['job.popen.timeout'],
-                                                  waittime=self._cf['job.popen.waittime'],
-                                                  lang=self._cf['job.popen.env.lang'],
-                                                  limit=self._cf['job.popen.output.limit'],
-                                                  job_id=m_job.id,
-                                                  )
-
-                        self.logger.debug('Of commands executed stdout=%s' % proc_info['stdout'])
-                        self.logger.debug('Of commands executed stderr=%s' % proc_info['stderr'])
-
-                        if self._cf['job.popen.output.limit'] < len(proc_info['stdout']):
-                            self.logger.info("There was a limit beyond stdout output. Information-processing is truncated beyond the limit. - limit=%d, stdout=%d" \
-                                             % (self._cf['job.popen.output.limit'], len(proc_info['stdout'])))
-
-                        if self._cf['job.popen.output.limit'] < len(proc_info['stderr']):
-                            self.logger.info("There was a limit beyond stderr output. Information-processing is truncated beyond the limit. - limit=%d, stderr=%d" \
-                                             % (self._cf['job.popen.output.limit'], len(proc_info['stderr'])))
-                            
-
-                    except OSError, oe:
-                        self.logger.info('action command system failed!! job_id=%d : cmd=%s'
-                                          % (m_job.id, cmd))
-                        raise oe
-
-                    job_result_action(session, m_job, proc_info) # Job result UPDATE
-
-                    if proc_info['r_code'] == 0: # Normal end
-                        self.logger.info('action command was successful!! job_id=%d : cmd=%s'
-                                          % (m_job.id, cmd))
-                        job_update(session, m_job, ACTION_STATUS['OK']) # Job UPDATE
-                    else: # Abnormal termination
-                        self.logger.info('action command failed!! job_id=%d : cmd=%s'
-                                          % (m_job.id, cmd))
-                        job_update(session, m_job, ACTION_STATUS['NG']) # Job UPDATE
-                        ret = False
-                        break
+            if self._action_result(session, m_job, sink, proc_info) is False:
+                ret = False
+                break
+                
+        return ret
+
+    def _action_graph(self, m_jobs):
+        """job_graph of the actions. Jobs that ended normally before a retry
+        are already done. "retry_codes" is checked here too, before any
+        command runs."""
+        for m_job in m_jobs:
+            m_job.get_retry_codes()
+        graph = job_graph(m_jobs)
+        if not graph is None:
+            for m_job in m_jobs:
+                if m_job.status == ACTION_STATUS['OK']:
+                    graph.start(m_job)
+                    graph.end(m_job, True)
+        return graph
+
+    def _run_graph(self, session, graph, size, phase):
+        """Run the "phase" (action or rollback) of the jobs of the graph, each
+        as soon as the graph lets it, up to "size" at the same time.
+        The commands run on threads, and the results are written here, in
+        one commit for those that ended together. Once nothing is running
+        the graph is done: after an action failed, the running jobs are
+        waited for and no other job is started.
+        """
+        if phase == 'action':
+            command = self._action_command
+            result = self._action_result
+        else:
+            command = self._rollback_command
+            result = self._rollback_result
+
+        results = Queue.Queue()
+        error = None
+        while True:
+            ready = graph.ready()
+            if ready and graph.running() < size:
+                m_job = ready[0]
+                graph.start(m_job)
+                lcmd = command(session, m_job)
+                if lcmd is None:
+                    graph.end(m_job, False)
                 else:
-                    # whitelist error
-                    self.logger.info('Tried to run the action command that is not registered in the whitelist. job_id=%d : cmd=%s'
-                                      % (m_job.id, cmd))
-                    m_job.action_stderr = "Command is not registered to run the whitelist."
-                    job_update(session, m_job, ACTION_STATUS['WHITELIST']) # Job UPDATE
+                    th = threading.Thread(target=self._run_job,
+                                          args=(m_job, m_job.id, getattr(m_job, '%s_command' % phase),
+                                                phase, lcmd, results))
+                    th.setDaemon(1)
+                    th.start()
+                continue
+
+            if graph.running() <= 0:
+                break
+
+            (m_job, sink, proc_info, e) = results.get()
+            if e is None:
+                try:
+                    ret = result(session, m_job, sink, proc_info)
+                    if results.empty() is True:
+                        session.commit()
+                except Exception, e:
                     ret = False
-                    break
-                    
+            else:
+                ret = False
+            if not e is None and error is None:
+                error = e # Raised once the running jobs are done.
+            graph.end(m_job, ret)
+
+        session.commit()
+        if not error is None:
+            raise error
+        return graph.is_ok()
+
+    def _run_job(self, m_job, job_id, cmd, phase, lcmd, results):
+        """Thread of one job of _run_graph.
+        m_job is not touched here, it belongs to the session of the worker.
+        """
+        proc = None
+        env_job_id = None
+        if phase == 'action':
+            env_job_id = job_id
+        sink = self._output_sink(job_id, phase)
+        try:
+            try:
+                (proc, proc_info) = popen(cmd=lcmd,
+                                          timeout=self._cf['job.popen.timeout'],
+                                          waittime=self._cf['job.popen.waittime'],
+                                          lang=self._cf['job.popen.env.lang'],
+                                          limit=self._cf['job.popen.output.limit'],
+                                          job_id=env_job_id,
+                                          sink=sink,
+                                          )
             finally:
                 kill_proc(proc)
-                
-        return ret
+                if not sink is None:
+                    sink.close()
+            results.put((m_job, sink, proc_info, None))
+        except Exception, e:
+            self.logger.info('%s command system failed!! job_id=%d : cmd=%s'
+                             % (phase, job_id, cmd))
+            results.put((m_job, None, None, e))
+
+    def _action_command(self, session, m_job):
+        """Start of the action of one job.
+        Returns the split command, or None when it is not in the whitelist
+        (the job status is set).
+        """
+        job_update(session, m_job, ACTION_STATUS['RUN']) # Job UPDATE
+        cmd = m_job.action_command
+        self.logger.info('action command running!!- jobgroup_id=%d : cmd=%s'
+                          % (m_job.id, cmd))
+
+        lcmd = split_shell_command(cmd)
+        if self.chk_whitelist(lcmd[0]):
+            return lcmd
+
+        # whitelist error
+        self.logger.info('Tried to run the action command that is not registered in the whitelist. job_id=%d : cmd=%s'
+                          % (m_job.id, cmd))
+        m_job.action_stderr = "Command is not registered to run the whitelist."
+        job_update(session, m_job, ACTION_STATUS['WHITELIST'], False) # Job UPDATE
+        return None
+
+    def _action_result(self, session, m_job, sink, proc_info):
+        """End of the action of one job. Returns True when it succeeded.
+        """
+        cmd = m_job.action_command
+        self.logger.debug('Of commands executed stdout=%s' % proc_info['stdout'])
+        self.logger.debug('Of commands executed stderr=%s' % proc_info['stderr'])
+
+        if self._cf['job.popen.output.limit'] < proc_info['stdout_size']:
+            self.logger.info("There was a limit beyond stdout output. Information-processing is truncated beyond the limit. - limit=%d, stdout=%d" \
+                             % (self._cf['job.popen.output.limit'], proc_info['stdout_size']))
+
+        if self._cf['job.popen.output.limit'] < proc_info['stderr_size']:
+            self.logger.info("There was a limit beyond stderr output. Information-processing is truncated beyond the limit. - limit=%d, stderr=%d" \
+                             % (self._cf['job.popen.output.limit'], proc_info['stderr_size']))
+
+        if sink and sink.is_written():
+            job_output_delete(session, m_job.id, sink.streams(), False)
+        # The result and the status are committed together with the
+        # next job (RUN), or with the status of the JobGroup. (process)
+        self._spool_output(m_job, 'action', proc_info)
+        job_result_action(session, m_job, proc_info, False) # Job result UPDATE
+
+        if proc_info['r_code'] == 0: # Normal end
+            self.logger.info('action command was successful!! job_id=%d : cmd=%s'
+                              % (m_job.id, cmd))
+            job_update(session, m_job, ACTION_STATUS['OK'], False) # Job UPDATE
+            return True
+        else: # Abnormal termination
+            self.logger.info('action command failed!! job_id=%d : cmd=%s'
+                              % (m_job.id, cmd))
+            job_update(session, m_job, ACTION_STATUS['NG'], False) # Job UPDATE
+            if m_job.retries < m_job.max_retries:
+                codes = m_job.get_retry_codes()
+                if codes is None or proc_info['r_code'] in codes:
+                    self._retries.append(m_job)
+            return False
     
     def _rollback(self, session, m_jobs):
-        for m_job in m_jobs:
+        self._run_graph(session, self._rollback_graph(m_jobs),
+                        self._cf['job.rollback.parallel.size'], 'rollback')
 
-            if m_job.is_rollback() and m_job.status in (ACTION_STATUS['RUN'],
-                                                        ACTION_STATUS['OK'],
-                                                        ACTION_STATUS['NG']):
-                # rollback exec
-                proc = None
-                proc_info = []
-                try:
-                    cmd = m_job.rollback_command
-                    self.logger.info('rollback command running!!- jobgroup_id=%d : cmd=%s'
-                                      % (m_job.id, cmd))
+    def _rollback_graph(self, m_jobs):
+        """JobGraph of the rollbacks. The last job is rolled back first, and
+        jobs that do not depend on each other (Job.depends) at the same
+        time, up to job.rollback.parallel.size.
+        """
+        m_rollbacks = [m_job for m_job in m_jobs if self._is_rollback(m_job)]
+        return job_graph(m_jobs, True).rollback_graph(m_rollbacks)
 
-                    lcmd = split_shell_command(cmd)
-                    
-                    if self.chk_whitelist(lcmd[0]):
-                        try:
-                            (proc, proc_info) = popen(cmd=lcmd,
-                                                      timeout=self._cf['job.popen.timeout'],
-                                                      waittime=self._cf['job.popen.waittime'],
-                                                      lang=self._cf['job.popen.env.lang'],
-                                                      limit=self._cf['job.popen.output.limit'],
-                                                      )
-
-                            self.logger.debug('Of commands executed stdout=%s' % proc_info['stdout'])
-                            self.logger.debug('Of commands executed stderr=%s' % proc_info['stderr'])
-
-                        except OSError, oe:
-                            self.logger.info('rollback command system failed!! job_id=%d : cmd=%s'
-                                          % (m_job.id, cmd))
-                            raise oe
-                    
-                        job_result_rollback(session, m_job, proc_info) # Job result UPDATE
-                        if proc_info['r_code'] == 0: # Normal end
-                            self.logger.info('rollback command was successful!! job_id=%d : cmd=%s'
-                                              % (m_job.id, cmd))
-                            job_update(session, m_job, ROLLBACK_STATUS['OK']) # Job UPDATE
-                        else: # Abnormal termination
-                            self.logger.info('rollback command failed!! job_id=%d : cmd=%s'
-                                              % (m_job.id, cmd))
-                            job_update(session, m_job, ROLLBACK_STATUS['NG']) # Job UPDATE
+    def _is_rollback(self, m_job):
+        if m_job.is_rollback() and m_job.status in (ACTION_STATUS['RUN'],
+                                                    ACTION_STATUS['OK'],
+                                                    ACTION_STATUS['NG']):
+            return True
+        self.logger.debug('Does not rollback the process. - job_id=%d : status=%s'
+                          % (m_job.id, m_job.status))
+        return False
 
-                    else:
-                        # whitelist error
-                        self.logger.info('Tried to run the rollback command that is not registered in the whitelist. job_id=%d : cmd=%s'
-                                          % (m_job.id, cmd))
-                        m_job.rollback_stderr = "Command is not registered to run the whitelist."
-                        job_update(session, m_job, ROLLBACK_STATUS['WHITELIST']) # Job UPDATE
+    def _rollback_command(self, session, m_job):
+        """Start of the rollback of one job.
+        Returns the split command, or None when it is not in the whitelist
+        (the job status is set).
+        """
+        cmd = m_job.rollback_command
+        self.logger.info('rollback command running!!- jobgroup_id=%d : cmd=%s'
+                          % (m_job.id, cmd))
 
-                finally:
-                    kill_proc(proc)
-            else:
-                self.logger.debug('Does not rollback the process. - job_id=%d : status=%s'
-                                  % (m_job.id, m_job.status))
+        lcmd = split_shell_command(cmd)
+        if self.chk_whitelist(lcmd[0]):
+            return lcmd
+
+        # whitelist error
+        self.logger.info('Tried to run the rollback command that is not registered in the whitelist. job_id=%d : cmd=%s'
+                          % (m_job.id, cmd))
+        m_job.rollback_stderr = "Command is not registered to run the whitelist."
+        job_update(session, m_job, ROLLBACK_STATUS['WHITELIST'], False) # Job UPDATE
+        return None
+
+    def _rollback_result(self, session, m_job, sink, proc_info):
+        """End of the rollback of one job. Returns True when it succeeded.
+        """
+        cmd = m_job.rollback_command
+        self.logger.debug('Of commands executed stdout=%s' % proc_info['stdout'])
+        self.logger.debug('Of commands executed stderr=%s' % proc_info['stderr'])
+
+        if sink and sink.is_written():
+            job_output_delete(session, m_job.id, sink.streams(), False)
+        # Committed together with the rollbacks that ended at the same time.
+        self._spool_output(m_job, 'rollback', proc_info)
+        job_result_rollback(session, m_job, proc_info, False) # Job result UPDATE
+        if proc_info['r_code'] == 0: # Normal end
+            self.logger.info('rollback command was successful!! job_id=%d : cmd=%s'
+                              % (m_job.id, cmd))
+            job_update(session, m_job, ROLLBACK_STATUS['OK'], False) # Job UPDATE
+            return True
+        else: # Abnormal termination
+            self.logger.info('rollback command failed!! job_id=%d : cmd=%s'
+                              % (m_job.id, cmd))
+            job_update(session, m_job, ROLLBACK_STATUS['NG'], False) # Job UPDATE
+            return False
 
 # --
 import threading
+import Queue
+
+def run_jobgroup(cf, db, jobgroup_id, logger, name):
+    """Run one jobgroup with SimpleWorker.
+    An unexpected exception leaves the jobgroup in APPERR.
+    """
+    try:
+        SimpleWorker(cf, db, jobgroup_id).process()
+    except Exception, e:
+        logger.error('%s - JobGroup execute failed. - jobgroup_id=%d : %s, JobGroup status=%s' \
+                     % (name, jobgroup_id, str(e.args), JOBGROUP_STATUS['APPERR']))
+        t_logger = logging.getLogger('pysilhouette_traceback')
+        t_logger.error(traceback.format_exc())
+        try:
+            session = db.get_session()
+            jobgroup_update(session,
+                            jobgroup_findbyid(session, jobgroup_id, cf['env.uniqkey']),
+                            JOBGROUP_STATUS['APPERR'])
+            session.close()
+        except:
+            logger.error('JobGroup failed to update. - jobgroup_id=%d : %s, update status=%s' \
+                         % (jobgroup_id, str(e.args), JOBGROUP_STATUS['APPERR']))
+            t_logger.error(traceback.format_exc())
+
+class WorkerPool:
+    """Fixed number of long-lived threads running the parallel jobgroups.
+    (AsynPerformer, asynperformer.thread.pool.size)
+
+    The jobgroup ids wait in a queue bounded by the pool size, so put()
+    never takes more work than there are threads. A jobgroup is in flight
+    from put() until its thread has finished it; callback is called after
+    each one so that the next jobgroup can be claimed at once.
+    """
+    def __init__(self, cf, db, size, callback=None):
+        self._cf = cf
+        self._db = db
+        self.size = size
+        self.callback = callback
+        self.logger = logging.getLogger('pysilhouette.worker.workerpool')
+        self.queue = Queue.Queue(size)
+        self.lock = threading.Lock()
+        self.inflight = set()
+        self.threads = []
+        for i in range(size):
+            th = threading.Thread(target=self._run, name='WorkerPool-%d' % i)
+            th.setDaemon(1)
+            th.start()
+            self.threads.append(th)
+
+    def busy(self):
+        """Number of jobgroups queued or running."""
+        self.lock.acquire()
+        try:
+            return len(self.inflight)
+        finally:
+            self.lock.release()
+
+    def free(self):
+        """Number of jobgroups the pool can take now."""
+        return self.size - self.busy()
+
+    def has(self, jobgroup_id):
+        """Whether the jobgroup is queued or running."""
+        self.lock.acquire()
+        try:
+            return jobgroup_id in self.inflight
+        finally:
+            self.lock.release()
+
+    def put(self, jobgroup_id):
+        """Queue a jobgroup. Returns False when the pool is full
+        or the jobgroup is already in flight.
+        """
+        self.lock.acquire()
+        try:
+            if jobgroup_id in self.inflight or self.size <= len(self.inflight):
+                return False
+            self.inflight.add(jobgroup_id)
+        finally:
+            self.lock.release()
+        self.queue.put(jobgroup_id)
+        self.logger.debug('Queued the JobGroup. - jobgroup_id=%d' % jobgroup_id)
+        return True
+
+    def _run(self):
+        name = threading.currentThread().getName()
+        while True:
+            jobgroup_id = self.queue.get()
+            if jobgroup_id is None: # stop
+                break
+            try:
+                run_jobgroup(self._cf, self._db, jobgroup_id, self.logger, name)
+            finally:
+                self._db.remove_session() # thread-local session
+                self.lock.acquire()
+                try:
+                    self.inflight.discard(jobgroup_id)
+                finally:
+                    self.lock.release()
+
+            if not self.callback is None:
+                try:
+                    self.callback(jobgroup_id)
+                except:
+                    t_logger = logging.getLogger('pysilhouette_traceback')
+                    t_logger.error(traceback.format_exc())
+
+    def stop(self, wait=True):
+        """Let the threads finish the queued jobgroups, then stop them."""
+        for th in self.threads:
+            self.queue.put(None)
+        if wait is True:
+            for th in self.threads:
+                th.join()
+
+class ProcessSlot:
+    """One pre-forked worker process of ProcessPool."""
+    def __init__(self, pid, task, done):
+        self.pid = pid
+        self.task = task # parent -> child, jobgroup ids
+        self.done = done # child -> parent, finished jobgroup ids
+        self.buf = ''
+        self.jobgroup_id = None
+
+class ProcessPool:
+    """Fixed number of pre-forked worker processes running the parallel
+    jobgroups. (AsynPerformer, asynperformer.executor=process)
+
+    Same interface as WorkerPool. Each child opens its own database engine
+    and runs one jobgroup at a time; the ids go down a pipe and come back
+    up another one when the jobgroup is finished. callback is called in
+    the child after each jobgroup. A child that dies is replaced on the
+    next put(), its jobgroup is left to the status it had in the database.
+    One found dead by put() itself is replaced at once.
+
+    The parent does not start any threads, so forking a replacement is safe.
+    """
+    def __init__(self, cf, db, size, callback=None):
+        self._cf = cf
+        self._db = db
+        self.size = size
+        self.callback = callback
+        self.logger = logging.getLogger('pysilhouette.worker.processpool')
+        self.processes = []
+        for i in range(size):
+            self.processes.append(self._spawn(i))
+
+    def _spawn(self, num):
+        task_r, task_w = os.pipe()
+        done_r, done_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # child
+            os.close(task_w)
+            os.close(done_r)
+            for slot in self.processes:
+                if not slot is None:
+                    os.close(slot.task)
+                    os.close(slot.done)
+            code = 0
+            try:
+                try:
+                    self._child(num, task_r, done_w)
+                except:
+                    t_logger = logging.getLogger('pysilhouette_traceback')
+                    t_logger.error(traceback.format_exc())
+                    code = 1
+            finally:
+                os._exit(code)
+
+        os.close(task_r)
+        os.close(done_w)
+        self.logger.info('Started the worker process. - pid=%d' % pid)
+        return ProcessSlot(pid, task_w, done_r)
+
+    def _child(self, num, task_r, done_w):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        name = 'ProcessPool-%d' % num
+        db = create_database(self._cf) # not the engine of the parent
+        task = os.fdopen(task_r, 'r', 0)
+        while True:
+            line = task.readline()
+            if not line: # parent closed the pipe
+                break
+            jobgroup_id = int(line)
+            try:
+                run_jobgroup(self._cf, db, jobgroup_id, self.logger, name)
+            finally:
+                db.remove_session()
+            os.write(done_w, '%d\n' % jobgroup_id)
+            if not self.callback is None:
+                self.callback(jobgroup_id)
+
+    def _collect(self):
+        """Read the finished jobgroup ids and reap the dead processes
+        without blocking.
+        """
+        alive = [slot for slot in self.processes if not slot is None]
+        if not alive:
+            return
+        r, w, x = select.select([slot.done for slot in alive], [], [], 0)
+        for slot in alive:
+            if not slot.done in r:
+                continue
+            data = os.read(slot.done, 512)
+            if data:
+                slot.buf += data
+                if '\n' in slot.buf:
+                    slot.buf = ''
+                    slot.jobgroup_id = None
+                continue
+
+            # EOF, the child is gone
+            self._reap(self.processes.index(slot))
+
+    def _reap(self, num):
+        """Wait for the dead process of the slot and free the slot."""
+        slot = self.processes[num]
+        self.logger.error('The worker process died. - pid=%d, jobgroup_id=%s' \
+                          % (slot.pid, slot.jobgroup_id))
+        try:
+            os.waitpid(slot.pid, 0)
+        except OSError:
+            pass
+        os.close(slot.task)
+        os.close(slot.done)
+        self.processes[num] = None
+
+    def busy(self):
+        """Number of jobgroups running."""
+        self._collect()
+        ret = 0
+        for slot in self.processes:
+            if not slot is None and not slot.jobgroup_id is None:
+                ret += 1
+        return ret
+
+    def free(self):
+        """Number of jobgroups the pool can take now."""
+        return self.size - self.busy()
+
+    def has(self, jobgroup_id):
+        """Whether the jobgroup is running."""
+        self._collect()
+        for slot in self.processes:
+            if not slot is None and slot.jobgroup_id == jobgroup_id:
+                return True
+        return False
+
+    def put(self, jobgroup_id):
+        """Hand a jobgroup to an idle process. Returns False when the pool
+        is full or the jobgroup is already running.
+        """
+        if self.has(jobgroup_id) is True:
+            return False
+        for i in range(self.size):
+            if self.processes[i] is None:
+                self.processes[i] = self._spawn(i)
+            slot = self.processes[i]
+            if slot.jobgroup_id is None:
+                try:
+                    os.write(slot.task, '%d\n' % jobgroup_id)
+                except OSError, e:
+                    if e.errno != errno.EPIPE:
+                        raise
+                    # Died after _collect(), hand it to a new one.
+                    self._reap(i)
+                    slot = self.processes[i] = self._spawn(i)
+                    os.write(slot.task, '%d\n' % jobgroup_id)
+                slot.jobgroup_id = jobgroup_id
+                self.logger.debug('Handed the JobGroup to the worker process. - pid=%d, jobgroup_id=%d' \
+                                  % (slot.pid, jobgroup_id))
+                return True
+        return False
+
+    def stop(self, wait=True):
+        """Let the processes finish their jobgroups, then stop them."""
+        for slot in self.processes:
+            if not slot is None:
+                os.close(slot.task) # EOF
+        if wait is True:
+            for slot in self.processes:
+                if not slot is None:
+                    try:
+                        os.waitpid(slot.pid, 0)
+                    except OSError:
+                        pass
+        for slot in self.processes:
+            if not slot is None:
+                os.close(slot.done)
+        self.processes[:] = []
 
 class ThreadQueue(threading.Thread):
     def __init__(self, request_queue, response_list, *args, **kwargs):
@@ -328,7 +1069,7 @@ class ThreadQueue(threading.Thread):
         ret = 0
         for th in self.response_list:
             if th[0].isAlive() is True:
-                ret =+ 1
+                ret += 1
         return ret
 
     def response_clean(self):
@@ -337,9 +1078,9 @@ class ThreadQueue(threading.Thread):
         while _size < _len:
             if self.response_list[_size][0].isAlive() is False:
                 self.response_list.pop(_size) # remove
-                _len =- 1
+                _len -= 1
             else:
-                _size =+ 1
+                _size += 1
         return len(self.response_list)
 
     def put(self, callable, *args, **kwargs):
@@ -364,22 +1105,44 @@ class ThreadWorker(threading.Thread, SimpleWorker):
     def run(self):
         self.logger = logging.getLogger('pysilhouette.worker.threadworker')
         try:
-            self.process()
-        except Exception, e:
-            self.logger.error('%s - JobGroup execute failed. - jobgroup_id=%d : %s, JobGroup status=%s' \
-                              % (self.getName(), self._jobgroup_id, str(e.args), JOBGROUP_STATUS['APPERR']))
-            t_logger = logging.getLogger('pysilhouette_traceback')
-            t_logger.error(traceback.format_exc())
-            try:
-                session = self._db.get_session()
-                jobgroup_update(session,
-                                jobgroup_findbyid(session, self._jobgroup_id, self._cf['env.uniqkey']),
-                                JOBGROUP_STATUS['APPERR'])
-                session.close()
-            except:
-                self.logger.error('JobGroup failed to update. - jobgroup_id=%d : %s, update status=%s' \
-                              % (self._jobgroup_id, str(e.args), JOBGROUP_STATUS['APPERR']))
-                t_logger.error(traceback.format_exc())
+            run_jobgroup(self._cf, self._db, self._jobgroup_id, self.logger, self.getName())
+        finally:
+            self._db.remove_session() # thread-local session
+
+class LaneWorker(threading.Thread):
+    """Runs the serial jobgroups of one lane in order, on its own thread.
+    (Performer with performer.worker.size > 1)
+    A job group queued again for a retry stops the lane, the rest of it
+    waits for the retry. The performer is woken up when the lane is done.
+    """
+    def __init__(self, cf, db, lane, jobgroup_ids):
+        threading.Thread.__init__(self)
+        self._cf = cf
+        self._db = db
+        self.lane = lane
+        self.jobgroup_ids = jobgroup_ids
+        self.logger = logging.getLogger('pysilhouette.worker.laneworker')
+
+    def run(self):
+        try:
+            for jobgroup_id in self.jobgroup_ids:
+                run_jobgroup(self._cf, self._db, jobgroup_id, self.logger,
+                             '%s(lane=%s)' % (self.getName(), self.lane))
+                if self._is_pending(jobgroup_id) is True:
+                    self.logger.info('The job group is queued again, the lane waits for it. - lane=%s, jobgroup_id=%d'
+                                     % (self.lane, jobgroup_id))
+                    break
+        finally:
+            self._db.remove_session() # thread-local session
+            notify(self._cf, JOBGROUP_TYPE['SERIAL'])
+
+    def _is_pending(self, jobgroup_id):
+        session = self._db.new_session()
+        try:
+            m_jg = jobgroup_findbyid(session, jobgroup_id, self._cf['env.uniqkey'])
+            return not m_jg is None and m_jg.status == JOBGROUP_STATUS['PEND']
+        finally:
+            session.close()
 
 def dummy_set_job(cf, number, action, rollback, finish, type, db=None):
     try:
@@ -416,9 +1179,12 @@ def dummy_set_job(cf, number, action, rollback, finish, type, db=None):
             jg.jobs.append(j)
             jgs.append(jg)
             
+        types = set([jg.type for jg in jgs])
         session.add_all(jgs)
         session.commit()
         session.close()
+        for type in types:
+            notify(cf, type) # Wake up the performer
         print >>sys.stdout, 'Insert JobGroup and Job. num=%d [OK]' % number
     except Exception, e:
         print >>sys.stderr, 'Failed to add JobGroup and Job.'
@@ -427,7 +1193,6 @@ def dummy_set_job(cf, number, action, rollback, finish, type, db=None):
 
 
 if __name__ == '__main__':
-    import Queue
     request_queue = Queue.Queue()
     #response_queue = Queue.Queue()
     response_list = []
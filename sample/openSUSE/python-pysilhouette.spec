@@ -89,6 +89,8 @@ python setup.py install --prefix=%{_prefix} --root=%{buildroot}
 
 # install binaries
 %{__install} -D -m0755 tools/psil-cleandb %{buildroot}%{_bindir}/psil-cleandb
+%{__install} -D -m0755 tools/psil-upgradedb %{buildroot}%{_bindir}/psil-upgradedb
+%{__install} -D -m0755 tools/psil-archive %{buildroot}%{_bindir}/psil-archive
 %{__install} -D -m0755 tools/psil-set %{buildroot}%{_bindir}/psil-set
 
 # create symlink for silhouette.py
@@ -148,6 +150,8 @@ sed -i -e "s,^env.uniqkey=@uniqkey@,env.uniqkey=`/usr/bin/uuidgen`," \
 %config(noreplace) %{_sysconfdir}/%{pyname}/whitelist.conf
 %{_sysconfdir}/init.d/%{pyname}
 %{_bindir}/psil-cleandb
+%{_bindir}/psil-upgradedb
+%{_bindir}/psil-archive
 %{_bindir}/psil-set
 %{_bindir}/%{pyname}
 %{_sbindir}/rc%{pyname}
@@ -73,6 +73,8 @@ install -c -m 644 sysconfig/%{__progd} $RPM_BUILD_ROOT/etc/sysconfig/%{__progd}
 popd
 
 install -c -m 744 tools/psil-cleandb $RPM_BUILD_ROOT%{_psi_bindir}
+install -c -m 744 tools/psil-upgradedb $RPM_BUILD_ROOT%{_psi_bindir}
+install -c -m 744 tools/psil-archive $RPM_BUILD_ROOT%{_psi_bindir}
 install -c -m 744 tools/psil-set $RPM_BUILD_ROOT%{_psi_bindir}
 
 chmod +x %{__app}/%{__prog}.py
@@ -146,6 +148,8 @@ fi
 %attr(0644, root, root) %config(noreplace) /etc/sysconfig/%{__progd}
 #%{_psi_bindir}/%{__prog}.py
 %{_psi_bindir}/psil-cleandb
+%{_psi_bindir}/psil-upgradedb
+%{_psi_bindir}/psil-archive
 %{_psi_bindir}/psil-set
 %dir /var/log/%{__app}
 %dir %{_psi_datadir}
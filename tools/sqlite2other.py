@@ -46,6 +46,7 @@ from optparse import OptionParser, OptionValueError
 
 try:
     import sqlalchemy
+    import sqlalchemy.orm
     import pysilhouette
 except ImportError, e:
     print >>sys.stderr, "".join(e.args)
@@ -60,7 +61,7 @@ warnings.filterwarnings("ignore", "", Warning, "", 0)
 
 from pysilhouette.prep import getopts, readconf, chkopts
 from pysilhouette.db import Database, reload_mappers
-from pysilhouette.db.model import JobGroup, Job
+from pysilhouette.db.model import JobGroup, Job, JOB_OUTPUT_COLUMNS
 
 usage = "%prog [options]"
 version = "%prog 0.1"
@@ -148,7 +149,8 @@ def main():
 
     try:
         input_session = input_db.get_session()
-        jobgroups= input_session.query(JobGroup).all()
+        jobgroups= input_session.query(JobGroup).options(
+            *[sqlalchemy.orm.undefer('jobs.%s' % c) for c in JOB_OUTPUT_COLUMNS]).all()
     except:
         raise
 
@@ -161,6 +163,12 @@ def main():
         _jobgroup.finish_command = j.finish_command
         _jobgroup.status = j.status
         _jobgroup.register = j.register
+        _jobgroup.priority = j.priority
+        _jobgroup.lane = j.lane
+        _jobgroup.owner = j.owner
+        _jobgroup.claimed = j.claimed
+        _jobgroup.lease = j.lease
+        _jobgroup.run_after = j.run_after
         _jobgroup.created = j.created
         _jobgroup.modified = j.modified
         for job in j.jobs:
@@ -171,6 +179,11 @@ def main():
             #_job.order = job.order
             #_job.action_command = job.action_command
             _job.rollback_command = job.rollback_command
+            _job.depends = job.depends
+            _job.max_retries = job.max_retries
+            _job.retry_backoff = job.retry_backoff
+            _job.retry_codes = job.retry_codes
+            _job.retries = job.retries
             _job.status = job.status
             _job.action_exit_code = job.action_exit_code
             _job.action_stdout = job.action_stdout
@@ -178,6 +191,10 @@ def main():
             _job.rollback_exit_code = job.rollback_exit_code
             _job.rollback_stdout = job.rollback_stdout
             _job.rollback_stderr = job.rollback_stderr
+            _job.action_stdout_spool = job.action_stdout_spool
+            _job.action_stderr_spool = job.action_stderr_spool
+            _job.rollback_stdout_spool = job.rollback_stdout_spool
+            _job.rollback_stderr_spool = job.rollback_stderr_spool
             _job.progress = job.progress
             _job.created = job.created
             _job.modified = job.modified